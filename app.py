@@ -4,25 +4,172 @@ llama.cpp Chat Frontend with Dynamic Model Switching
 Enhanced Flask web application with seamless model switching capability.
 """
 
+import argparse
+import atexit
+import copy
+import fcntl
+import hashlib
+import heapq
+import math
+import mimetypes
+import mmap
 import os
+import queue
 import sqlite3
 import requests
 import json
 import time
 import subprocess
+import tempfile
 import signal
+import socket
+import struct
 import glob
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, g
+import gzip
+import itertools
+import random
+import sys
+import threading
+import zlib
+import concurrent.futures
+from collections import Counter, defaultdict, deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import MappingProxyType
+from flask import (Flask, Response, render_template, request, jsonify, g, has_request_context,
+                   send_from_directory, url_for)
+from flask.json.provider import DefaultJSONProvider
 import logging
-
-# Configure logging
+import logging.handlers
+
+try:
+    import numpy as np
+except ImportError:  # Optional: only needed for semantic search
+    np = None
+
+try:
+    import zstandard
+except ImportError:  # Optional: message compression falls back to zlib
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # Optional: build-assets then only precompresses with gzip
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # Optional: fastest JSON backend
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # Optional: JSON backend when orjson is missing
+    ujson = None
+
+# Console logging until configure_logging() applies the "logging" config section
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# JSON for API responses and llama-server bodies: orjson, else ujson, else
+# the standard library (JSON_BACKEND=json|ujson|orjson picks one)
+JSON_BACKENDS = {'orjson': orjson, 'ujson': ujson, 'json': json}
+JSON_BACKEND = os.getenv('JSON_BACKEND', '')
+if not JSON_BACKENDS.get(JSON_BACKEND):
+    JSON_BACKEND = next(name for name, module in JSON_BACKENDS.items() if module)
+
+
+def _json_default(value):
+    """Values the JSON libraries do not encode themselves."""
+    if isinstance(value, (sqlite3.Row, Mapping)):
+        return dict(value)
+    # Dates, decimals, UUIDs and dataclasses as Flask encodes them
+    return DefaultJSONProvider.default(value)
+
+
+def json_bytes(value, sort_keys=False):
+    """Compact UTF-8 JSON of ``value`` from the fastest available library."""
+    if JSON_BACKEND == 'orjson':
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        try:
+            return orjson.dumps(value, default=_json_default,
+                                option=option | orjson.OPT_SORT_KEYS if sort_keys else option)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits: let the standard library try
+    elif JSON_BACKEND == 'ujson':
+        try:
+            return ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False,
+                               sort_keys=sort_keys, default=_json_default).encode('utf-8')
+        except (TypeError, OverflowError):
+            pass
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys,
+                      default=_json_default).encode('utf-8')
+
+
+def json_loads(data):
+    """Parse JSON text or bytes with the fastest available library."""
+    if JSON_BACKEND == 'orjson':
+        return orjson.loads(data)
+    if JSON_BACKEND == 'ujson':
+        return ujson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider using json_bytes() and json_loads().
+
+    Keys stay sorted like with Flask's provider; debug mode keeps its
+    indented output.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return json_bytes(obj, sort_keys=self.sort_keys).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_loads(s)
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_bytes(obj, sort_keys=self.sort_keys) + b'\n',
+                                        mimetype=self.mimetype)
+
+
+def stream_json(key, rows, batch_size=500, **fields):
+    """Yield the JSON object ``{key: [*rows], **fields}`` in chunks.
+
+    Large lists are encoded ``batch_size`` rows at a time as they are read
+    from a cursor, instead of being built in memory first.
+    """
+    yield b'{' + json_bytes(key) + b':['
+    rows = iter(rows)
+    separator = b''
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        yield separator + json_bytes(batch)[1:-1]
+        separator = b','
+    yield b']' + b''.join(b',' + json_bytes(name) + b':' + json_bytes(value)
+                          for name, value in fields.items()) + b'}\n'
+
+
+def post_json(url, payload, **kwargs):
+    """POST ``payload`` encoded by json_bytes() (llama-server requests)."""
+    return requests.post(url, data=json_bytes(payload),
+                         headers={'Content-Type': 'application/json'}, **kwargs)
+
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-this'
 app.config['THREADED'] = True
+app.json = FastJSONProvider(app)
 
 
 @app.errorhandler(404)
@@ -64,13 +211,18 @@ def handle_exception(e):
 # Load configuration from JSON file
 
 
+# config.json next to app.py unless CONFIG_PATH points elsewhere
+CONFIG_PATH = os.getenv('CONFIG_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'config.json'))
+
+
 def load_config():
     """Load configuration from config.json file."""
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+    config_path = CONFIG_PATH
     try:
         with open(config_path, 'r') as f:
             config = json.load(f)
-        logger.info("Configuration loaded from config.json")
+        logger.info(f"Configuration loaded from {config_path}")
         return config
     except FileNotFoundError:
         logger.warning(
@@ -104,7 +256,9 @@ def get_default_config():
             "use_mlock": True,
             "use_mmap": True,
             "num_thread": -1,
-            "num_gpu": 0
+            "num_gpu": 0,
+            "auto_tune": False,
+            "auto_tune_calibrate": False
         },
         "system_prompt": "Your name is Bhaai, a helpful, friendly, and knowledgeable AI assistant. You have a warm personality and enjoy helping users solve problems. You're curious about technology and always try to provide practical, actionable advice. You occasionally use light humor when appropriate, but remain professional and focused on being genuinely helpful.",
         "response_optimization": {
@@ -123,12 +277,393 @@ def get_default_config():
             "directory": "./models",
             "auto_detect": True,
             "default_model": None
+        },
+        "speculative": {
+            "enabled_by_default": False,
+            "max_draft_size_ratio": 0.25,
+            "draft_max": 16,
+            "draft_min": 1,
+            "draft_p_min": 0.75
+        },
+        "prefetch": {
+            "enabled": True,
+            "predictive": True,
+            "predict_count": 1,
+            "max_mb_per_second": 200,
+            "chunk_mb": 16,
+            "max_memory_fraction": 0.5
+        },
+        "health": {
+            "interval_seconds": 5,
+            "probe_timeout_seconds": 1,
+            "failure_threshold": 3,
+            "auto_restart": True,
+            "restart_backoff_seconds": 5,
+            "max_restart_backoff_seconds": 300,
+            "stable_seconds": 120,
+            "sse_keepalive_seconds": 15,
+            "max_event_streams": 4
+        },
+        "semantic_search": {
+            "enabled": False,
+            "model": None,
+            "port": 8081,
+            "ctx_size": 2048,
+            "threads": 2,
+            "batch_size": 32,
+            "max_chars": 2000,
+            "index_interval_seconds": 60,
+            "index_dir": None,
+            "default_mode": "hybrid",
+            "keyword_weight": 0.3
+        },
+        "compression": {
+            "enabled": True,
+            "algorithm": "zlib",
+            "level": 6,
+            "min_bytes": 1024,
+            "use_dictionary": False,
+            "dictionary_size": 65536
+        },
+        "archive": {
+            "enabled": False,
+            "idle_days": 180,
+            "directory": None,
+            "batch_size": 200,
+            "interval_hours": 24,
+            "search_archives": True
+        },
+        "summarization": {
+            "enabled": False,
+            "trigger_tokens": 2048,
+            "keep_recent_messages": 6,
+            "max_summary_tokens": 256
+        },
+        "resources": {
+            "sample_interval_seconds": 5,
+            "history_size": 720,
+            "check_memory_fit": True
+        },
+        "debug": {
+            "trace_buffer_size": 200,
+            "profile_sample_rate": 0.0,
+            "profile_interval_ms": 5,
+            "allow_profile_header": False
+        },
+        "http": {
+            "compression": True,
+            "compression_min_bytes": 1024,
+            "compression_level": 6
+        },
+        "config_reload": {
+            "enabled": True,
+            "interval_seconds": 2
+        },
+        "logging": {
+            "level": "INFO",
+            "file": "llamacpp_chat.log",
+            "max_size_mb": 50,
+            "backup_count": 3,
+            "format": "json",
+            "console": None,
+            "queue_size": 10000,
+            "max_message_chars": 2000,
+            "rate_limit_per_minute": 120
+        },
+        "rate_limits": {
+            "enabled": True,
+            "identity_header": "",
+            "requests_per_minute": 20,
+            "request_burst": 10,
+            "tokens_per_minute": 20000,
+            "token_burst": 50000,
+            "switches_per_hour": 20,
+            "switch_burst": 5,
+            "daily_token_quota": 0
+        },
+        "batch": {
+            "concurrency": 4,
+            "max_attempts": 3,
+            "directory": None
+        }
+    }
+
+
+def _freeze(value):
+    """Read-only copy of a JSON value: objects become mapping proxies, arrays tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    """JSON-serializable copy of a value frozen by _freeze()."""
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _config_value(data, path, default=None):
+    """Value at a dotted ``path`` of a config, or ``default``."""
+    for key in path.split('.'):
+        if not isinstance(data, Mapping) or key not in data:
+            return default
+        data = data[key]
+    return data
+
+
+def _config_leaves(data, prefix=''):
+    """Dotted path -> value of every setting in a config."""
+    leaves = {}
+    for key, value in data.items():
+        if isinstance(value, Mapping):
+            leaves.update(_config_leaves(value, f"{prefix}{key}."))
+        else:
+            leaves[f"{prefix}{key}"] = value
+    return leaves
+
+
+class ConfigSnapshot:
+    """One validated, read-only version of the configuration.
+
+    Values read for every generation are precomputed, so hot paths read
+    attributes of the snapshot they started with instead of doing nested
+    lookups in a config that may be swapped meanwhile.
+    """
+
+    # (dotted path, accepted types, check, description of a valid value)
+    RULES = (
+        ('system_prompt', str, None, 'text'),
+        ('models.directory', str, None, 'a path'),
+        ('timeouts.llamacpp_timeout', (int, float), lambda v: v > 0, 'a positive number'),
+        ('timeouts.llamacpp_connect_timeout', (int, float), lambda v: v > 0, 'a positive number'),
+        ('timeouts.model_switch_timeout', (int, float), lambda v: v > 0, 'a positive number'),
+        ('model_options.temperature', (int, float), lambda v: v >= 0, 'a number >= 0'),
+        ('model_options.top_p', (int, float), lambda v: 0 <= v <= 1, 'a number from 0 to 1'),
+        ('model_options.num_predict', int, None, 'an integer'),
+        ('model_options.num_ctx', int, lambda v: v > 0, 'a positive integer'),
+        ('model_options.repeat_penalty', (int, float), None, 'a number'),
+        ('model_options.stop', list, None, 'a list of strings'),
+        ('performance.context_history_limit', int, lambda v: v > 0, 'a positive integer'),
+        ('performance.batch_size', int, lambda v: v > 0, 'a positive integer'),
+        ('performance.num_thread', int, None, 'an integer'),
+        ('performance.num_gpu', int, None, 'an integer'),
+        ('response_optimization.stream', bool, None, 'true or false'),
+    )
+
+    def __init__(self, data, version):
+        ConfigSnapshot.validate(data)
+        self.data = _freeze(data)
+        self.version = version
+        self.digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+
+        options = data['model_options']
+        self.system_prompt = data['system_prompt']
+        self.history_limit = data['performance']['context_history_limit']
+        self.timeouts = (data['timeouts']['llamacpp_connect_timeout'],
+                         data['timeouts']['llamacpp_timeout'])
+        sampling = {
+            'stream': data['response_optimization']['stream'],
+            'temperature': options['temperature'],
+            'top_p': options['top_p'],
+            'max_tokens': options['num_predict'],
+            'stop': list(options['stop']),
+            'repeat_penalty': options['repeat_penalty'],
+            'cache_prompt': True
         }
+        if 'top_k' in options:
+            sampling['top_k'] = options['top_k']
+        self.sampling = MappingProxyType(sampling)
+
+    @staticmethod
+    def validate(data):
+        """Raise ValueError listing every invalid setting of ``data``."""
+        if not isinstance(data, dict):
+            raise ValueError("configuration must be a JSON object")
+        problems = []
+        missing = object()
+        for path, types, check, description in ConfigSnapshot.RULES:
+            value = _config_value(data, path, missing)
+            if value is missing:
+                problems.append(f"{path} is missing")
+            elif (not isinstance(value, types) or (isinstance(value, bool) and types is not bool)
+                  or (check is not None and not check(value))):
+                problems.append(f"{path} must be {description}, not {value!r}")
+        if problems:
+            raise ValueError('; '.join(problems))
+
+
+class ConfigWatcher:
+    """Reloads config.json when it changes, swapping in a new snapshot.
+
+    A changed file is validated before use; an invalid one is reported and
+    the running configuration kept. Requests in flight finish with the
+    snapshot they started with. Settings only read when llama-server or the
+    app starts are reported as pending a restart until that happens.
+    """
+
+    PATH = CONFIG_PATH
+
+    # Sections returned by GET /api/config
+    PUBLIC_SECTIONS = ('timeouts', 'model_options', 'performance', 'response_optimization')
+
+    # Settings that only take effect when llama-server (restarted on every
+    # model switch) or the app is restarted; a section name covers all of it
+    RESTART_SETTINGS = {
+        'llama-server': ('model_options.num_ctx', 'performance.num_thread',
+                         'performance.batch_size', 'performance.num_gpu', 'performance.use_mmap',
+                         'performance.use_mlock', 'performance.auto_tune',
+                         'performance.auto_tune_calibrate', 'speculative'),
+        'app': ('models.directory', 'debug', 'resources.history_size', 'health.enabled',
+                'archive.enabled', 'semantic_search.port', 'semantic_search.model',
+                'semantic_search.ctx_size', 'semantic_search.threads')
     }
 
+    _lock = threading.Lock()
+    _snapshot = None
+    _applied = {}
+    _file_state = None
+    _last_error = None
+    _thread = None
+
+    @staticmethod
+    def current():
+        """The active configuration snapshot."""
+        return ConfigWatcher._snapshot
+
+    @staticmethod
+    def initialize(data):
+        try:
+            snapshot = ConfigSnapshot(data, 1)
+        except ValueError as e:
+            logger.error(f"Invalid configuration: {e}, using defaults")
+            ConfigWatcher._last_error = str(e)
+            snapshot = ConfigSnapshot(get_default_config(), 1)
+        ConfigWatcher._snapshot = snapshot
+        ConfigWatcher._applied = {scope: snapshot for scope in ConfigWatcher.RESTART_SETTINGS}
+        ConfigWatcher._file_state = ConfigWatcher._stat()
+
+    @staticmethod
+    def _stat():
+        try:
+            stat = os.stat(ConfigWatcher.PATH)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    @staticmethod
+    def reload(force=False):
+        """Load config.json if it changed (or ``force``); returns the changed settings.
+
+        Raises ValueError, keeping the current snapshot, when the file is
+        not valid JSON or fails validation.
+        """
+        with ConfigWatcher._lock:
+            file_state = ConfigWatcher._stat()
+            if not force and file_state == ConfigWatcher._file_state:
+                return []
+            ConfigWatcher._file_state = file_state
+            previous = ConfigWatcher._snapshot
+            try:
+                with open(ConfigWatcher.PATH) as f:
+                    data = json.load(f)
+                if hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16] \
+                        == previous.digest:
+                    ConfigWatcher._last_error = None
+                    return []
+                snapshot = ConfigSnapshot(data, previous.version + 1)
+            except (OSError, ValueError) as e:
+                ConfigWatcher._last_error = str(e)
+                logger.error(f"Configuration not reloaded: {e}")
+                raise ValueError(str(e))
+            ConfigWatcher._snapshot = snapshot
+            ConfigWatcher._last_error = None
+
+        old, new = _config_leaves(previous.data), _config_leaves(snapshot.data)
+        changed = sorted(path for path in old.keys() | new.keys() if old.get(path) != new.get(path))
+        logger.info(f"Configuration version {snapshot.version} loaded, changed: {', '.join(changed)}")
+        if _config_value(previous.data, 'logging') != _config_value(snapshot.data, 'logging'):
+            configure_logging(snapshot.data.get('logging', {}))
+        return changed
+
+    @staticmethod
+    def mark_applied(scope, snapshot):
+        """Record that the settings of ``snapshot`` are in effect for ``scope``."""
+        ConfigWatcher._applied[scope] = snapshot
+
+    @staticmethod
+    def pending_restart():
+        """Changed settings that wait for a restart of llama-server or the app."""
+        current = ConfigWatcher._snapshot.data
+        pending = []
+        for scope, paths in ConfigWatcher.RESTART_SETTINGS.items():
+            applied = ConfigWatcher._applied[scope].data
+            for path in paths:
+                if _config_value(applied, path) != _config_value(current, path):
+                    pending.append({'setting': path, 'restart': scope})
+        return pending
+
+    @staticmethod
+    def get_status():
+        snapshot = ConfigWatcher._snapshot
+        return {
+            'version': snapshot.version,
+            'digest': snapshot.digest,
+            'loaded_at': snapshot.loaded_at,
+            'path': ConfigWatcher.PATH,
+            'watching': ConfigWatcher._thread is not None and ConfigWatcher._thread.is_alive(),
+            'last_error': ConfigWatcher._last_error,
+            'pending_restart': ConfigWatcher.pending_restart()
+        }
+
+    @staticmethod
+    def start():
+        """Poll config.json for changes when ``config_reload.enabled``."""
+        if not CONFIG.get('config_reload', {}).get('enabled', True):
+            return
+        if ConfigWatcher._thread and ConfigWatcher._thread.is_alive():
+            return
+        ConfigWatcher._thread = threading.Thread(
+            target=ConfigWatcher._run, name='config-watcher', daemon=True)
+        ConfigWatcher._thread.start()
+
+    @staticmethod
+    def _run():
+        while True:
+            time.sleep(CONFIG.get('config_reload', {}).get('interval_seconds', 2))
+            try:
+                ConfigWatcher.reload()
+            except ValueError:
+                pass  # Logged by reload(); the file is checked again when it changes
+            except Exception as e:
+                logger.error(f"Configuration watcher failed: {e}", exc_info=True)
+
+
+class LiveConfig(Mapping):
+    """Read-only view of the active configuration snapshot.
+
+    Code that needs several values that must agree should read them from one
+    ``ConfigWatcher.current()`` snapshot instead.
+    """
+
+    def __getitem__(self, key):
+        return ConfigWatcher._snapshot.data[key]
+
+    def __iter__(self):
+        return iter(ConfigWatcher._snapshot.data)
+
+    def __len__(self):
+        return len(ConfigWatcher._snapshot.data)
+
 
 # Load configuration
-CONFIG = load_config()
+ConfigWatcher.initialize(load_config())
+CONFIG = LiveConfig()
 
 # Configuration
 LLAMACPP_HOST = os.getenv('LLAMACPP_HOST', 'localhost')
@@ -137,13 +672,19 @@ LLAMACPP_API_URL = os.getenv(
     'LLAMACPP_API_URL', f'http://{LLAMACPP_HOST}:{LLAMACPP_PORT}')
 MODELS_DIR = os.getenv('MODELS_DIR', CONFIG['models']['directory'])
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'llamacpp_chat.db')
-LLAMACPP_TIMEOUT = CONFIG['timeouts']['llamacpp_timeout']
-LLAMACPP_CONNECT_TIMEOUT = CONFIG['timeouts']['llamacpp_connect_timeout']
-MODEL_SWITCH_TIMEOUT = CONFIG['timeouts']['model_switch_timeout']
 
 # PID file for llama.cpp server management
 LLAMACPP_PID_FILE = os.getenv('LLAMACPP_PID_FILE', 'llamacpp.pid')
 
+# Lock and state shared by all processes of the app (see LlamaCppManager)
+LLAMACPP_LOCK_FILE = os.getenv('LLAMACPP_LOCK_FILE', 'llamacpp.lock')
+LLAMACPP_STATE_FILE = os.getenv('LLAMACPP_STATE_FILE', 'llamacpp-state.json')
+
+# Version of SCHEMA and migrate_database() together, kept in PRAGMA
+# user_version; bump it with every change to either, or existing databases
+# are not migrated
+SCHEMA_VERSION = 1
+
 # Enhanced database schema with model tracking
 SCHEMA = '''
 CREATE TABLE IF NOT EXISTS conversations (
@@ -151,6 +692,7 @@ CREATE TABLE IF NOT EXISTS conversations (
     title TEXT NOT NULL,
     model TEXT NOT NULL,
     model_file TEXT,
+    active_leaf_id INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -158,21 +700,757 @@ CREATE TABLE IF NOT EXISTS conversations (
 CREATE TABLE IF NOT EXISTS messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     conversation_id INTEGER NOT NULL,
+    parent_id INTEGER REFERENCES messages (id),
     role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
     content TEXT NOT NULL,
+    content_encoding TEXT,
     model TEXT,
     model_file TEXT,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     response_time_ms INTEGER,
     estimated_tokens INTEGER,
+    prompt_tokens INTEGER,
+    cached_tokens INTEGER,
+    prompt_ms REAL,
+    prompt_per_second REAL,
+    predicted_ms REAL,
+    predicted_per_second REAL,
+    FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS usage_rollups (
+    granularity TEXT NOT NULL CHECK (granularity IN ('hour', 'day')),
+    bucket_start TEXT NOT NULL,
+    model_file TEXT NOT NULL DEFAULT '',
+    request_count INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    total_response_time_ms INTEGER NOT NULL DEFAULT 0,
+    max_response_time_ms INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket_start, model_file)
+);
+
+CREATE TABLE IF NOT EXISTS usage_latency_histogram (
+    granularity TEXT NOT NULL,
+    bucket_start TEXT NOT NULL,
+    model_file TEXT NOT NULL DEFAULT '',
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket_start, model_file, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS model_benchmarks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model_file TEXT NOT NULL,
+    size_bytes INTEGER,
+    load_time_ms INTEGER,
+    prompt_tokens_per_second REAL,
+    generation_tokens_per_second REAL,
+    peak_rss_mb REAL,
+    prompts INTEGER,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS speculative_settings (
+    model_file TEXT PRIMARY KEY,
+    enabled INTEGER NOT NULL DEFAULT 0,
+    draft_model_file TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS speculative_stats (
+    model_file TEXT NOT NULL,
+    draft_model_file TEXT NOT NULL DEFAULT '',
+    generations INTEGER NOT NULL DEFAULT 0,
+    predicted_tokens INTEGER NOT NULL DEFAULT 0,
+    predicted_ms REAL NOT NULL DEFAULT 0,
+    draft_tokens INTEGER NOT NULL DEFAULT 0,
+    draft_accepted_tokens INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (model_file, draft_model_file)
+);
+
+CREATE TABLE IF NOT EXISTS model_switches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    from_model_file TEXT,
+    model_file TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    duration_ms INTEGER,
+    load_ms INTEGER,
+    residency_at_load REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS launch_tunings (
+    model_file TEXT NOT NULL,
+    host_id TEXT NOT NULL,
+    model_size INTEGER,
+    model_mtime INTEGER,
+    params TEXT NOT NULL,
+    calibrated INTEGER DEFAULT 0,
+    generation_tokens_per_second REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (model_file, host_id)
+);
+
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    covered_through_id INTEGER NOT NULL,
+    covered_count INTEGER NOT NULL,
+    source_hash TEXT NOT NULL,
+    summary_tokens INTEGER,
+    model_file TEXT,
+    generation_ms INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (conversation_id, version),
     FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
 );
 
+CREATE TABLE IF NOT EXISTS compression_dictionaries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    algorithm TEXT NOT NULL,
+    data BLOB NOT NULL,
+    sample_count INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS archived_conversations (
+    id INTEGER PRIMARY KEY,
+    title TEXT,
+    model TEXT,
+    model_file TEXT,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    message_count INTEGER,
+    archive_file TEXT NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    client_id TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    level REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (client_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS client_usage (
+    client_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    requests INTEGER DEFAULT 0,
+    rejected INTEGER DEFAULT 0,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    PRIMARY KEY (client_id, day, scope)
+);
+
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input_path TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    model_file TEXT,
+    concurrency INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    pid INTEGER,
+    total_items INTEGER DEFAULT 0,
+    completed_items INTEGER DEFAULT 0,
+    failed_items INTEGER DEFAULT 0,
+    current_model TEXT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_archived_conversations_updated ON archived_conversations(updated_at DESC);
 CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id);
 CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at DESC);
 CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
 '''
 
+# Upper bounds (inclusive) of the response time histogram buckets used by the
+# usage rollups. Anything slower lands in a final overflow bucket.
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000,
+                      20000, 30000, 60000, 120000, 180000)
+
+# Per-response timing breakdown reported by llama-server, stored on assistant
+# messages alongside the wall-clock response time
+MESSAGE_TIMING_COLUMNS = {
+    'prompt_tokens': 'INTEGER',
+    'cached_tokens': 'INTEGER',
+    'prompt_ms': 'REAL',
+    'prompt_per_second': 'REAL',
+    'predicted_ms': 'REAL',
+    'predicted_per_second': 'REAL'
+}
+
+# strftime formats that truncate a timestamp to the start of its rollup bucket
+ROLLUP_GRANULARITIES = {
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d'
+}
+
+
+# Default histogram buckets for request and generation latencies (seconds)
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                           5, 10, 30, 60, 120, 300)
+
+
+class MetricsRegistry:
+    """Low-overhead counters, gauges and histograms in Prometheus text format.
+
+    Every thread writes into its own shard, so recording a sample never takes
+    a lock. Shards of finished threads are folded into a retired total when
+    metrics are scraped or when too many shards pile up.
+    """
+
+    MAX_SHARDS = 256
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = defaultdict(float)
+        self._definitions = {}
+        self._gauges = {}
+        self._gauge_callbacks = {}
+
+    def counter(self, name, help_text):
+        self._definitions[name] = ('counter', help_text, None)
+
+    def gauge(self, name, help_text, callback=None):
+        self._definitions[name] = ('gauge', help_text, None)
+        if callback is not None:
+            self._gauge_callbacks[name] = callback
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS_SECONDS):
+        self._definitions[name] = ('histogram', help_text, tuple(buckets))
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = defaultdict(float)
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > self.MAX_SHARDS:
+                    self._compact()
+        return shard
+
+    def _compact(self):
+        """Fold shards of threads that have exited into the retired totals."""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for key, value in list(shard.items()):
+                    self._retired[key] += value
+        self._shards = live
+
+    def inc(self, name, labels=None, value=1):
+        """Increment a counter."""
+        self._shard()[(name, _label_key(labels), None)] += value
+
+    def set(self, name, value, labels=None):
+        """Set a gauge to an absolute value."""
+        self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, labels=None):
+        """Record one histogram sample."""
+        buckets = self._definitions[name][2]
+        label_key = _label_key(labels)
+        index = len(buckets)
+        for position, upper_bound in enumerate(buckets):
+            if value <= upper_bound:
+                index = position
+                break
+        shard = self._shard()
+        shard[(name, label_key, index)] += 1
+        shard[(name, label_key, 'sum')] += value
+
+    def total(self, name):
+        """Sum a counter across all label sets and shards."""
+        return sum(value for (metric, _, _), value in self._snapshot().items()
+                   if metric == name)
+
+    def _snapshot(self):
+        with self._lock:
+            self._compact()
+            totals = defaultdict(float, self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            for key, value in list(shard.items()):
+                totals[key] += value
+        return totals
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        for name, callback in self._gauge_callbacks.items():
+            try:
+                for labels, value in callback():
+                    self.set(name, value, labels)
+            except Exception as e:
+                logger.warning(f"Metrics gauge {name} failed: {e}")
+
+        samples = defaultdict(dict)
+        for (name, label_key, part), value in self._snapshot().items():
+            samples[name][(label_key, part)] = value
+        for (name, label_key), value in list(self._gauges.items()):
+            samples[name][(label_key, None)] = value
+
+        lines = []
+        for name, (metric_type, help_text, buckets) in sorted(self._definitions.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            values = samples.get(name, {})
+            if metric_type != 'histogram':
+                for (label_key, _), value in sorted(values.items()):
+                    lines.append(
+                        f"{name}{_format_labels(label_key)} {_format_value(value)}")
+                continue
+
+            for label_key in sorted({label_key for label_key, _ in values}):
+                cumulative = 0
+                for index, upper_bound in enumerate(buckets + (float('inf'),)):
+                    cumulative += values.get((label_key, index), 0)
+                    le = '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+                    lines.append(
+                        f"{name}_bucket{_format_labels(label_key + (('le', le),))} {_format_value(cumulative)}")
+                lines.append(
+                    f"{name}_sum{_format_labels(label_key)} {_format_value(values.get((label_key, 'sum'), 0))}")
+                lines.append(
+                    f"{name}_count{_format_labels(label_key)} {_format_value(cumulative)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(label_key):
+    if not label_key:
+        return ''
+    pairs = []
+    for key, value in label_key:
+        value = str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+METRICS = MetricsRegistry()
+METRICS.counter('llama_chat_http_requests_total',
+                'HTTP requests handled, by route, method and status code.')
+METRICS.histogram('llama_chat_http_request_duration_seconds',
+                  'HTTP request latency by route and method.')
+METRICS.counter('llama_chat_generations_started_total',
+                'Generations sent to llama-server.')
+METRICS.counter('llama_chat_generations_finished_total',
+                'Generations that returned from llama-server, by outcome.')
+METRICS.gauge('llama_chat_generations_in_flight',
+              'Generations currently waiting on llama-server.',
+              lambda: [(None, METRICS.total('llama_chat_generations_started_total')
+                        - METRICS.total('llama_chat_generations_finished_total'))])
+METRICS.histogram('llama_chat_generation_duration_seconds',
+                  'Wall-clock time of a generation request per model.')
+METRICS.histogram('llama_chat_time_to_first_token_seconds',
+                  'Prompt evaluation time reported by llama-server per model.')
+METRICS.histogram('llama_chat_generation_tokens_per_second',
+                  'Generation speed per model.',
+                  buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 250, 500))
+METRICS.counter('llama_chat_generated_tokens_total',
+                'Completion tokens generated per model.')
+METRICS.counter('llama_chat_model_switches_total',
+                'Model switches by result.')
+METRICS.histogram('llama_chat_model_switch_duration_seconds',
+                  'Time taken to stop llama-server and start it with a new model.')
+METRICS.histogram('llama_chat_model_load_duration_seconds',
+                  'Time from starting llama-server until it serves the new model, '
+                  'by page cache state of the model file (warm, partial, cold).')
+METRICS.counter('llama_chat_prefetch_bytes_total',
+                'Bytes of model files read into the page cache by the prefetcher.')
+METRICS.histogram('llama_chat_sqlite_query_duration_seconds',
+                  'SQLite statement execution time by statement type.',
+                  buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                           0.05, 0.1, 0.25, 0.5, 1))
+METRICS.gauge('llama_chat_llamacpp_up',
+              'Whether llama-server answered its health check (1) or not (0).')
+METRICS.counter('llama_chat_llamacpp_restarts_total',
+                'Automatic llama-server restarts by the health monitor, by result.')
+METRICS.counter('llama_chat_conversations_archived_total',
+                'Conversations moved to (archive) or back from (restore) archive databases.')
+METRICS.gauge('llama_chat_llamacpp_rss_bytes',
+              'Resident memory of the llama-server process.')
+METRICS.gauge('llama_chat_llamacpp_cpu_percent',
+              'CPU use of llama-server over the last sampling interval (100 = one core).')
+METRICS.gauge('llama_chat_llamacpp_threads',
+              'Threads of the llama-server process.')
+METRICS.counter('llama_chat_llamacpp_cpu_seconds_total',
+                'User and system CPU time used by llama-server.')
+METRICS.counter('llama_chat_llamacpp_major_faults_total',
+                'Major page faults (pages read from disk) of llama-server.')
+METRICS.counter('llama_chat_llamacpp_io_bytes_total',
+                'Bytes llama-server read from or wrote to storage, by direction.')
+
+METRICS.counter('llama_chat_rate_limited_total',
+                'Requests rejected by per-client rate limits, by scope and reason.')
+
+METRICS.counter('llama_chat_batch_items_total',
+                'Prompts run by batch jobs, by outcome.')
+
+METRICS.counter('llama_chat_log_records_dropped_total',
+                'Log records not written, by reason (rate_limited or queue_full).')
+
+
+class FileLock:
+    """A lock shared by the threads of this process and by other processes.
+
+    Other processes are excluded with flock() on ``path`` (gunicorn workers,
+    CLI commands), threads with an RLock. Like the RLock it is re-entrant:
+    only the outermost acquire takes the file lock. The kernel releases the
+    file lock if the process dies while holding it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    def acquire(self, blocking=True):
+        if not self._thread_lock.acquire(blocking=blocking):
+            return False
+        if self._depth == 0:
+            lock_file = open(self.path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                self._thread_lock.release()
+                return False
+            self._file = lock_file
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per log record, for the log file."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for key in ('request', 'suppressed'):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class LogRateLimiter(logging.Filter):
+    """Rate limits records per call site, which identifies a message type.
+
+    At most ``per_minute`` records of one call site pass per minute; the
+    rest are dropped and their count is attached to the next record that
+    passes. ERROR and CRITICAL records always pass.
+    """
+
+    def __init__(self, per_minute):
+        super().__init__()
+        self.per_minute = per_minute
+        self._lock = threading.Lock()
+        # (pathname, lineno) -> [window start, passed, suppressed]
+        self._sites = {}
+
+    def filter(self, record):
+        if not self.per_minute or record.levelno >= logging.ERROR:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or record.created - site[0] >= 60:
+                suppressed = site[2] if site else 0
+                site = self._sites[key] = [record.created, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if site[1] >= self.per_minute:
+                site[2] += 1
+                METRICS.inc('llama_chat_log_records_dropped_total', {'reason': 'rate_limited'})
+                return False
+            site[1] += 1
+        return True
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Hands records to the log writer thread without ever blocking.
+
+    Messages are rendered and truncated to ``max_chars`` on the logging
+    thread (their arguments may change later); when the queue is full the
+    record is dropped rather than waiting for the writer.
+    """
+
+    def __init__(self, log_queue, max_chars):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        message = record.getMessage()
+        if self.max_chars and len(message) > self.max_chars:
+            message = f"{message[:self.max_chars]}... [{len(message) - self.max_chars} more chars]"
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = message, None, None
+        if has_request_context():
+            record.request = f"{request.method} {request.path}"
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            METRICS.inc('llama_chat_log_records_dropped_total', {'reason': 'queue_full'})
+
+
+class SuppressedCountFormatter(logging.Formatter):
+    """Text format that notes how many similar records were rate limited."""
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += f" ({record.suppressed} similar messages suppressed)"
+        return text
+
+
+class SharedRotatingFileHandler(logging.handlers.WatchedFileHandler):
+    """A size rotated log file that several processes append to.
+
+    Gunicorn workers and CLI commands write to the same file. The process
+    that finds it over ``max_bytes`` rotates it under a FileLock, the
+    others notice the new file and reopen it, so no process keeps writing
+    to a rotated file.
+    """
+
+    def __init__(self, filename, max_bytes, backup_count, encoding=None):
+        super().__init__(filename, encoding=encoding)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_lock = FileLock(self.baseFilename + '.lock')
+
+    def emit(self, record):
+        if self.max_bytes and self.stream and os.fstat(self.stream.fileno()).st_size >= self.max_bytes:
+            try:
+                with self.rotate_lock:
+                    # Another process may have rotated it meanwhile
+                    if os.path.exists(self.baseFilename) and \
+                            os.path.getsize(self.baseFilename) >= self.max_bytes:
+                        self.rotate_files()
+            except OSError:
+                self.handleError(record)
+        super().emit(record)
+
+    def rotate_files(self):
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.baseFilename}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.baseFilename}.{index + 1}")
+        if self.backup_count:
+            os.replace(self.baseFilename, f"{self.baseFilename}.1")
+        else:
+            os.remove(self.baseFilename)
+
+
+def configure_logging(settings):
+    """Route all logging through a queue to a writer thread.
+
+    Records go to stderr and, when ``file`` is set, to a size rotated log
+    file shared with the other processes (JSON lines unless ``format`` is
+    ``text``). A relative ``file`` is in ``LOG_DIR`` (set by chat-manager.sh)
+    or else next to app.py. With a file, stderr is only written when it is a
+    terminal unless ``console`` says otherwise, so chat-manager.sh's
+    flask.log does not repeat every record. The writer thread is stopped,
+    flushing the queue, at exit or when logging is configured again.
+    """
+    handlers = []
+    to_console = settings.get('console')
+    if to_console is None:
+        to_console = not settings.get('file') or sys.stderr.isatty()
+    if to_console:
+        console = logging.StreamHandler()
+        console.setFormatter(SuppressedCountFormatter(logging.BASIC_FORMAT))
+        handlers.append(console)
+    if settings.get('file'):
+        path = os.path.join(os.getenv('LOG_DIR', os.path.dirname(os.path.abspath(__file__))),
+                            settings['file'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_handler = SharedRotatingFileHandler(
+            path, int(settings.get('max_size_mb', 50) * 1024 * 1024),
+            settings.get('backup_count', 3), encoding='utf-8')
+        file_handler.setFormatter(
+            SuppressedCountFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+            if settings.get('format', 'json') == 'text' else JsonLogFormatter())
+        handlers.append(file_handler)
+
+    handler = AsyncLogHandler(queue.Queue(settings.get('queue_size', 10000)),
+                              settings.get('max_message_chars', 2000))
+    handler.addFilter(LogRateLimiter(settings.get('rate_limit_per_minute', 120)))
+    handler.listener = logging.handlers.QueueListener(handler.queue, *handlers,
+                                                      respect_handler_level=True)
+    handler.listener.start()
+    atexit.register(handler.listener.stop)
+
+    root = logging.getLogger()
+    previous = root.handlers[:]
+    root.addHandler(handler)
+    root.setLevel(settings.get('level', 'INFO'))
+    for existing in previous:
+        root.removeHandler(existing)
+        if isinstance(existing, AsyncLogHandler):
+            atexit.unregister(existing.listener.stop)
+            existing.listener.stop()
+            for target in existing.listener.handlers:
+                target.close()
+
+
+configure_logging(CONFIG.get('logging', {}))
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """SQLite connection that records statement latency in METRICS."""
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            METRICS.observe('llama_chat_sqlite_query_duration_seconds',
+                            time.perf_counter() - start,
+                            {'statement': _statement_type(sql)})
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            METRICS.observe('llama_chat_sqlite_query_duration_seconds',
+                            time.perf_counter() - start,
+                            {'statement': _statement_type(sql)})
+
+
+def _statement_type(sql):
+    words = sql.split(None, 1)
+    return words[0].upper() if words else 'UNKNOWN'
+
+
+# Request tracing and profiling (see the "debug" section of config.json)
+DEBUG_CONFIG = CONFIG.get('debug', {})
+TRACE_BUFFER_SIZE = DEBUG_CONFIG.get('trace_buffer_size', 200)
+PROFILE_SAMPLE_RATE = DEBUG_CONFIG.get('profile_sample_rate', 0.0)
+PROFILE_INTERVAL_MS = DEBUG_CONFIG.get('profile_interval_ms', 5)
+ALLOW_PROFILE_HEADER = DEBUG_CONFIG.get('allow_profile_header', False)
+
+# Most recent request traces, newest last
+TRACE_BUFFER = deque(maxlen=TRACE_BUFFER_SIZE)
+_trace_ids = itertools.count(1)
+
+
+@contextmanager
+def trace_span(name):
+    """Time one phase of the current request for Server-Timing and traces."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            spans = g.get('trace_spans')
+            if spans is not None:
+                spans.append(
+                    (name, round((time.perf_counter() - start) * 1000, 2)))
+
+
+class StackSampler:
+    """Periodically samples one thread's Python stack from a helper thread.
+
+    Samples are aggregated as collapsed stacks ("outer;inner" -> count), the
+    format consumed by flame graph tools.
+    """
+
+    def __init__(self, thread_id, interval_ms=PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = max(interval_ms, 1) / 1000
+        self.samples = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self, top=50):
+        """Stop sampling and return the most frequent stacks."""
+        self._stop.set()
+        self._thread.join()
+        stacks = sorted(self.samples.items(),
+                        key=lambda item: item[1], reverse=True)
+        return {
+            'interval_ms': self.interval * 1000,
+            'total_samples': sum(self.samples.values()),
+            'stacks': [{'stack': stack, 'samples': count}
+                       for stack, count in stacks[:top]]
+        }
+
+
+def _should_profile():
+    if ALLOW_PROFILE_HEADER and request.headers.get('X-Profile', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
 
 def migrate_database():
     """Migrate database to add missing columns."""
@@ -203,16 +1481,127 @@ def migrate_database():
                 logger.info(
                     "Successfully added model_file column to messages table")
 
+            # Check for llama-server timing columns in messages table
+            for column, column_type in MESSAGE_TIMING_COLUMNS.items():
+                if column not in columns:
+                    logger.info(f"Adding {column} column to messages table")
+                    cursor.execute(
+                        f"ALTER TABLE messages ADD COLUMN {column} {column_type}")
+                    conn.commit()
+
+            # Large message contents may be stored compressed
+            if 'content_encoding' not in columns:
+                logger.info("Adding content_encoding column to messages table")
+                cursor.execute(
+                    "ALTER TABLE messages ADD COLUMN content_encoding TEXT")
+                conn.commit()
+
+            # Messages form a tree (regenerated answers and branches share
+            # their prefix); conversations point at the leaf of the shown path
+            if 'parent_id' not in columns:
+                logger.info("Adding parent_id column to messages table")
+                cursor.execute(
+                    "ALTER TABLE messages ADD COLUMN parent_id INTEGER REFERENCES messages (id)")
+                conn.commit()
+            cursor.execute("PRAGMA table_info(conversations)")
+            if 'active_leaf_id' not in [column[1] for column in cursor.fetchall()]:
+                logger.info("Adding active_leaf_id column to conversations table")
+                cursor.execute(
+                    "ALTER TABLE conversations ADD COLUMN active_leaf_id INTEGER")
+                conn.commit()
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_parent ON messages(parent_id)")
+            link_linear_conversations(conn)
+
+            # Populate usage rollups from existing history on first run
+            rollups_empty = cursor.execute(
+                "SELECT 1 FROM usage_rollups LIMIT 1").fetchone() is None
+            if rollups_empty:
+                UsageRollups.backfill(conn)
+
     except Exception as e:
         logger.error(f"Error migrating database: {e}")
         raise
 
 
+def link_linear_conversations(conn):
+    """Chain the messages of conversations without a message tree.
+
+    Conversations stored before messages had parents (or inserted directly,
+    like the benchmark database) become a single path in timestamp order.
+    """
+    pending = conn.execute(
+        'SELECT id FROM conversations WHERE active_leaf_id IS NULL '
+        'AND EXISTS (SELECT 1 FROM messages WHERE conversation_id = conversations.id)'
+    ).fetchall()
+    if not pending:
+        return
+
+    logger.info(f"Linking messages of {len(pending)} conversations into paths")
+    conn.execute(
+        'CREATE TEMP TABLE message_parents (id INTEGER PRIMARY KEY, parent_id INTEGER)')
+    conn.execute('''
+        INSERT INTO message_parents (id, parent_id)
+        SELECT id, LAG(id) OVER (PARTITION BY conversation_id ORDER BY timestamp, id)
+        FROM messages
+        WHERE conversation_id IN (SELECT id FROM conversations WHERE active_leaf_id IS NULL)
+    ''')
+    conn.execute('''
+        UPDATE messages SET parent_id = (
+            SELECT parent_id FROM message_parents WHERE message_parents.id = messages.id)
+        WHERE id IN (SELECT id FROM message_parents)
+    ''')
+    conn.execute('''
+        UPDATE conversations SET active_leaf_id = (
+            SELECT id FROM messages WHERE conversation_id = conversations.id
+            ORDER BY timestamp DESC, id DESC LIMIT 1)
+        WHERE active_leaf_id IS NULL
+    ''')
+    conn.execute('DROP TABLE message_parents')
+    conn.commit()
+
+
+def cursor_dicts(cursor, **extra):
+    """Rows of a cursor without row factory as dicts, plus ``extra`` fields."""
+    columns = [column[0] for column in cursor.description] + list(extra)
+    values = tuple(extra.values())
+    return (dict(zip(columns, row + values)) for row in cursor)
+
+
+def iter_newest_first(db, table, columns='*', page_size=500, **extra):
+    """Yield the rows of ``table`` by ``updated_at`` and ``id``, newest first.
+
+    Rows are read in keyset pages of ``page_size``, each its own short
+    statement, so no transaction stays open while the caller consumes
+    them. A row updated meanwhile may be skipped or appear twice, as in
+    any paginated listing. Rows without ``updated_at`` come last.
+    """
+    select = f'SELECT {columns} FROM {table} WHERE {{}} ORDER BY updated_at DESC, id DESC LIMIT {page_size}'
+    where, params = 'updated_at IS NOT NULL', ()
+    while True:
+        rows = list(cursor_dicts(db.execute(select.format(where), params), **extra))
+        yield from rows
+        if len(rows) < page_size:
+            break
+        last = rows[-1]
+        where = 'updated_at <= ? AND (updated_at < ? OR id < ?)'
+        params = (last['updated_at'], last['updated_at'], last['id'])
+    where, params = 'updated_at IS NULL', ()
+    while True:
+        rows = list(cursor_dicts(db.execute(select.format(where), params), **extra))
+        yield from rows
+        if len(rows) < page_size:
+            break
+        where, params = 'updated_at IS NULL AND id < ?', (rows[-1]['id'],)
+
+
 def get_db():
     """Get database connection."""
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE_PATH)
+        g.db = sqlite3.connect(
+            DATABASE_PATH, factory=InstrumentedConnection)
         g.db.row_factory = sqlite3.Row
+        MessageCompression.register(g.db)
     return g.db
 
 
@@ -223,15 +1612,46 @@ def close_db(error):
         db.close()
 
 
+def pid_alive(pid):
+    """Whether process ``pid`` exists and is not a zombie."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    stats = read_process_stats(pid)
+    return stats is None or stats['state'] != 'Z'
+
+
 def init_db():
-    """Initialize database with schema."""
+    """Initialize database with schema.
+
+    Nothing is done for a database already at SCHEMA_VERSION, so restarts
+    do not inspect every table.
+    """
     with sqlite3.connect(DATABASE_PATH) as conn:
+        # WAL lets long reads (exports, streamed lists) run while others write;
+        # the mode is stored in the file, so this also converts older databases
+        conn.execute('PRAGMA journal_mode=WAL')
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            if version > SCHEMA_VERSION:
+                logger.warning(f"Database schema version {version} is newer than this app "
+                               f"({SCHEMA_VERSION}); leaving it as it is")
+            logger.info(f"Database schema is current (version {version}): {DATABASE_PATH}")
+            return
         conn.executescript(SCHEMA)
         conn.commit()
     logger.info(f"Database initialized: {DATABASE_PATH}")
 
     # Run migrations
     migrate_database()
+    with sqlite3.connect(DATABASE_PATH) as conn:
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    logger.info(f"Database schema migrated from version {version} to {SCHEMA_VERSION}")
 
 
 @app.teardown_appcontext
@@ -267,7 +1687,7 @@ class ModelManager:
                 'size_bytes': file_size
             })
 
-        logger.info(f"Found {len(models)} available models")
+        logger.debug(f"Found {len(models)} available models")
         return models
 
     # @staticmethod
@@ -295,17 +1715,17 @@ class ModelManager:
         try:
             response = requests.get(
                 f"{LLAMACPP_API_URL}/v1/models",
-                timeout=(LLAMACPP_CONNECT_TIMEOUT, 10)
+                timeout=(ConfigWatcher.current().timeouts[0], 10)
             )
 
             if response.status_code == 200:
-                data = response.json()
+                data = json_loads(response.content)
                 if 'data' in data and len(data['data']) > 0:
                     model_path = data['data'][0]['id']
                     # Extract just the filename from the full path
                     import os
                     model_filename = os.path.basename(model_path)
-                    logger.info(
+                    logger.debug(
                         f"Current model path: {model_path}, filename: {model_filename}")
                     return model_filename
                 return "unknown-model"
@@ -316,15 +1736,95 @@ class ModelManager:
 
 
 class LlamaCppManager:
-    """Manages llama.cpp server lifecycle for model switching."""
+    """Manages llama.cpp server lifecycle for model switching.
+
+    The lifecycle lock and the state file are shared by every process of
+    the app (gunicorn workers, CLI commands), so only one of them stops
+    and starts llama-server at a time, and all of them know which model
+    and draft model it serves and which operation is in progress.
+    """
+
+    # Held while the server is deliberately stopped and started (switches,
+    # benchmarks, restarts); `busy` in the state names the operation for
+    # status reports
+    lifecycle_lock = FileLock(LLAMACPP_LOCK_FILE)
+
+    @staticmethod
+    def state():
+        """Shared state: pid, model_path, draft, busy and busy_pid.
+
+        An operation whose process died (and with it its hold on the lock)
+        is not reported as busy.
+        """
+        try:
+            with open(LLAMACPP_STATE_FILE) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if state.get('busy') and not pid_alive(state.get('busy_pid')):
+            state['busy'] = state['busy_pid'] = None
+        return state
+
+    @staticmethod
+    def _write_state(**changes):
+        # Only called with the lifecycle lock held; readers never see a
+        # partial file thanks to the rename
+        with LlamaCppManager.lifecycle_lock:
+            state = dict(LlamaCppManager.state(), **changes, updated_at=time.time())
+            temp_path = f"{LLAMACPP_STATE_FILE}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, LLAMACPP_STATE_FILE)
+
+    @staticmethod
+    def active_model():
+        """Model path of the server started by the app, if any."""
+        return LlamaCppManager.state().get('model_path')
+
+    @staticmethod
+    def active_draft():
+        """Draft model name of the server started by the app, if any."""
+        return LlamaCppManager.state().get('draft')
+
+    @staticmethod
+    def busy():
+        """The lifecycle operation in progress in any process, if any."""
+        return LlamaCppManager.state().get('busy')
+
+    @staticmethod
+    @contextmanager
+    def lifecycle(operation):
+        with LlamaCppManager.lifecycle_lock:
+            previous = LlamaCppManager.busy()
+            LlamaCppManager._write_state(busy=operation, busy_pid=os.getpid())
+            HealthMonitor.update(state=operation, server_running=False)
+            try:
+                yield
+            finally:
+                LlamaCppManager._write_state(busy=previous, busy_pid=os.getpid() if previous else None)
+                HealthMonitor.wake()
+
+    @staticmethod
+    def is_serving(model_path):
+        """Whether the app's server is up and serving ``model_path``."""
+        if LlamaCppManager.active_model() != model_path:
+            return False
+        try:
+            response = requests.get(f"{LLAMACPP_API_URL}/health",
+                                    timeout=(ConfigWatcher.current().timeouts[0], 5))
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
 
     @staticmethod
     def is_server_running():
         """Check if llama.cpp server is running."""
+        if HealthMonitor.is_running():
+            return HealthMonitor.get_status()['server_running']
         try:
             response = requests.get(
                 f"{LLAMACPP_API_URL}/health",
-                timeout=(LLAMACPP_CONNECT_TIMEOUT, 5)
+                timeout=(ConfigWatcher.current().timeouts[0], 5)
             )
             return response.status_code == 200
         except:
@@ -332,164 +1832,238 @@ class LlamaCppManager:
                 # Fallback: try models endpoint
                 response = requests.get(
                     f"{LLAMACPP_API_URL}/v1/models",
-                    timeout=(LLAMACPP_CONNECT_TIMEOUT, 5)
+                    timeout=(ConfigWatcher.current().timeouts[0], 5)
                 )
                 return response.status_code == 200
             except:
                 return False
 
+    @staticmethod
+    def server_pids():
+        """PIDs of the llama-server processes listening on LLAMACPP_PORT.
+
+        Found through /proc, so other llama-server instances (the embedding
+        server, other installations) are never mistaken for ours.
+        """
+        pids = []
+        try:
+            entries = os.listdir('/proc')
+        except OSError:
+            return pids
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                    args = f.read().decode('utf-8', 'replace').split('\0')
+            except OSError:
+                continue
+            if os.path.basename(args[0]) != 'llama-server':
+                continue
+            port = args[args.index('--port') + 1] if '--port' in args[:-1] else '8080'
+            if port == str(LLAMACPP_PORT):
+                pids.append(int(entry))
+        return pids
+
     @staticmethod
     def stop_server():
-        """Stop the llama.cpp server."""
+        """Stop the llama.cpp server.
+
+        Only llama-server processes listening on LLAMACPP_PORT are stopped:
+        the one in the PID file, or all of them if the PID file is missing
+        or stale (e.g. a server started by hand).
+        """
         try:
+            running = LlamaCppManager.server_pids()
+            pids = running
             if os.path.exists(LLAMACPP_PID_FILE):
                 with open(LLAMACPP_PID_FILE, 'r') as f:
                     pid = int(f.read().strip())
+                if pid in running:
+                    pids = [pid]
+
+            # Try graceful shutdown first, then force kill what is left
+            for pid in pids:
+                os.kill(pid, signal.SIGTERM)
+            deadline = time.time() + 5
+            while pids and time.time() < deadline:
+                time.sleep(0.1)
+                pids = [pid for pid in pids if pid_alive(pid)]
+            for pid in pids:
+                os.kill(pid, signal.SIGKILL)
+                logger.info(f"Force killed llama.cpp server {pid}")
 
-                # Try graceful shutdown first
-                try:
-                    os.kill(pid, signal.SIGTERM)
-                    time.sleep(3)
-
-                    # Check if process is still running
-                    try:
-                        # This doesn't kill, just checks if process exists
-                        os.kill(pid, 0)
-                        # Still running, force kill
-                        os.kill(pid, signal.SIGKILL)
-                        logger.info("Force killed llama.cpp server")
-                    except OSError:
-                        # Process already terminated
-                        pass
-
-                except OSError as e:
-                    logger.warning(f"Process {pid} not found: {e}")
-
-                # Remove PID file
-                os.remove(LLAMACPP_PID_FILE)
-                logger.info("Stopped llama.cpp server")
-                return True
-        except Exception as e:
-            logger.error(f"Error stopping server: {e}")
-
-        # Fallback: kill any llama-server processes
-        try:
-            subprocess.run(["pkill", "-f", "llama-server"],
-                           check=False, capture_output=True)
             if os.path.exists(LLAMACPP_PID_FILE):
                 os.remove(LLAMACPP_PID_FILE)
-            time.sleep(2)
+            LlamaCppManager._write_state(pid=None, model_path=None, draft=None)
+            logger.info("Stopped llama.cpp server")
             return True
         except Exception as e:
-            logger.error(f"Error with fallback kill: {e}")
+            logger.error(f"Error stopping server: {e}")
             return False
 
     @staticmethod
-    def start_server(model_path):
-        """Start llama.cpp server with specified model."""
+    def start_server(model_path, launch_params=None):
+        """Start llama.cpp server with specified model.
+
+        Launch parameters come from config.json, or from LaunchTuner when
+        performance.auto_tune is enabled, unless given explicitly.
+        """
+        config = ConfigWatcher.current()
         try:
             if not os.path.exists(model_path):
                 raise FileNotFoundError(f"Model file not found: {model_path}")
 
             # Determine optimal settings
-            threads = CONFIG['performance']['num_thread']
-            if threads == -1:
-                threads = os.cpu_count() or 4
-
-            context_size = CONFIG['model_options']['num_ctx']
-            batch_size = CONFIG['performance']['batch_size']
-            gpu_layers = CONFIG['performance']['num_gpu']
+            if launch_params is None:
+                if config.data['performance'].get('auto_tune', False):
+                    launch_params = LaunchTuner.get_params(
+                        model_path, calibrate=config.data['performance'].get('auto_tune_calibrate', False))
+                else:
+                    launch_params = LaunchTuner.config_params()
 
             # Build command - use the same format that works in debug script
             cmd = [
                 "llama-server",
                 "--model", model_path,
                 "--host", LLAMACPP_HOST,
-                "--port", str(LLAMACPP_PORT),
-                "--ctx-size", str(context_size),
-                "--batch-size", str(batch_size),
-                "--threads", str(threads)
-            ]
+                "--port", str(LLAMACPP_PORT)
+            ] + LaunchTuner.build_args(launch_params)
 
-            # Add GPU layers if configured
-            if gpu_layers > 0:
-                cmd.extend(["--n-gpu-layers", str(gpu_layers)])
+            # Add a draft model for speculative decoding if enabled
+            draft = SpeculativeDecoding.resolve_draft(model_path)
+            if draft:
+                cmd.extend(SpeculativeDecoding.build_args(draft['file_path']))
 
             logger.info(
                 f"Starting llama.cpp server with command: {' '.join(cmd)}")
 
-            # Ensure we're in the right working directory
-            original_cwd = os.getcwd()
+            # Run from the application directory without changing the cwd of
+            # this (multi-threaded) process
             script_dir = os.path.dirname(os.path.abspath(__file__))
-            os.chdir(script_dir)
 
-            try:
-                # Start server with explicit environment
-                env = os.environ.copy()
-                env['PATH'] = os.environ.get('PATH', '')
-
-                # Start server
-                with open("llamacpp.log", "a") as log_file:
-                    process = subprocess.Popen(
-                        cmd,
-                        stdout=log_file,
-                        stderr=subprocess.STDOUT,
-                        env=env,
-                        cwd=script_dir
-                    )
+            # Start server with explicit environment
+            env = os.environ.copy()
+            env['PATH'] = os.environ.get('PATH', '')
+
+            # Start server
+            with open(os.path.join(script_dir, "llamacpp.log"), "a") as log_file:
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
+                    env=env,
+                    cwd=script_dir
+                )
 
-                # Save PID
-                with open(LLAMACPP_PID_FILE, 'w') as f:
-                    f.write(str(process.pid))
+            # Save PID
+            with open(LLAMACPP_PID_FILE, 'w') as f:
+                f.write(str(process.pid))
 
-                logger.info(
-                    f"Started llama.cpp server with PID: {process.pid}")
-
-                # Wait for server to be ready - increase attempts and reduce sleep
-                max_attempts = 60  # 2 minutes total
-                for attempt in range(max_attempts):
-                    time.sleep(2)
-
-                    # Check if process is still running
-                    if process.poll() is not None:
-                        logger.error(
-                            f"llama.cpp server process died with return code: {process.returncode}")
-                        return False
-
-                    # Check if server is responding
-                    try:
-                        response = requests.get(
-                            f"{LLAMACPP_API_URL}/v1/models",
-                            timeout=5
-                        )
-                        if response.status_code == 200:
-                            logger.info(
-                                f"llama.cpp server started successfully after {attempt + 1} attempts with model: {os.path.basename(model_path)}")
-                            return True
-                    except requests.exceptions.RequestException:
-                        # Server not ready yet, continue waiting
-                        pass
-
-                    if attempt % 10 == 9:  # Log progress every 20 seconds
-                        logger.info(
-                            f"Still waiting for server... attempt {attempt + 1}/{max_attempts}")
+            logger.info(
+                f"Started llama.cpp server with PID: {process.pid}")
 
-                logger.error("Server failed to start within timeout")
-                return False
+            # Wait for server to be ready - poll often so that fast (page
+            # cache warm) loads are not rounded up to the poll interval
+            max_attempts = 240  # 2 minutes total
+            for attempt in range(max_attempts):
+                time.sleep(0.5)
 
-            finally:
-                # Restore original working directory
-                os.chdir(original_cwd)
+                # Check if process is still running
+                if process.poll() is not None:
+                    logger.error(
+                        f"llama.cpp server process died with return code: {process.returncode}")
+                    return False
+
+                # Check if server is responding
+                try:
+                    response = requests.get(
+                        f"{LLAMACPP_API_URL}/v1/models",
+                        timeout=5
+                    )
+                    if response.status_code == 200:
+                        logger.info(
+                            f"llama.cpp server started successfully after {attempt + 1} attempts with model: {os.path.basename(model_path)}")
+                        LlamaCppManager._write_state(
+                            pid=process.pid, model_path=model_path,
+                            draft=draft['name'] if draft else None)
+                        ConfigWatcher.mark_applied('llama-server', config)
+                        return True
+                except requests.exceptions.RequestException:
+                    # Server not ready yet, continue waiting
+                    pass
+
+                if attempt % 40 == 39:  # Log progress every 20 seconds
+                    logger.info(
+                        f"Still waiting for server... attempt {attempt + 1}/{max_attempts}")
+
+            logger.error("Server failed to start within timeout")
+            return False
 
         except Exception as e:
             logger.error(f"Error starting server: {e}")
             return False
 
     @staticmethod
-    def switch_model(model_path):
-        """Switch to a different model by restarting the server."""
-        logger.info(f"Switching to model: {os.path.basename(model_path)}")
+    def switch_model(model_path, check_memory=True):
+        """Switch to a different model by restarting the server.
+
+        Refuses models that would not fit in memory (see
+        ResourceSampler.check_fit) unless check_memory is False.
+        """
+        model_file = os.path.basename(model_path)
+        if check_memory and CONFIG.get('resources', {}).get('check_memory_fit', True):
+            fit = ResourceSampler.check_fit(model_path)
+            if not fit['fits']:
+                logger.error(
+                    f"Not switching to {model_file}: needs about {fit['required_mb']} MB, "
+                    f"{fit['usable_mb']} MB available")
+                METRICS.inc('llama_chat_model_switches_total', {'result': 'refused'})
+                return False
+
+        logger.info(f"Switching to model: {model_file}")
+        from_model = LlamaCppManager.active_model() or ModelManager.get_current_model()
+        switch_start = time.perf_counter()
+
+        # Warm the new model file while the old server shuts down
+        try:
+            ModelPrefetcher.prefetch(model_path, reason='switch')
+        except OSError as e:
+            logger.warning(f"Could not prefetch {model_file}: {e}")
+
+        with LlamaCppManager.lifecycle_lock:
+            # Another worker may have switched to this model while we waited
+            if LlamaCppManager.is_serving(model_path):
+                logger.info(f"{model_file} is already loaded")
+                return True
+            with LlamaCppManager.lifecycle('switching'):
+                success, load_ms, residency = LlamaCppManager._switch_model(
+                    model_path)
+        duration = time.perf_counter() - switch_start
+        METRICS.inc('llama_chat_model_switches_total',
+                    {'result': 'success' if success else 'failure'})
+        METRICS.observe('llama_chat_model_switch_duration_seconds', duration)
+        if success:
+            METRICS.observe('llama_chat_model_load_duration_seconds', load_ms / 1000,
+                            {'cache': residency_label(residency)})
+
+        try:
+            ModelPrefetcher.record_switch(
+                os.path.basename(from_model) if from_model else None, model_file,
+                success, int(duration * 1000), load_ms, residency)
+            if success:
+                ModelPrefetcher.prefetch_predicted(model_file)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Could not record model switch: {e}")
+        return success
+
+    @staticmethod
+    def _switch_model(model_path):
+        """Restart llama-server with the given model.
 
+        Returns (success, load time in ms, page cache residency of the model
+        file when loading started).
+        """
         # Stop current server
         if not LlamaCppManager.stop_server():
             logger.warning(
@@ -499,13 +2073,17 @@ class LlamaCppManager:
         time.sleep(3)
 
         # Start with new model
+        residency = page_cache_residency(model_path)
+        load_start = time.perf_counter()
         if not LlamaCppManager.start_server(model_path):
             logger.error("Failed to start server with new model")
-            return False
+            return False, None, residency
+        load_ms = int((time.perf_counter() - load_start) * 1000)
 
         logger.info(
-            f"Successfully switched to model: {os.path.basename(model_path)}")
-        return True
+            f"Successfully switched to model: {os.path.basename(model_path)} "
+            f"(loaded in {load_ms / 1000:.1f}s, {residency_label(residency)} page cache)")
+        return True, load_ms, residency
 
 
 class LlamaCppAPI:
@@ -524,22 +2102,103 @@ class LlamaCppAPI:
             return []
 
     @staticmethod
-    def generate_response(model, prompt, conversation_history=None):
-        """Generate response from llama.cpp with timing metrics."""
+    def parse_timings(data):
+        """Extract the prompt/generation timing breakdown from a completion.
+
+        llama-server reports `prompt_n` as the tokens it actually evaluated,
+        so the tokens served from the prompt cache are the difference to the
+        full prompt size (or `cache_n` on builds that report it directly).
+        """
+        timings = data.get('timings') or {}
+        usage = data.get('usage') or {}
+
+        prompt_tokens = usage.get('prompt_tokens')
+        prompt_evaluated = timings.get('prompt_n')
+
+        cached_tokens = timings.get('cache_n')
+        if cached_tokens is None:
+            cached_tokens = (usage.get('prompt_tokens_details')
+                             or {}).get('cached_tokens')
+        if cached_tokens is None and prompt_tokens is not None and prompt_evaluated is not None:
+            cached_tokens = max(0, prompt_tokens - prompt_evaluated)
+        if prompt_tokens is None and prompt_evaluated is not None:
+            prompt_tokens = prompt_evaluated + (cached_tokens or 0)
+
+        return {
+            'prompt_tokens': prompt_tokens,
+            'cached_tokens': cached_tokens,
+            'prompt_ms': timings.get('prompt_ms'),
+            'prompt_per_second': timings.get('prompt_per_second'),
+            'predicted_ms': timings.get('predicted_ms'),
+            'predicted_per_second': timings.get('predicted_per_second'),
+            'predicted_n': timings.get('predicted_n'),
+            'draft_n': timings.get('draft_n'),
+            'draft_n_accepted': timings.get('draft_n_accepted')
+        }
+
+    @staticmethod
+    def generate_response(model, prompt, conversation_history=None, summary=None,
+                          system_prompt=None, options=None):
+        """Generate response from llama.cpp with timing metrics.
+
+        With a rolling summary the history is expected to hold only the
+        messages the summary does not cover, and is sent without the
+        context_history_limit slice. ``system_prompt`` and the sampling
+        ``options`` override the configured ones for this request.
+        """
+        METRICS.inc('llama_chat_generations_started_total')
+        result = LlamaCppAPI._generate_response(
+            model, prompt, conversation_history, summary, system_prompt, options)
+
+        labels = {'model': model}
+        timings = result.get('timings')
+        METRICS.inc('llama_chat_generations_finished_total',
+                    {'outcome': 'success' if timings is not None else 'error'})
+        METRICS.observe('llama_chat_generation_duration_seconds',
+                        result['response_time_ms'] / 1000, labels)
+        if timings is not None:
+            METRICS.inc('llama_chat_generated_tokens_total',
+                        labels, result['estimated_tokens'] or 0)
+            if timings.get('prompt_ms') is not None:
+                METRICS.observe('llama_chat_time_to_first_token_seconds',
+                                timings['prompt_ms'] / 1000, labels)
+            tokens_per_second = timings.get('predicted_per_second')
+            if tokens_per_second is None and result['response_time_ms']:
+                tokens_per_second = result['estimated_tokens'] / \
+                    (result['response_time_ms'] / 1000)
+            if tokens_per_second is not None:
+                METRICS.observe('llama_chat_generation_tokens_per_second',
+                                tokens_per_second, labels)
+        return result
+
+    @staticmethod
+    def _generate_response(model, prompt, conversation_history=None, summary=None,
+                           system_prompt=None, options=None):
+        """Send one chat completion request to llama-server."""
         start_time = time.time()
+        # One snapshot for the whole generation, even if the config is reloaded
+        config = ConfigWatcher.current()
 
         try:
-            # Get system prompt from config
-            system_prompt = CONFIG['system_prompt']
-
             # Build messages array for chat completion
             messages = [
-                {"role": "system", "content": system_prompt}
+                {"role": "system",
+                 "content": config.system_prompt if system_prompt is None else system_prompt}
             ]
 
+            # The summary stands in for the messages it covers; keeping it
+            # right after the system prompt keeps the cached prefix stable
+            if summary:
+                messages.append({
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{summary}"
+                })
+
             # Add conversation history
             if conversation_history:
-                history_limit = CONFIG['performance']['context_history_limit']
+                history_limit = config.history_limit
+                if summary:
+                    history_limit = len(conversation_history)
                 for msg in conversation_history[-history_limit:]:
                     messages.append({
                         "role": msg['role'],
@@ -549,33 +2208,23 @@ class LlamaCppAPI:
             # Add current user message
             messages.append({"role": "user", "content": prompt})
 
-            # Build payload for OpenAI-compatible endpoint
-            payload = {
-                "model": model,
-                "messages": messages,
-                "stream": CONFIG['response_optimization']['stream'],
-                "temperature": CONFIG['model_options']['temperature'],
-                "top_p": CONFIG['model_options']['top_p'],
-                "max_tokens": CONFIG['model_options']['num_predict'],
-                "stop": CONFIG['model_options']['stop'],
-                "repeat_penalty": CONFIG['model_options']['repeat_penalty'],
-            }
-
-            # Add llama.cpp specific parameters if available
-            if 'top_k' in CONFIG['model_options']:
-                payload['top_k'] = CONFIG['model_options']['top_k']
+            # Build payload for OpenAI-compatible endpoint; the sampling
+            # options include cache_prompt, which keeps the evaluated prompt
+            # in the slot so follow-ups, regenerated answers and branches
+            # only evaluate the part after the shared prefix
+            payload = dict(config.sampling, **(options or {}), model=model, messages=messages)
 
-            response = requests.post(
+            response = post_json(
                 f"{LLAMACPP_API_URL}/v1/chat/completions",
-                json=payload,
-                timeout=(LLAMACPP_CONNECT_TIMEOUT, LLAMACPP_TIMEOUT)
+                payload,
+                timeout=config.timeouts
             )
 
             # Calculate response time
             response_time = int((time.time() - start_time) * 1000)
 
             if response.status_code == 200:
-                data = response.json()
+                data = json_loads(response.content)
 
                 # Extract response from OpenAI format
                 if 'choices' in data and len(data['choices']) > 0:
@@ -597,7 +2246,8 @@ class LlamaCppAPI:
                     'estimated_tokens': estimated_tokens,
                     'completion_tokens': usage.get('completion_tokens'),
                     'prompt_tokens': usage.get('prompt_tokens'),
-                    'total_tokens': usage.get('total_tokens')
+                    'total_tokens': usage.get('total_tokens'),
+                    'timings': LlamaCppAPI.parse_timings(data)
                 }
             else:
                 return {
@@ -610,7 +2260,7 @@ class LlamaCppAPI:
             response_time = int((time.time() - start_time) * 1000)
             logger.error(f"llama.cpp read timeout: {e}")
             return {
-                'response': f"Response timed out after {LLAMACPP_TIMEOUT} seconds.",
+                'response': f"Response timed out after {config.timeouts[1]} seconds.",
                 'response_time_ms': response_time,
                 'estimated_tokens': 0
             }
@@ -624,6 +2274,221 @@ class LlamaCppAPI:
             }
 
 
+class MessageCompression:
+    """Transparent compression of large message contents.
+
+    Contents of at least ``min_bytes`` are stored as a compressed BLOB and
+    ``messages.content_encoding`` names the codec: ``zlib`` or ``zstd``,
+    suffixed with ``:<id>`` when a trained dictionary from
+    ``compression_dictionaries`` was used. Small messages keep a NULL
+    encoding and plain text, as do databases written before compression
+    existed. zstd needs the optional ``zstandard`` package; without it zlib
+    is used.
+    """
+
+    # Dictionaries never change once stored, so they are cached by id
+    _dictionaries = {}
+    _zstd_dictionaries = {}
+
+    @staticmethod
+    def settings():
+        return CONFIG.get('compression', {})
+
+    @staticmethod
+    def algorithm():
+        """Codec for new messages: the configured one if it is available."""
+        algorithm = MessageCompression.settings().get('algorithm', 'zlib')
+        if algorithm == 'zstd' and zstandard is None:
+            return 'zlib'
+        return algorithm
+
+    @staticmethod
+    def text_sql(table='messages'):
+        """SQL expression for the plain text content of ``table``."""
+        return (f"CASE WHEN {table}.content_encoding IS NULL THEN {table}.content "
+                f"ELSE message_text({table}.content, {table}.content_encoding) END")
+
+    @staticmethod
+    def _dictionary(db, dictionary_id):
+        data = MessageCompression._dictionaries.get(dictionary_id)
+        if data is None:
+            if db is None:
+                with sqlite3.connect(DATABASE_PATH) as conn:
+                    return MessageCompression._dictionary(conn, dictionary_id)
+            row = db.execute('SELECT data FROM compression_dictionaries WHERE id = ?',
+                             (dictionary_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Compression dictionary {dictionary_id} is missing")
+            data = MessageCompression._dictionaries[dictionary_id] = bytes(row[0])
+        return data
+
+    @staticmethod
+    def _zstd_dictionary(db, dictionary_id):
+        zstd_dictionary = MessageCompression._zstd_dictionaries.get(dictionary_id)
+        if zstd_dictionary is None:
+            zstd_dictionary = zstandard.ZstdCompressionDict(
+                MessageCompression._dictionary(db, dictionary_id))
+            MessageCompression._zstd_dictionaries[dictionary_id] = zstd_dictionary
+        return zstd_dictionary
+
+    @staticmethod
+    def encode(db, text):
+        """(value, encoding) to store for ``text``.
+
+        Text below the size threshold, or that barely compresses, is kept
+        plain so reading it costs nothing.
+        """
+        settings = MessageCompression.settings()
+        raw = text.encode('utf-8')
+        if not settings.get('enabled', True) or len(raw) < settings.get('min_bytes', 1024):
+            return text, None
+
+        algorithm = MessageCompression.algorithm()
+        level = settings.get('level', 6)
+        dictionary_id = None
+        if settings.get('use_dictionary', False):
+            dictionary_id = db.execute(
+                'SELECT MAX(id) FROM compression_dictionaries WHERE algorithm = ?',
+                (algorithm,)).fetchone()[0]
+
+        if algorithm == 'zstd':
+            compressor = zstandard.ZstdCompressor(
+                level=level,
+                dict_data=MessageCompression._zstd_dictionary(db, dictionary_id) if dictionary_id else None)
+            data = compressor.compress(raw)
+        else:
+            if dictionary_id:
+                compressor = zlib.compressobj(
+                    level, zdict=MessageCompression._dictionary(db, dictionary_id))
+            else:
+                compressor = zlib.compressobj(level)
+            data = compressor.compress(raw) + compressor.flush()
+
+        if len(data) > len(raw) * 0.9:
+            return text, None
+        return data, f"{algorithm}:{dictionary_id}" if dictionary_id else algorithm
+
+    @staticmethod
+    def decode(value, encoding, db=None):
+        """Plain text of a stored content value."""
+        if encoding is None:
+            return value
+        algorithm, _, dictionary_id = encoding.partition(':')
+        dictionary_id = int(dictionary_id) if dictionary_id else None
+
+        if algorithm == 'zstd':
+            if zstandard is None:
+                raise ValueError("Message is zstd compressed: install zstandard to read it")
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=MessageCompression._zstd_dictionary(db, dictionary_id) if dictionary_id else None)
+            data = decompressor.decompress(value)
+        elif algorithm == 'zlib':
+            if dictionary_id:
+                decompressor = zlib.decompressobj(
+                    zdict=MessageCompression._dictionary(db, dictionary_id))
+            else:
+                decompressor = zlib.decompressobj()
+            data = decompressor.decompress(value) + decompressor.flush()
+        else:
+            raise ValueError(f"Unknown content encoding: {encoding}")
+        return data.decode('utf-8')
+
+    @staticmethod
+    def decode_row(db, row):
+        """A message row as a dict with plain text content."""
+        message = dict(row)
+        encoding = message.pop('content_encoding', None)
+        if encoding is not None:
+            message['content'] = MessageCompression.decode(message['content'], encoding, db)
+        return message
+
+    @staticmethod
+    def register(conn):
+        """Make message_text() (see text_sql) available on a connection."""
+        conn.create_function('message_text', 2, MessageCompression.decode, deterministic=True)
+
+    @staticmethod
+    def train_dictionary(db, sample_count=2000):
+        """Train a dictionary on recent messages and store it; returns its id.
+
+        New messages use it when ``use_dictionary`` is set. zstd dictionaries
+        come from zstandard's trainer; for zlib the lines shared by most
+        samples are concatenated (zlib only looks back 32 KB).
+        """
+        algorithm = MessageCompression.algorithm()
+        size = MessageCompression.settings().get('dictionary_size', 65536)
+        rows = db.execute(
+            'SELECT content, content_encoding FROM messages ORDER BY id DESC LIMIT ?',
+            (sample_count,)).fetchall()
+        samples = [MessageCompression.decode(content, encoding, db).encode('utf-8')
+                   for content, encoding in rows]
+
+        if algorithm == 'zstd':
+            try:
+                data = zstandard.train_dictionary(size, samples).as_bytes()
+            except zstandard.ZstdError as e:
+                raise ValueError(f"Too few messages to train a dictionary: {e}")
+        else:
+            counts = Counter()
+            for sample in samples:
+                counts.update(set(sample.splitlines(keepends=True)))
+            # Most common lines go last, where zlib matches are cheapest
+            lines, length = [], 0
+            for line, count in counts.most_common():
+                if count < 2 or length + len(line) > min(size, 32768):
+                    break
+                lines.append(line)
+                length += len(line)
+            data = b''.join(reversed(lines))
+            if not data:
+                raise ValueError("Too few repeated lines in the messages to build a dictionary")
+
+        cursor = db.execute(
+            'INSERT INTO compression_dictionaries (algorithm, data, sample_count) VALUES (?, ?, ?)',
+            (algorithm, data, len(samples)))
+        db.commit()
+        return cursor.lastrowid
+
+    @staticmethod
+    def compress_messages(db, recompress=False, batch_size=500):
+        """Compress stored messages with the current settings, in batches.
+
+        Plain messages above the threshold are compressed; with
+        ``recompress`` already compressed ones are encoded again too (after
+        training a dictionary, or to store everything plain after disabling
+        compression). Returns (messages changed, bytes before, bytes after).
+        """
+        if recompress:
+            condition = 'content_encoding IS NOT NULL OR LENGTH(CAST(content AS BLOB)) >= ?'
+        else:
+            condition = 'content_encoding IS NULL AND LENGTH(CAST(content AS BLOB)) >= ?'
+        min_bytes = MessageCompression.settings().get('min_bytes', 1024)
+
+        changed = bytes_before = bytes_after = 0
+        last_id = 0
+        while True:
+            rows = db.execute(
+                f'SELECT id, content, content_encoding FROM messages WHERE id > ? AND ({condition}) '
+                'ORDER BY id LIMIT ?', (last_id, min_bytes, batch_size)).fetchall()
+            if not rows:
+                break
+            updates = []
+            for message_id, content, encoding in rows:
+                value, new_encoding = MessageCompression.encode(
+                    db, MessageCompression.decode(content, encoding, db))
+                if new_encoding is None and encoding is None:
+                    continue
+                updates.append((value, new_encoding, message_id))
+                bytes_before += len(content if encoding else content.encode('utf-8'))
+                bytes_after += len(value if new_encoding else value.encode('utf-8'))
+            db.executemany(
+                'UPDATE messages SET content = ?, content_encoding = ? WHERE id = ?', updates)
+            db.commit()
+            changed += len(updates)
+            last_id = rows[-1][0]
+        return changed, bytes_before, bytes_after
+
+
 class ConversationManager:
     """Enhanced conversation management with model tracking."""
 
@@ -639,21 +2504,76 @@ class ConversationManager:
         return cursor.lastrowid
 
     @staticmethod
-    def get_conversations():
-        """Get all conversations ordered by last update."""
+    def iter_conversations(include_archived=False):
+        """Yield all conversations ordered by last update, as they are read.
+
+        Runs on a dedicated connection, so the rows can be streamed after
+        the request handler has returned, and reads them in short pages, so
+        a slow client holds no transaction open.
+        """
+        db = sqlite3.connect(DATABASE_PATH)
+        try:
+            conversations = iter_newest_first(db, 'conversations', archived=False)
+            if include_archived:
+                # Archived conversations are older than the idle threshold,
+                # so they mostly sort after the hot ones
+                conversations = heapq.merge(conversations, ConversationArchive.get_conversations(db),
+                                            key=lambda conv: conv['updated_at'] or '', reverse=True)
+            yield from conversations
+        finally:
+            db.close()
+
+    @staticmethod
+    def list_version(include_archived=False):
+        """Values that change whenever the conversation list does.
+
+        Every change of a conversation sets its updated_at to the current
+        second, so besides the counters only the rows of the latest second
+        need to be compared in full.
+        """
         db = get_db()
-        return db.execute(
-            'SELECT * FROM conversations ORDER BY updated_at DESC'
-        ).fetchall()
+        version = tuple(db.execute('''
+            SELECT COUNT(*), MAX(id), MAX(updated_at),
+                   (SELECT group_concat(id || ':' || title || ':' || model || ':' || IFNULL(model_file, ''), '|')
+                    FROM conversations
+                    WHERE updated_at = (SELECT MAX(updated_at) FROM conversations))
+            FROM conversations
+        ''').fetchone())
+        if include_archived:
+            version += tuple(db.execute(
+                'SELECT COUNT(*), MAX(archived_at) FROM archived_conversations').fetchone())
+        return version
 
     @staticmethod
     def get_conversation(conversation_id):
-        """Get conversation by ID."""
+        """Get conversation by ID, restoring it first if it was archived."""
         db = get_db()
-        return db.execute(
+        conversation = db.execute(
             'SELECT * FROM conversations WHERE id = ?',
             (conversation_id,)
         ).fetchone()
+        if conversation is None and ConversationArchive.restore(db, conversation_id):
+            conversation = db.execute(
+                'SELECT * FROM conversations WHERE id = ?',
+                (conversation_id,)
+            ).fetchone()
+        return conversation
+
+    @staticmethod
+    def keyword_search(db, query, limit, schema='main'):
+        """Messages containing ``query`` (or in conversations titled so)."""
+        # Compressed messages are matched on their decompressed text
+        content_sql = MessageCompression.text_sql('m')
+        return db.execute(f'''
+            SELECT DISTINCT c.id, c.title, c.model, c.model_file, c.updated_at,
+                   m.id AS message_id, {content_sql} AS content, m.role, m.timestamp,
+                   m.response_time_ms, m.estimated_tokens
+            FROM {schema}.conversations c
+            JOIN {schema}.messages m ON c.id = m.conversation_id
+            WHERE {content_sql} LIKE ? OR c.title LIKE ?
+            ORDER BY c.updated_at DESC
+            LIMIT ?
+        ''', (f'%{query}%', f'%{query}%', limit)).fetchall()
 
     @staticmethod
     def update_conversation_timestamp(conversation_id):
@@ -681,28 +2601,130 @@ class ConversationManager:
         db = get_db()
         db.execute('DELETE FROM conversations WHERE id = ?',
                    (conversation_id,))
+        db.execute('DELETE FROM conversation_summaries WHERE conversation_id = ?',
+                   (conversation_id,))
         db.commit()
 
     @staticmethod
-    def add_message(conversation_id, role, content, model=None, model_file=None, response_time_ms=None, estimated_tokens=None):
-        """Add message to conversation with model info and metrics."""
+    def add_message(conversation_id, role, content, model=None, model_file=None, response_time_ms=None, estimated_tokens=None, timings=None, parent_id=None):
+        """Add message to conversation with model info and metrics.
+
+        The message is attached below ``parent_id`` (by default the end of
+        the active path) and becomes the new active leaf. Returns its id.
+        """
+        timings = timings or {}
         db = get_db()
-        db.execute(
-            'INSERT INTO messages (conversation_id, role, content, model, model_file, response_time_ms, estimated_tokens) VALUES (?, ?, ?, ?, ?, ?, ?)',
-            (conversation_id, role, content, model,
+        if parent_id is None:
+            parent_id = db.execute(
+                'SELECT active_leaf_id FROM conversations WHERE id = ?',
+                (conversation_id,)
+            ).fetchone()[0]
+        stored_content, content_encoding = MessageCompression.encode(db, content)
+        cursor = db.execute(
+            'INSERT INTO messages (conversation_id, parent_id, role, content, content_encoding, model, model_file, '
+            'response_time_ms, estimated_tokens, '
+            'prompt_tokens, cached_tokens, prompt_ms, prompt_per_second, predicted_ms, predicted_per_second) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (conversation_id, parent_id, role, stored_content, content_encoding, model,
              model_file, response_time_ms, estimated_tokens)
+            + tuple(timings.get(column) for column in MESSAGE_TIMING_COLUMNS)
+        )
+        if role == 'assistant':
+            UsageRollups.record(
+                db, model_file, response_time_ms, estimated_tokens)
+            SpeculativeDecoding.record(db, model_file, timings)
+        db.execute(
+            'UPDATE conversations SET active_leaf_id = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (cursor.lastrowid, conversation_id)
         )
         db.commit()
-        ConversationManager.update_conversation_timestamp(conversation_id)
+        EmbeddingIndex.schedule()
+        return cursor.lastrowid
+
+    @staticmethod
+    def get_messages(conversation_id, leaf_id=None):
+        """Get the messages on the active path (or the path to leaf_id)."""
+        return ConversationManager.get_path(get_db(), conversation_id, leaf_id)
+
+    @staticmethod
+    def get_path(db, conversation_id, leaf_id=None):
+        """Walk parent pointers from a leaf to the root, oldest message first.
+
+        Each step is a primary key lookup, so the cost depends on the path
+        length rather than on the number of branches.
+        """
+        if leaf_id is None:
+            row = db.execute(
+                'SELECT active_leaf_id FROM conversations WHERE id = ?',
+                (conversation_id,)
+            ).fetchone()
+            leaf_id = row[0] if row else None
+            if leaf_id is None:
+                return []
+        rows = db.execute('''
+            WITH RECURSIVE path(id) AS (
+                SELECT id FROM messages WHERE id = ? AND conversation_id = ?
+                UNION ALL
+                SELECT m.parent_id FROM messages m JOIN path ON m.id = path.id
+                WHERE m.parent_id IS NOT NULL
+            )
+            SELECT messages.* FROM messages JOIN path ON messages.id = path.id
+            ORDER BY messages.id
+        ''', (leaf_id, conversation_id)).fetchall()
+        return [MessageCompression.decode_row(db, row) for row in rows]
 
     @staticmethod
-    def get_messages(conversation_id):
-        """Get all messages for a conversation."""
+    def get_message(conversation_id, message_id):
+        """Get one message of a conversation."""
         db = get_db()
-        return db.execute(
-            'SELECT * FROM messages WHERE conversation_id = ? ORDER BY timestamp',
-            (conversation_id,)
+        row = db.execute(
+            'SELECT * FROM messages WHERE id = ? AND conversation_id = ?',
+            (message_id, conversation_id)
+        ).fetchone()
+        return MessageCompression.decode_row(db, row) if row else None
+
+    @staticmethod
+    def get_sibling_ids(conversation_id, messages):
+        """Map each message id to the ids of all alternatives at its position."""
+        if not messages:
+            return {}
+        db = get_db()
+        parent_ids = [msg['parent_id'] for msg in messages if msg['parent_id'] is not None]
+        rows = db.execute(
+            'SELECT id, parent_id FROM messages WHERE conversation_id = ? AND '
+            f"(parent_id IS NULL OR parent_id IN ({','.join('?' * len(parent_ids))})) ORDER BY id",
+            (conversation_id, *parent_ids)
         ).fetchall()
+        children = defaultdict(list)
+        for row in rows:
+            children[row['parent_id']].append(row['id'])
+        return {msg['id']: children[msg['parent_id']] for msg in messages}
+
+    @staticmethod
+    def set_active_branch(conversation_id, message_id):
+        """Show the most recent path through ``message_id``.
+
+        The new active leaf is the newest descendant of the message (or the
+        message itself), so switching back to a branch resumes where it
+        ended. Returns the leaf id, or None if the message does not exist.
+        """
+        db = get_db()
+        leaf_id = db.execute('''
+            WITH RECURSIVE subtree(id) AS (
+                SELECT id FROM messages WHERE id = ? AND conversation_id = ?
+                UNION ALL
+                SELECT m.id FROM messages m JOIN subtree ON m.parent_id = subtree.id
+            )
+            SELECT MAX(id) FROM subtree
+        ''', (message_id, conversation_id)).fetchone()[0]
+        if leaf_id is None:
+            return None
+        db.execute(
+            'UPDATE conversations SET active_leaf_id = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (leaf_id, conversation_id)
+        )
+        db.commit()
+        return leaf_id
 
     @staticmethod
     def get_conversation_stats(conversation_id):
@@ -720,195 +2742,3968 @@ class ConversationManager:
 
         return dict(stats) if stats else {}
 
-# Routes
 
+class ConversationArchive:
+    """Moves idle conversations into archive databases and back.
 
-@app.route('/')
-def index():
-    """Main chat interface."""
-    return render_template('index.html')
+    Conversations not updated for ``idle_days`` are moved in batches, with
+    their messages and summaries, into ``archive-<year>.db`` files (by year
+    of last activity), so the hot database and its indexes only hold
+    conversations in use. ``archived_conversations`` in the hot database
+    keeps what the conversation list needs. Archives are ATTACHed on demand:
+    by keyword search, and to move a conversation back when it is opened.
+    """
 
+    # (table, column holding the conversation id)
+    TABLES = (('conversations', 'id'), ('messages', 'conversation_id'),
+              ('conversation_summaries', 'conversation_id'))
 
-@app.route('/api/models/available')
-def api_available_models():
-    """Get all available models in the models directory."""
-    try:
-        models = ModelManager.get_available_models()
-        current_model = ModelManager.get_current_model()
+    _lock = threading.Lock()
+    _thread = None
 
-        return jsonify({
-            'models': models,
-            'current_model': current_model,
-            'count': len(models),
-            'models_dir': MODELS_DIR
-        })
-    except Exception as e:
-        logger.error(f"Error in /api/models/available endpoint: {e}")
-        return jsonify({
-            'models': [],
-            'current_model': None,
-            'count': 0,
-            'error': str(e),
-            'models_dir': MODELS_DIR
-        }), 500
+    @staticmethod
+    def settings():
+        return CONFIG.get('archive', {})
 
+    @staticmethod
+    def directory():
+        return ConversationArchive.settings().get('directory') or os.path.join(
+            os.path.dirname(os.path.abspath(DATABASE_PATH)), 'archive')
 
-@app.route('/api/models')
-def api_models():
-    """Get currently loaded model."""
-    try:
-        models = LlamaCppAPI.get_models()
-        current_model = ModelManager.get_current_model()
+    @staticmethod
+    def archive_files():
+        """Archive database files, newest year first."""
+        return sorted(glob.glob(os.path.join(ConversationArchive.directory(), 'archive-*.db')),
+                      reverse=True)
 
-        return jsonify({
-            'models': models,
-            'current_model': current_model,
-            'count': len(models),
-            'llamacpp_url': LLAMACPP_API_URL
-        })
-    except Exception as e:
-        logger.error(f"Error in /api/models endpoint: {e}")
-        return jsonify({
-            'models': [],
-            'current_model': None,
-            'count': 0,
-            'error': str(e),
-            'llamacpp_url': LLAMACPP_API_URL
-        }), 500
+    @staticmethod
+    @contextmanager
+    def attached(db, path):
+        """ATTACH an archive database as ``archive`` for the duration."""
+        db.commit()
+        db.execute('ATTACH DATABASE ? AS archive', (path,))
+        try:
+            yield
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            db.execute('DETACH DATABASE archive')
 
+    @staticmethod
+    def _upgrade(db):
+        """Add columns the hot database gained since the attached archive was created."""
+        for table, _ in ConversationArchive.TABLES:
+            archived = {row[1] for row in db.execute(f'PRAGMA archive.table_info({table})')}
+            for row in db.execute(f'PRAGMA main.table_info({table})').fetchall():
+                if row[1] not in archived:
+                    db.execute(f'ALTER TABLE archive.{table} ADD COLUMN {row[1]} {row[2]}')
 
-@app.route('/api/models/switch', methods=['POST'])
-def api_switch_model():
-    """Switch to a different model."""
-    try:
-        data = request.get_json()
-        model_name = data.get('model_name')
+    @staticmethod
+    def _move(db, source, target, conversation_ids):
+        placeholders = ','.join('?' * len(conversation_ids))
+        for table, key in ConversationArchive.TABLES:
+            target_columns = {row[1] for row in db.execute(f'PRAGMA {target}.table_info({table})')}
+            columns = ', '.join(row[1] for row in db.execute(f'PRAGMA {source}.table_info({table})')
+                                if row[1] in target_columns)
+            db.execute(f'INSERT OR REPLACE INTO {target}.{table} ({columns}) '
+                       f'SELECT {columns} FROM {source}.{table} WHERE {key} IN ({placeholders})',
+                       conversation_ids)
+            db.execute(f'DELETE FROM {source}.{table} WHERE {key} IN ({placeholders})',
+                       conversation_ids)
 
-        if not model_name:
-            return jsonify({'error': 'Model name is required'}), 400
+    @staticmethod
+    def archive_idle(db, idle_days=None):
+        """Archive all conversations idle for ``idle_days``; returns how many."""
+        settings = ConversationArchive.settings()
+        idle_days = settings.get('idle_days', 180) if idle_days is None else idle_days
+        cutoff = (datetime.utcnow() - timedelta(days=idle_days)).strftime('%Y-%m-%d %H:%M:%S')
+        os.makedirs(ConversationArchive.directory(), exist_ok=True)
+
+        archived = 0
+        while True:
+            rows = db.execute('''
+                SELECT c.id, c.title, c.model, c.model_file, c.created_at, c.updated_at,
+                       (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = c.id)
+                FROM conversations c
+                WHERE c.updated_at < ?
+                ORDER BY c.updated_at
+                LIMIT ?
+            ''', (cutoff, settings.get('batch_size', 200))).fetchall()
+            if not rows:
+                break
+
+            by_file = defaultdict(list)
+            for row in rows:
+                by_file[f"archive-{row[5][:4]}.db"].append(row)
+            for archive_file, group in by_file.items():
+                path = os.path.join(ConversationArchive.directory(), archive_file)
+                # Archives have the full schema, so each is a usable database
+                with sqlite3.connect(path) as conn:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(SCHEMA)
+                with ConversationArchive._lock, ConversationArchive.attached(db, path):
+                    ConversationArchive._upgrade(db)
+                    ConversationArchive._move(db, 'main', 'archive', [row[0] for row in group])
+                    db.executemany(
+                        'INSERT OR REPLACE INTO archived_conversations (id, title, model, model_file, '
+                        'created_at, updated_at, message_count, archive_file) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        [tuple(row) + (archive_file,) for row in group])
+                    db.commit()
+                METRICS.inc('llama_chat_conversations_archived_total',
+                            {'direction': 'archive'}, len(group))
+            archived += len(rows)
+        if archived:
+            logger.info(f"Archived {archived} conversations idle since {cutoff}")
+        return archived
 
-        # Find the model file
-        model_path = os.path.join(MODELS_DIR, model_name)
-        if not os.path.exists(model_path):
-            return jsonify({'error': f'Model file not found: {model_name}'}), 404
+    @staticmethod
+    def restore(db, conversation_id):
+        """Move an archived conversation back; False if it is not archived.
+
+        The conversation counts as updated now, so it is not archived
+        again before it has been idle for ``idle_days``.
+        """
+        row = db.execute('SELECT archive_file FROM archived_conversations WHERE id = ?',
+                         (conversation_id,)).fetchone()
+        if row is None:
+            return False
+        with ConversationArchive._lock, ConversationArchive.attached(
+                db, os.path.join(ConversationArchive.directory(), row[0])):
+            ConversationArchive._move(db, 'archive', 'main', [conversation_id])
+            db.execute('DELETE FROM archived_conversations WHERE id = ?', (conversation_id,))
+            db.execute('UPDATE conversations SET updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                       (conversation_id,))
+            db.commit()
+        METRICS.inc('llama_chat_conversations_archived_total', {'direction': 'restore'})
+        logger.info(f"Restored conversation {conversation_id} from {row[0]}")
+        return True
 
-        # Switch model
-        logger.info(f"Switching to model: {model_name}")
-        success = LlamaCppManager.switch_model(model_path)
+    @staticmethod
+    def get_conversations(db):
+        """Archived conversations for the conversation list, newest first (lazily)."""
+        return iter_newest_first(
+            db, 'archived_conversations',
+            'id, title, model, model_file, created_at, updated_at, message_count', archived=True)
 
-        if success:
-            # Verify the switch was successful
-            time.sleep(2)  # Give server time to fully initialize
-            current_model = ModelManager.get_current_model()
+    @staticmethod
+    def search(db, query, limit):
+        """Keyword search through the archives, newest archive first."""
+        results = []
+        for path in ConversationArchive.archive_files():
+            if len(results) >= limit:
+                break
+            with ConversationArchive.attached(db, path):
+                results.extend(dict(row, archived=True) for row in ConversationManager.keyword_search(
+                    db, query, limit - len(results), schema='archive'))
+        return results
 
-            return jsonify({
-                'success': True,
-                'message': f'Successfully switched to {model_name}',
-                'current_model': current_model,
-                'model_file': model_name
-            })
-        else:
-            return jsonify({
-                'error': f'Failed to switch to model: {model_name}',
-                'success': False
-            }), 500
+    @staticmethod
+    def start():
+        """Archive idle conversations periodically when enabled."""
+        if not ConversationArchive.settings().get('enabled', False):
+            return
+        if ConversationArchive._thread and ConversationArchive._thread.is_alive():
+            return
+        ConversationArchive._thread = threading.Thread(
+            target=ConversationArchive._run, name='conversation-archive', daemon=True)
+        ConversationArchive._thread.start()
 
-    except Exception as e:
-        logger.error(f"Error switching model: {e}")
-        return jsonify({
-            'error': f'Error switching model: {str(e)}',
-            'success': False
-        }), 500
+    @staticmethod
+    def _run():
+        # First pass shortly after startup, then every interval_hours
+        time.sleep(60)
+        lock = FileLock(DATABASE_PATH + '.archive.lock')
+        while True:
+            # With several workers, one archives while the others skip
+            if lock.acquire(blocking=False):
+                try:
+                    with sqlite3.connect(DATABASE_PATH) as db:
+                        ConversationArchive.archive_idle(db)
+                except Exception as e:
+                    logger.error(f"Archiving conversations failed: {e}", exc_info=True)
+                finally:
+                    lock.release()
+            time.sleep(ConversationArchive.settings().get('interval_hours', 24) * 3600)
 
 
-@app.route('/api/server/status')
-def api_server_status():
-    """Get server status and current model info."""
-    try:
-        is_running = LlamaCppManager.is_server_running()
-        current_model = ModelManager.get_current_model() if is_running else None
+class ConversationTransfer:
+    """Streaming NDJSON export and import of conversations.
 
-        return jsonify({
-            'server_running': is_running,
-            'current_model': current_model,
-            'llamacpp_url': LLAMACPP_API_URL
-        })
-    except Exception as e:
-        logger.error(f"Error checking server status: {e}")
-        return jsonify({
-            'server_running': False,
-            'current_model': None,
-            'error': str(e)
-        }), 500
+    An export is a header line followed by each conversation's record and
+    then its messages, oldest first, with message contents as plain text.
+    Export walks conversations and messages with two cursors ordered by
+    conversation id (a merge join over idx_messages_conversation), and
+    import inserts batches of whole conversations per transaction, so
+    memory use depends on the batch size rather than on the history.
+    Imported rows get new ids; parent and active leaf links are remapped.
+    """
 
-# Existing routes with enhanced model tracking...
+    FORMAT = 'llama-chat-export'
+    VERSION = 1
 
+    # Columns that refer to ids and are remapped on import
+    ID_COLUMNS = ('id', 'conversation_id', 'parent_id', 'active_leaf_id')
 
-@app.route('/api/conversations')
-def api_conversations():
-    """Get all conversations."""
-    try:
-        conversations = ConversationManager.get_conversations()
-        return jsonify({
-            'conversations': [dict(conv) for conv in conversations],
-            'success': True
-        })
-    except Exception as e:
-        logger.error(f"Error loading conversations: {e}")
-        return jsonify({
-            'conversations': [],
-            'error': f'Failed to load conversations: {str(e)}',
-            'success': False
-        }), 500
+    @staticmethod
+    def _filters(model=None, since=None, until=None):
+        conditions, params = [], []
+        if model:
+            conditions.append('(c.model_file = ? OR c.model = ?)')
+            params += [model, model]
+        if since:
+            conditions.append('c.updated_at >= ?')
+            params.append(since)
+        if until:
+            conditions.append('c.updated_at < ?')
+            params.append(until)
+        return ' AND '.join(conditions) or '1', params
 
+    @staticmethod
+    def _export_schema(db, schema, where, params):
+        conversations = db.execute(
+            f'SELECT c.* FROM {schema}.conversations c WHERE {where} ORDER BY c.id', params)
+        messages = db.execute(f'''
+            SELECT m.* FROM {schema}.messages m
+            WHERE m.conversation_id IN (SELECT c.id FROM {schema}.conversations c WHERE {where})
+            ORDER BY m.conversation_id, m.id
+        ''', params)
+        message = messages.fetchone()
+        for conversation in conversations:
+            yield json_bytes(dict(conversation, type='conversation')) + b'\n'
+            while message is not None and message['conversation_id'] <= conversation['id']:
+                if message['conversation_id'] == conversation['id']:
+                    yield json_bytes(dict(MessageCompression.decode_row(db, message),
+                                          type='message')) + b'\n'
+                message = messages.fetchone()
 
-@app.route('/api/conversations', methods=['POST'])
-def api_create_conversation():
-    """Create new conversation with model info."""
-    try:
-        data = request.get_json()
-        logger.info(f"Creating conversation with data: {data}")
+    @staticmethod
+    def export_lines(model=None, since=None, until=None, include_archived=True):
+        """Yield the export as NDJSON lines from a dedicated connection.
+
+        Each database (the hot one, then every archive) is read in one
+        transaction, so its conversations and messages are consistent. The
+        databases are in WAL mode, so the transaction does not block writers
+        for the duration of the download.
+        """
+        where, params = ConversationTransfer._filters(model, since, until)
+        db = sqlite3.connect(DATABASE_PATH)
+        db.row_factory = sqlite3.Row
+        try:
+            yield json_bytes({'type': 'header', 'format': ConversationTransfer.FORMAT,
+                              'version': ConversationTransfer.VERSION,
+                              'exported_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                              'filters': {'model': model, 'since': since, 'until': until}}) + b'\n'
+            db.execute('BEGIN')
+            yield from ConversationTransfer._export_schema(db, 'main', where, params)
+            db.commit()
+            if include_archived:
+                for path in ConversationArchive.archive_files():
+                    with ConversationArchive.attached(db, path):
+                        db.execute('BEGIN')
+                        yield from ConversationTransfer._export_schema(db, 'archive', where, params)
+                        db.commit()
+        finally:
+            db.close()
 
-        if not data:
-            data = {}
+    @staticmethod
+    def import_lines(db, lines, batch_size=5000, defer_indexes=False):
+        """Import an NDJSON export; returns counts of what was imported.
+
+        Conversations are committed in batches of about ``batch_size``
+        messages, never split across transactions. With ``defer_indexes``
+        the secondary indexes of conversations and messages are dropped for
+        the duration and rebuilt at the end, which is much faster for large
+        imports but slows down queries of a running app meanwhile.
+        """
+        columns = {table: [row[1] for row in db.execute(f'PRAGMA table_info({table})')
+                           if row[1] not in ConversationTransfer.ID_COLUMNS]
+                   for table in ('conversations', 'messages')}
+        conversation_sql = (
+            f"INSERT INTO conversations ({', '.join(columns['conversations'])}) "
+            f"VALUES ({', '.join('?' * len(columns['conversations']))})")
+        message_sql = (
+            f"INSERT INTO messages (id, conversation_id, parent_id, {', '.join(columns['messages'])}) "
+            f"VALUES (?, ?, ?, {', '.join('?' * len(columns['messages']))})")
+
+        indexes = []
+        if defer_indexes:
+            db.commit()
+            indexes = db.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                "AND tbl_name IN ('conversations', 'messages')").fetchall()
+            for name, _ in indexes:
+                db.execute(f'DROP INDEX {name}')
+            db.commit()
+
+        counts = {'conversations': 0, 'messages': 0}
+        state = {'next_id': None, 'rows': [], 'leaves': [], 'responses': [], 'conversations': 0}
+
+        def begin():
+            # Allocate message ids ourselves, past any id ever used (the
+            # sequence also covers archived and deleted messages)
+            db.execute('BEGIN IMMEDIATE')
+            state['next_id'] = max(
+                db.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0],
+                (db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()
+                 or (0,))[0]) + 1
+
+        def flush():
+            if state['next_id'] is None:
+                return
+            db.executemany(message_sql, state['rows'])
+            db.executemany('UPDATE conversations SET active_leaf_id = ? WHERE id = ?',
+                           state['leaves'])
+            UsageRollups.add_history(db, state['responses'])
+            db.commit()
+            counts['conversations'] += state['conversations']
+            counts['messages'] += len(state['rows'])
+            state.update(next_id=None, rows=[], leaves=[], responses=[], conversations=0)
+
+        conversation = None
+        try:
+            for line_number, line in enumerate(lines, 1):
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                if not line.strip():
+                    continue
+                try:
+                    record = json_loads(line)
+                    kind = record.pop('type')
+                except (ValueError, KeyError, AttributeError):
+                    raise ValueError(f"Line {line_number}: not an export record")
+
+                if kind == 'header':
+                    if record.get('format') != ConversationTransfer.FORMAT or \
+                            record.get('version', 0) > ConversationTransfer.VERSION:
+                        raise ValueError(f"Line {line_number}: unsupported export format")
+                    continue
+
+                if kind == 'conversation':
+                    if conversation is not None:
+                        state['leaves'].append((conversation['id_map'].get(conversation['leaf']),
+                                                conversation['id']))
+                    if len(state['rows']) >= batch_size:
+                        flush()
+                    if state['next_id'] is None:
+                        begin()
+                    cursor = db.execute(conversation_sql,
+                                        [record.get(column) for column in columns['conversations']])
+                    conversation = {'id': cursor.lastrowid, 'source_id': record.get('id'),
+                                    'leaf': record.get('active_leaf_id'), 'id_map': {}}
+                    state['conversations'] += 1
+                elif kind == 'message':
+                    if conversation is None or record.get('conversation_id') != conversation['source_id']:
+                        raise ValueError(f"Line {line_number}: message outside its conversation")
+                    if not isinstance(record.get('content'), str) or not record.get('role'):
+                        raise ValueError(f"Line {line_number}: message without role or content")
+                    message_id = state['next_id']
+                    state['next_id'] += 1
+                    if record.get('id') is not None:
+                        conversation['id_map'][record['id']] = message_id
+                    record['content'], record['content_encoding'] = MessageCompression.encode(
+                        db, record['content'])
+                    state['rows'].append(
+                        [message_id, conversation['id'], conversation['id_map'].get(record.get('parent_id'))]
+                        + [record.get(column) for column in columns['messages']])
+                    if record['role'] == 'assistant':
+                        state['responses'].append(
+                            (record.get('timestamp'), record.get('model_file'),
+                             record.get('response_time_ms'), record.get('estimated_tokens')))
+                else:
+                    raise ValueError(f"Line {line_number}: unknown record type {kind!r}")
+
+            if conversation is not None:
+                state['leaves'].append((conversation['id_map'].get(conversation['leaf']),
+                                        conversation['id']))
+            flush()
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            for _, sql in indexes:
+                db.execute(sql)
+            db.commit()
+
+        # Exports without a message tree become linear conversations
+        link_linear_conversations(db)
+        return counts
+
+
+class ConversationSummaries:
+    """Rolling summaries that bound the prompt size of long conversations.
+
+    Once the messages not covered by a summary exceed ``trigger_tokens``,
+    everything except the last ``keep_recent_messages`` is folded into a new
+    summary version on a background thread after the response has been
+    sent. Each version records the messages it covers and a hash of them,
+    so a summary whose source messages were edited or deleted no longer
+    matches and is skipped: edits, deletes and imports need not invalidate
+    anything.
+    """
+
+    SUMMARY_PROMPT = (
+        "Summarize the conversation below for your own later reference. Keep "
+        "facts, names, numbers, decisions, open questions and the user's "
+        "preferences; leave out pleasantries. Write at most {max_tokens} tokens "
+        "of plain prose.")
+
+    _lock = threading.Lock()
+    _queue = queue.Queue()
+    _pending = set()
+    _worker = None
 
-        title = data.get('title', 'New Chat')
-        model = data.get('model', 'unknown')
-        model_file = data.get('model_file')
+    @staticmethod
+    def settings():
+        return CONFIG.get('summarization', {})
 
-        # If no model_file provided, try to get current model
-        if not model_file:
-            try:
-                available_models = ModelManager.get_available_models()
-                current_model = ModelManager.get_current_model()
-                logger.info(
-                    f"Available models: {len(available_models)}, Current model: {current_model}")
+    @staticmethod
+    def source_hash(messages):
+        digest = hashlib.sha1()
+        for msg in messages:
+            digest.update(f"{msg['id']}\x00{msg['role']}\x00{msg['content']}\x01".encode())
+        return digest.hexdigest()
 
-                # Try to match current model to file
-                if current_model and available_models:
-                    for available_model in available_models:
-                        if current_model in available_model['name']:
-                            model_file = available_model['name']
-                            model = current_model
-                            break
+    @staticmethod
+    def _message_tokens(msg):
+        return msg['estimated_tokens'] or estimate_tokens(msg['content'])
 
-                # If no match found but we have available models, use the first one
-                if not model_file and available_models:
-                    model_file = available_models[0]['name']
-                    model = available_models[0]['name']
-                    logger.info(f"Using first available model: {model_file}")
+    # Summaries of other branches are skipped; only this many recent
+    # versions are tried against the current path
+    CANDIDATE_VERSIONS = 10
 
-            except Exception as e:
-                logger.warning(f"Error detecting current model: {e}")
-                # Continue with default values
-                pass
+    @staticmethod
+    def _valid_summary(db, conversation_id, messages):
+        """Newest summary whose covered messages match ``messages``.
+
+        A summary of another branch, or one whose messages were edited or
+        deleted since, does not match and is not used.
+        """
+        candidates = db.execute(
+            'SELECT * FROM conversation_summaries WHERE conversation_id = ? '
+            'ORDER BY version DESC LIMIT ?',
+            (conversation_id, ConversationSummaries.CANDIDATE_VERSIONS)
+        ).fetchall()
+        for summary in candidates:
+            covered = [msg for msg in messages if msg['id'] <= summary['covered_through_id']]
+            if len(covered) == summary['covered_count'] and \
+                    ConversationSummaries.source_hash(covered) == summary['source_hash']:
+                return summary
+        return None
+
+    @staticmethod
+    def build_context(db, conversation_id, messages):
+        """Return (history, summary row) to generate a response from.
+
+        ``messages`` are the conversation's messages in order, excluding the
+        new prompt. Without a usable summary the full history is returned
+        and generate_response applies context_history_limit.
+        """
+        if not ConversationSummaries.settings().get('enabled', False):
+            summary = None
+        else:
+            summary = ConversationSummaries._valid_summary(db, conversation_id, messages)
+        if summary is not None:
+            messages = [msg for msg in messages if msg['id'] > summary['covered_through_id']]
+        history = [{'role': msg['role'], 'content': msg['content']} for msg in messages]
+        return history, summary
+
+    @staticmethod
+    def schedule(conversation_id, model_file=None):
+        """Queue a background check whether the conversation needs compacting."""
+        if not ConversationSummaries.settings().get('enabled', False):
+            return
+        with ConversationSummaries._lock:
+            if conversation_id in ConversationSummaries._pending:
+                return
+            ConversationSummaries._pending.add(conversation_id)
+            ConversationSummaries._queue.put((conversation_id, model_file))
+            if ConversationSummaries._worker is None or not ConversationSummaries._worker.is_alive():
+                ConversationSummaries._worker = threading.Thread(
+                    target=ConversationSummaries._run, name='conversation-summaries', daemon=True)
+                ConversationSummaries._worker.start()
+
+    @staticmethod
+    def _run():
+        while True:
+            conversation_id, model_file = ConversationSummaries._queue.get()
+            with ConversationSummaries._lock:
+                ConversationSummaries._pending.discard(conversation_id)
+            try:
+                with sqlite3.connect(DATABASE_PATH, factory=InstrumentedConnection) as db:
+                    db.row_factory = sqlite3.Row
+                    ConversationSummaries.compact(db, conversation_id, model_file)
+            except Exception as e:
+                logger.error(f"Summarizing conversation {conversation_id} failed: {e}")
+
+    @staticmethod
+    def compact(db, conversation_id, model_file=None):
+        """Fold older messages into a new summary version if over the threshold.
+
+        Returns the new version number, or None when nothing was done.
+        """
+        settings = ConversationSummaries.settings()
+        messages = ConversationManager.get_path(db, conversation_id)
+
+        summary = ConversationSummaries._valid_summary(db, conversation_id, messages)
+        covered_through = summary['covered_through_id'] if summary else 0
+        uncovered = [msg for msg in messages if msg['id'] > covered_through]
+        if sum(ConversationSummaries._message_tokens(msg) for msg in uncovered) \
+                <= settings.get('trigger_tokens', 2048):
+            return None
+
+        keep = max(0, settings.get('keep_recent_messages', 6))
+        to_fold = uncovered[:len(uncovered) - keep] if keep else uncovered
+        if not to_fold:
+            return None
+
+        max_tokens = settings.get('max_summary_tokens', 256)
+        transcript = '\n\n'.join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in to_fold)
+        if summary:
+            transcript = f"Summary so far:\n{summary['content']}\n\nNew messages:\n\n{transcript}"
+
+        start = time.perf_counter()
+        response = post_json(
+            f"{LLAMACPP_API_URL}/v1/chat/completions",
+            {
+                "messages": [
+                    {"role": "system", "content": ConversationSummaries.SUMMARY_PROMPT.format(
+                        max_tokens=max_tokens)},
+                    {"role": "user", "content": transcript}
+                ],
+                "temperature": 0.2,
+                "max_tokens": max_tokens,
+                "stream": False
+            },
+            timeout=ConfigWatcher.current().timeouts
+        )
+        response.raise_for_status()
+        data = json_loads(response.content)
+        content = data['choices'][0]['message']['content'].strip()
+        generation_ms = int((time.perf_counter() - start) * 1000)
+        if not content:
+            return None
+
+        covered = [msg for msg in messages if msg['id'] <= to_fold[-1]['id']]
+        version = db.execute(
+            'SELECT COALESCE(MAX(version), 0) FROM conversation_summaries WHERE conversation_id = ?',
+            (conversation_id,)).fetchone()[0] + 1
+        db.execute(
+            'INSERT INTO conversation_summaries (conversation_id, version, content, covered_through_id, '
+            'covered_count, source_hash, summary_tokens, model_file, generation_ms) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (conversation_id, version, content, to_fold[-1]['id'], len(covered),
+             ConversationSummaries.source_hash(covered),
+             data.get('usage', {}).get('completion_tokens') or estimate_tokens(content),
+             model_file, generation_ms))
+        db.commit()
+        logger.info(
+            f"Summarized {len(to_fold)} messages of conversation {conversation_id} "
+            f"into version {version} in {generation_ms} ms")
+        return version
+
+
+class EmbeddingIndex:
+    """Semantic search over messages with a local embedding model.
+
+    A second llama-server started with ``--embedding`` embeds messages in
+    batches on a background thread, incrementally by message id. Vectors are
+    L2-normalized and appended to a raw float32 matrix (``vectors.f32``) with
+    a parallel int64 id map (``ids.i64``); ``meta.json`` records how many
+    rows are complete. Queries memory-map the matrix and scan it in chunks
+    with NumPy, so cosine similarity is a dot product and memory use stays
+    bounded at millions of rows. Requires NumPy; without it semantic search
+    is unavailable and keyword search is used.
+    """
+
+    SCAN_CHUNK_ROWS = 65536
+
+    _lock = threading.Lock()
+    _write_lock = threading.Lock()
+    _wake = threading.Event()
+    _worker = None
+    _matrix = None
+    _last_error = None
+
+    @staticmethod
+    def settings():
+        return CONFIG.get('semantic_search', {})
+
+    @staticmethod
+    def index_dir():
+        return EmbeddingIndex.settings().get('index_dir') or os.path.join(
+            os.path.dirname(os.path.abspath(DATABASE_PATH)), 'embeddings')
+
+    @staticmethod
+    def model_path():
+        model = EmbeddingIndex.settings().get('model')
+        if not model:
+            return None
+        return model if os.path.isabs(model) else os.path.join(MODELS_DIR, model)
+
+    @staticmethod
+    def is_enabled():
+        """Semantic search is configured and NumPy is installed."""
+        model_path = EmbeddingIndex.model_path()
+        return bool(np is not None and EmbeddingIndex.settings().get('enabled', False)
+                    and model_path and os.path.exists(model_path))
+
+    @staticmethod
+    def server_url():
+        return f"http://{LLAMACPP_HOST}:{EmbeddingIndex.settings().get('port', 8081)}"
+
+    @staticmethod
+    def pid_file():
+        base, ext = os.path.splitext(LLAMACPP_PID_FILE)
+        return f"{base}-embedding{ext or '.pid'}"
+
+    @staticmethod
+    def server_up():
+        try:
+            return requests.get(f"{EmbeddingIndex.server_url()}/health", timeout=1).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    @staticmethod
+    def ensure_server():
+        """Start the embedding llama-server unless it already answers."""
+        if EmbeddingIndex.server_up():
+            return True
+
+        # Workers share one embedding server
+        with FileLock(EmbeddingIndex.pid_file() + '.lock'):
+            if EmbeddingIndex.server_up():
+                return True
+
+            settings = EmbeddingIndex.settings()
+            ctx_size = settings.get('ctx_size', 2048)
+            cmd = [
+                "llama-server",
+                "--model", EmbeddingIndex.model_path(),
+                "--host", LLAMACPP_HOST,
+                "--port", str(settings.get('port', 8081)),
+                "--embedding",
+                "--ctx-size", str(ctx_size),
+                # Each input must fit in one micro-batch
+                "--batch-size", str(ctx_size),
+                "--ubatch-size", str(ctx_size),
+                "--threads", str(settings.get('threads', 2))
+            ]
+            logger.info(f"Starting embedding server: {' '.join(cmd)}")
+            script_dir = os.path.dirname(os.path.abspath(__file__))
+            with open(os.path.join(script_dir, "llamacpp-embedding.log"), "a") as log_file:
+                process = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT,
+                                           cwd=script_dir)
+            with open(EmbeddingIndex.pid_file(), 'w') as f:
+                f.write(str(process.pid))
+
+            for _ in range(120):
+                time.sleep(0.5)
+                if process.poll() is not None:
+                    logger.error(f"Embedding server exited with code {process.returncode}")
+                    return False
+                if EmbeddingIndex.server_up():
+                    return True
+            logger.error("Embedding server did not become ready")
+            return False
+
+    @staticmethod
+    def stop_server():
+        try:
+            with open(EmbeddingIndex.pid_file()) as f:
+                os.kill(int(f.read().strip()), signal.SIGTERM)
+        except (OSError, ValueError):
+            pass
+        try:
+            os.remove(EmbeddingIndex.pid_file())
+        except OSError:
+            pass
+
+    @staticmethod
+    def embed(texts):
+        """Return L2-normalized float32 embeddings of ``texts`` as rows."""
+        max_chars = EmbeddingIndex.settings().get('max_chars', 2000)
+        response = post_json(
+            f"{EmbeddingIndex.server_url()}/v1/embeddings",
+            {"input": [text[:max_chars] or ' ' for text in texts]},
+            timeout=ConfigWatcher.current().timeouts
+        )
+        response.raise_for_status()
+        data = sorted(json_loads(response.content)['data'], key=lambda item: item['index'])
+        vectors = np.asarray([item['embedding'] for item in data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @staticmethod
+    def _paths():
+        directory = EmbeddingIndex.index_dir()
+        return (os.path.join(directory, 'vectors.f32'), os.path.join(directory, 'ids.i64'),
+                os.path.join(directory, 'meta.json'))
+
+    @staticmethod
+    def read_meta():
+        try:
+            with open(EmbeddingIndex._paths()[2]) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_meta(meta):
+        path = EmbeddingIndex._paths()[2]
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _open_meta():
+        """Meta of the index for the configured model, resetting a stale one.
+
+        Bytes past the recorded row count (an append interrupted by a crash)
+        are truncated.
+        """
+        vectors_path, ids_path, _ = EmbeddingIndex._paths()
+        model_file = os.path.basename(EmbeddingIndex.model_path())
+        meta = EmbeddingIndex.read_meta()
+        if meta is None or meta.get('model_file') != model_file:
+            os.makedirs(EmbeddingIndex.index_dir(), exist_ok=True)
+            for path in (vectors_path, ids_path):
+                open(path, 'wb').close()
+            meta = {'model_file': model_file, 'dimensions': None, 'count': 0, 'last_message_id': 0}
+            EmbeddingIndex._write_meta(meta)
+            EmbeddingIndex._matrix = None
+            return meta
+
+        dimensions = meta['dimensions'] or 0
+        for path, row_bytes in ((vectors_path, dimensions * 4), (ids_path, 8)):
+            if os.path.getsize(path) > meta['count'] * row_bytes:
+                with open(path, 'r+b') as f:
+                    f.truncate(meta['count'] * row_bytes)
+        return meta
+
+    @staticmethod
+    def _append(meta, ids, vectors):
+        vectors_path, ids_path, _ = EmbeddingIndex._paths()
+        for path, array in ((vectors_path, vectors), (ids_path, np.asarray(ids, dtype=np.int64))):
+            with open(path, 'ab') as f:
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        meta.update(dimensions=int(vectors.shape[1]), count=meta['count'] + len(ids),
+                    last_message_id=int(ids[-1]))
+        EmbeddingIndex._write_meta(meta)
+        EmbeddingIndex._matrix = None
+
+    @staticmethod
+    @contextmanager
+    def _writer():
+        """Serialize appends between threads and processes (app and CLI)."""
+        with EmbeddingIndex._write_lock:
+            os.makedirs(EmbeddingIndex.index_dir(), exist_ok=True)
+            with open(os.path.join(EmbeddingIndex.index_dir(), 'index.lock'), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    @staticmethod
+    def index_pending(max_batches=None):
+        """Embed messages newer than the index in batches; returns how many."""
+        batch_size = EmbeddingIndex.settings().get('batch_size', 32)
+        indexed = 0
+        with sqlite3.connect(DATABASE_PATH) as db:
+            batches = 0
+            while max_batches is None or batches < max_batches:
+                with EmbeddingIndex._writer():
+                    meta = EmbeddingIndex._open_meta()
+                    rows = db.execute(
+                        'SELECT id, content, content_encoding FROM messages WHERE id > ? ORDER BY id LIMIT ?',
+                        (meta['last_message_id'], batch_size)).fetchall()
+                    if not rows:
+                        break
+                    vectors = EmbeddingIndex.embed(
+                        [MessageCompression.decode(content, encoding, db) for _, content, encoding in rows])
+                    if meta['dimensions'] not in (None, vectors.shape[1]):
+                        raise ValueError(
+                            f"Embedding size changed from {meta['dimensions']} to {vectors.shape[1]}")
+                    EmbeddingIndex._append(meta, [row[0] for row in rows], vectors)
+                indexed += len(rows)
+                batches += 1
+        return indexed
+
+    @staticmethod
+    def schedule():
+        """Wake the background indexer (after new messages were stored)."""
+        if not EmbeddingIndex.is_enabled():
+            return
+        with EmbeddingIndex._lock:
+            if EmbeddingIndex._worker is None or not EmbeddingIndex._worker.is_alive():
+                EmbeddingIndex._worker = threading.Thread(
+                    target=EmbeddingIndex._run, name='embedding-index', daemon=True)
+                EmbeddingIndex._worker.start()
+        EmbeddingIndex._wake.set()
+
+    @staticmethod
+    def _run():
+        while True:
+            EmbeddingIndex._wake.wait(EmbeddingIndex.settings().get('index_interval_seconds', 60))
+            EmbeddingIndex._wake.clear()
+            if not EmbeddingIndex.is_enabled():
+                continue
+            try:
+                if EmbeddingIndex.ensure_server():
+                    indexed = EmbeddingIndex.index_pending()
+                    if indexed:
+                        logger.info(f"Embedded {indexed} messages")
+                    EmbeddingIndex._last_error = None
+            except Exception as e:
+                EmbeddingIndex._last_error = str(e)
+                logger.error(f"Embedding messages failed: {e}")
+
+    @staticmethod
+    def _load_matrix():
+        """Memory-mapped (vectors, ids) of the complete rows, or None."""
+        meta = EmbeddingIndex.read_meta()
+        if not meta or not meta['count']:
+            return None
+        with EmbeddingIndex._lock:
+            # Another process (embed-messages) may have grown the index
+            if EmbeddingIndex._matrix is None or len(EmbeddingIndex._matrix[1]) != meta['count']:
+                vectors_path, ids_path, _ = EmbeddingIndex._paths()
+                EmbeddingIndex._matrix = (
+                    np.memmap(vectors_path, dtype=np.float32, mode='r',
+                              shape=(meta['count'], meta['dimensions'])),
+                    np.memmap(ids_path, dtype=np.int64, mode='r', shape=(meta['count'],)))
+            return EmbeddingIndex._matrix
+
+    @staticmethod
+    def search(query, k=50, extra_ids=()):
+        """Top-k (message_id, cosine) pairs for ``query``.
+
+        Cosines of ``extra_ids`` (e.g. keyword hits) are returned as well, in
+        a dict, so hybrid ranking can score them without a second scan.
+        Returns ([], {}) while the index is empty.
+        """
+        matrix = EmbeddingIndex._load_matrix()
+        if matrix is None:
+            return [], {}
+        vectors, ids = matrix
+        query_vector = EmbeddingIndex.embed([query])[0]
+
+        best_scores, best_rows = [], []
+        for start in range(0, len(ids), EmbeddingIndex.SCAN_CHUNK_ROWS):
+            scores = vectors[start:start + EmbeddingIndex.SCAN_CHUNK_ROWS] @ query_vector
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_scores.append(scores[top])
+            best_rows.append(top + start)
+        scores = np.concatenate(best_scores)
+        rows = np.concatenate(best_rows)
+        order = np.argsort(-scores)[:k]
+        hits = [(int(ids[rows[i]]), float(scores[i])) for i in order]
+
+        # Ids are appended in ascending order, so they can be binary searched
+        extra = {}
+        if extra_ids:
+            wanted = np.asarray(sorted(extra_ids), dtype=np.int64)
+            positions = np.searchsorted(ids, wanted)
+            for message_id, position in zip(wanted, positions):
+                if position < len(ids) and ids[position] == message_id:
+                    extra[int(message_id)] = float(vectors[position] @ query_vector)
+        return hits, extra
+
+    @staticmethod
+    def get_status():
+        meta = EmbeddingIndex.read_meta() or {}
+        vectors_path = EmbeddingIndex._paths()[0]
+        status = {
+            'enabled': EmbeddingIndex.settings().get('enabled', False),
+            'numpy_available': np is not None,
+            'model_file': EmbeddingIndex.settings().get('model'),
+            'indexed_messages': meta.get('count', 0),
+            'last_message_id': meta.get('last_message_id', 0),
+            'dimensions': meta.get('dimensions'),
+            'size_bytes': os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0,
+            'last_error': EmbeddingIndex._last_error
+        }
+        if has_request_context():
+            status['pending_messages'] = get_db().execute(
+                'SELECT COUNT(*) FROM messages WHERE id > ?', (status['last_message_id'],)
+            ).fetchone()[0]
+        return status
+
+
+def latency_bucket_index(response_time_ms):
+    """Return the histogram bucket index for a response time."""
+    for index, upper_bound in enumerate(LATENCY_BUCKETS_MS):
+        if response_time_ms <= upper_bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+
+def percentile_from_histogram(counts, quantile, max_value=None):
+    """Estimate a percentile by interpolating inside histogram buckets."""
+    total = sum(counts)
+    if total == 0:
+        return None
+
+    rank = quantile * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count == 0:
+            continue
+        if cumulative + count >= rank:
+            lower = LATENCY_BUCKETS_MS[index - 1] if index > 0 else 0
+            if index < len(LATENCY_BUCKETS_MS):
+                upper = LATENCY_BUCKETS_MS[index]
+            else:
+                upper = max_value if max_value is not None else lower
+            if max_value is not None:
+                upper = min(upper, max(max_value, lower))
+            fraction = (rank - cumulative) / count
+            return int(lower + (upper - lower) * fraction)
+        cumulative += count
+    return max_value
+
+
+class UsageRollups:
+    """Incrementally maintained per-model usage aggregates."""
+
+    @staticmethod
+    def record(db, model_file, response_time_ms, tokens):
+        """Fold one assistant response into the hourly and daily rollups.
+
+        Runs on the caller's connection so it commits together with the
+        message insert.
+        """
+        model_file = model_file or ''
+        response_time_ms = int(response_time_ms or 0)
+        tokens = int(tokens or 0)
+        bucket = latency_bucket_index(response_time_ms)
+
+        for granularity, bucket_format in ROLLUP_GRANULARITIES.items():
+            db.execute('''
+                INSERT INTO usage_rollups (granularity, bucket_start, model_file, request_count,
+                                           total_tokens, total_response_time_ms, max_response_time_ms)
+                VALUES (?, strftime(?, 'now'), ?, 1, ?, ?, ?)
+                ON CONFLICT(granularity, bucket_start, model_file) DO UPDATE SET
+                    request_count = request_count + 1,
+                    total_tokens = total_tokens + excluded.total_tokens,
+                    total_response_time_ms = total_response_time_ms + excluded.total_response_time_ms,
+                    max_response_time_ms = MAX(max_response_time_ms, excluded.max_response_time_ms)
+            ''', (granularity, bucket_format, model_file, tokens,
+                  response_time_ms, response_time_ms))
+            db.execute('''
+                INSERT INTO usage_latency_histogram (granularity, bucket_start, model_file, bucket, count)
+                VALUES (?, strftime(?, 'now'), ?, ?, 1)
+                ON CONFLICT(granularity, bucket_start, model_file, bucket) DO UPDATE SET
+                    count = count + 1
+            ''', (granularity, bucket_format, model_file, bucket))
+
+    @staticmethod
+    def backfill(conn):
+        """Rebuild the rollups from the assistant messages already stored."""
+        cursor = conn.execute('''
+            SELECT timestamp, COALESCE(model_file, ''), response_time_ms, estimated_tokens
+            FROM messages
+            WHERE role = 'assistant'
+        ''')
+        rollup_rows = UsageRollups.add_history(conn, cursor)
+        if rollup_rows:
+            conn.commit()
+            logger.info(
+                f"Backfilled {rollup_rows} usage rollup rows from message history")
+
+    @staticmethod
+    def add_history(conn, responses):
+        """Fold past assistant responses into the rollups at their timestamps.
+
+        ``responses`` yields (timestamp, model_file, response_time_ms,
+        tokens). Does not commit; returns the number of rollup rows touched.
+        """
+        rollups = defaultdict(lambda: [0, 0, 0, 0])
+        histogram = defaultdict(int)
+
+        for timestamp, model_file, response_time_ms, tokens in responses:
+            model_file = model_file or ''
+            if not timestamp:
+                continue
+            response_time_ms = int(response_time_ms or 0)
+            tokens = int(tokens or 0)
+            bucket = latency_bucket_index(response_time_ms)
+            bucket_starts = {
+                'hour': f"{timestamp[:13]}:00:00",
+                'day': timestamp[:10]
+            }
+            for granularity, bucket_start in bucket_starts.items():
+                totals = rollups[(granularity, bucket_start, model_file)]
+                totals[0] += 1
+                totals[1] += tokens
+                totals[2] += response_time_ms
+                totals[3] = max(totals[3], response_time_ms)
+                histogram[(granularity, bucket_start,
+                           model_file, bucket)] += 1
+
+        conn.executemany('''
+            INSERT INTO usage_rollups (granularity, bucket_start, model_file, request_count,
+                                       total_tokens, total_response_time_ms, max_response_time_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(granularity, bucket_start, model_file) DO UPDATE SET
+                request_count = request_count + excluded.request_count,
+                total_tokens = total_tokens + excluded.total_tokens,
+                total_response_time_ms = total_response_time_ms + excluded.total_response_time_ms,
+                max_response_time_ms = MAX(max_response_time_ms, excluded.max_response_time_ms)
+        ''', [key + tuple(totals) for key, totals in rollups.items()])
+        conn.executemany('''
+            INSERT INTO usage_latency_histogram (granularity, bucket_start, model_file, bucket, count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(granularity, bucket_start, model_file, bucket) DO UPDATE SET
+                count = count + excluded.count
+        ''', [key + (count,) for key, count in histogram.items()])
+        return len(rollups)
+
+    @staticmethod
+    def get_stats(granularity='day', since=None, model_file=None):
+        """Read rollup buckets and per-model totals without touching messages."""
+        db = get_db()
+        filters = ['granularity = ?']
+        params = [granularity]
+        if since:
+            filters.append('bucket_start >= ?')
+            params.append(since)
+        if model_file is not None:
+            filters.append('model_file = ?')
+            params.append(model_file)
+        where = ' AND '.join(filters)
+
+        histograms = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+        for row in db.execute(
+            f'SELECT bucket_start, model_file, bucket, count FROM usage_latency_histogram WHERE {where}',
+            params
+        ):
+            key = (row['bucket_start'], row['model_file'])
+            histograms[key][row['bucket']] += row['count']
+
+        rows = db.execute(
+            f'SELECT * FROM usage_rollups WHERE {where} ORDER BY bucket_start, model_file',
+            params
+        ).fetchall()
+
+        buckets = []
+        model_totals = {}
+        for row in rows:
+            counts = histograms[(row['bucket_start'], row['model_file'])]
+            buckets.append(UsageRollups._summarize(
+                row['request_count'], row['total_tokens'],
+                row['total_response_time_ms'], row['max_response_time_ms'],
+                counts, bucket_start=row['bucket_start'],
+                model_file=row['model_file'] or None))
+
+            totals = model_totals.setdefault(row['model_file'], {
+                'request_count': 0,
+                'total_tokens': 0,
+                'total_response_time_ms': 0,
+                'max_response_time_ms': 0,
+                'counts': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            })
+            totals['request_count'] += row['request_count']
+            totals['total_tokens'] += row['total_tokens']
+            totals['total_response_time_ms'] += row['total_response_time_ms']
+            totals['max_response_time_ms'] = max(
+                totals['max_response_time_ms'], row['max_response_time_ms'])
+            totals['counts'] = [total + count for total,
+                                count in zip(totals['counts'], counts)]
+
+        models = [
+            UsageRollups._summarize(
+                totals['request_count'], totals['total_tokens'],
+                totals['total_response_time_ms'], totals['max_response_time_ms'],
+                totals['counts'], model_file=name or None)
+            for name, totals in sorted(model_totals.items())
+        ]
+
+        return {'buckets': buckets, 'models': models}
+
+    @staticmethod
+    def _summarize(request_count, total_tokens, total_response_time_ms,
+                   max_response_time_ms, counts, **fields):
+        """Build the API representation of one aggregate."""
+        fields.update({
+            'request_count': request_count,
+            'total_tokens': total_tokens,
+            'avg_response_time_ms': round(total_response_time_ms / request_count) if request_count else None,
+            'max_response_time_ms': max_response_time_ms,
+            'p50_response_time_ms': percentile_from_histogram(counts, 0.50, max_response_time_ms),
+            'p95_response_time_ms': percentile_from_histogram(counts, 0.95, max_response_time_ms),
+            'p99_response_time_ms': percentile_from_histogram(counts, 0.99, max_response_time_ms),
+            'tokens_per_second': round(total_tokens / (total_response_time_ms / 1000), 2) if total_response_time_ms else None
+        })
+        return fields
+
+
+# Fixed prompts used to benchmark models, covering a short question, a long
+# prompt (prompt-eval heavy) and code generation
+BENCHMARK_PROMPTS = [
+    "Explain in three sentences what a hash table is.",
+    "Summarize the following text in two sentences:\n\n" + (
+        "Large language models run on commodity CPUs by quantizing their weights "
+        "to four or five bits, which shrinks memory use and speeds up matrix "
+        "multiplication at a small cost in quality. The prompt is evaluated in "
+        "batches, while generation produces one token at a time, so prompt "
+        "evaluation speed and generation speed are measured separately. " * 6),
+    "Write a Python function that returns the n-th Fibonacci number iteratively."
+]
+BENCHMARK_MAX_TOKENS = 128
+
+
+class RateLimiter:
+    """Per-client token buckets and usage accounting.
+
+    Clients are identified by the ``identity_header`` request header when
+    it is configured and present, otherwise by IP address. Chats draw a
+    request from the ``chat`` bucket and tokens from the ``tokens`` bucket,
+    model switches a request from the ``switch`` bucket. Levels live in the
+    database, so every worker and restart sees the same buckets.
+
+    Admission happens before any call to llama-server: the estimated tokens
+    of the new message are reserved, and settle() later replaces the
+    reservation with the prompt and completion tokens llama-server reported.
+    A client whose prompts were larger than estimated is left in debt and
+    waits for the bucket to refill. Usage is counted per client and day
+    even when limits are not enforced.
+    """
+
+    @staticmethod
+    def settings():
+        return CONFIG.get('rate_limits', {})
+
+    @staticmethod
+    def client_id():
+        """Identity of the client of the current request."""
+        header = RateLimiter.settings().get('identity_header')
+        identity = request.headers.get(header) if header else None
+        return (identity or request.remote_addr or 'unknown')[:200]
+
+    @staticmethod
+    def buckets(scope):
+        """(bucket, capacity, refill per second) for the buckets ``scope`` draws from."""
+        settings = RateLimiter.settings()
+        if scope == 'switch':
+            buckets = [('switch', settings.get('switch_burst', 5),
+                        settings.get('switches_per_hour', 20) / 3600)]
+        else:
+            buckets = [('chat', settings.get('request_burst', 10),
+                        settings.get('requests_per_minute', 20) / 60),
+                       ('tokens', settings.get('token_burst', 50000),
+                        settings.get('tokens_per_minute', 20000) / 60)]
+        # A rate of 0 disables the bucket
+        return [bucket for bucket in buckets if bucket[2] > 0]
+
+    @staticmethod
+    def _level(db, client_id, bucket, capacity, rate, now):
+        row = db.execute('SELECT level, updated_at FROM rate_limit_buckets WHERE client_id = ? AND bucket = ?',
+                         (client_id, bucket)).fetchone()
+        if row is None:
+            return capacity
+        return min(capacity, row[0] + (now - row[1]) * rate)
+
+    @staticmethod
+    def _count(db, client_id, scope, requests=0, rejected=0, prompt_tokens=0, completion_tokens=0):
+        db.execute('''
+            INSERT INTO client_usage (client_id, day, scope, requests, rejected,
+                                      prompt_tokens, completion_tokens)
+            VALUES (?, strftime('%Y-%m-%d', 'now'), ?, ?, ?, ?, ?)
+            ON CONFLICT(client_id, day, scope) DO UPDATE SET
+                requests = requests + excluded.requests,
+                rejected = rejected + excluded.rejected,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens
+        ''', (client_id, scope, requests, rejected, prompt_tokens, completion_tokens))
+
+    @staticmethod
+    def admit(scope, tokens=0):
+        """Take a request, and reserve ``tokens``, from the client's buckets.
+
+        Returns a grant for settle(); when ``allowed`` is False it names the
+        exhausted ``reason`` (requests, tokens or daily_quota) and the
+        seconds until a retry can succeed. Nothing is taken from the
+        buckets of a rejected request.
+        """
+        settings = RateLimiter.settings()
+        grant = {'client_id': RateLimiter.client_id(), 'scope': scope,
+                 'reserved': None, 'allowed': True}
+        enforce = settings.get('enabled', True)
+        now = time.time()
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            levels = {}
+            for bucket, capacity, rate in RateLimiter.buckets(scope) if enforce else ():
+                level = RateLimiter._level(db, grant['client_id'], bucket, capacity, rate, now)
+                # Prompts larger than the bucket pass once it is full
+                cost = min(max(tokens, 1), capacity) if bucket == 'tokens' else 1
+                if level < cost:
+                    grant.update(allowed=False, reason='tokens' if bucket == 'tokens' else 'requests',
+                                 retry_after=math.ceil((cost - level) / rate))
+                    break
+                levels[bucket] = level - (tokens if bucket == 'tokens' else 1)
+
+            quota = settings.get('daily_token_quota', 0)
+            if grant['allowed'] and enforce and quota and scope == 'chat':
+                used = db.execute(
+                    "SELECT SUM(prompt_tokens + completion_tokens) FROM client_usage "
+                    "WHERE client_id = ? AND day = strftime('%Y-%m-%d', 'now')",
+                    (grant['client_id'],)).fetchone()[0] or 0
+                if used >= quota:
+                    midnight = (datetime.utcnow() + timedelta(days=1)).replace(
+                        hour=0, minute=0, second=0, microsecond=0)
+                    grant.update(allowed=False, reason='daily_quota',
+                                 retry_after=math.ceil((midnight - datetime.utcnow()).total_seconds()))
+
+            if grant['allowed']:
+                db.executemany(
+                    'INSERT OR REPLACE INTO rate_limit_buckets (client_id, bucket, level, updated_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    [(grant['client_id'], bucket, level, now) for bucket, level in levels.items()])
+                if 'tokens' in levels:
+                    grant['reserved'] = tokens
+            RateLimiter._count(db, grant['client_id'], scope, requests=int(grant['allowed']),
+                               rejected=int(not grant['allowed']))
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+
+        if not grant['allowed']:
+            METRICS.inc('llama_chat_rate_limited_total', {'scope': scope, 'reason': grant['reason']})
+            logger.info(f"Rate limited {grant['client_id']} ({scope}, {grant['reason']}), "
+                        f"retry after {grant['retry_after']}s")
+        return grant
+
+    @staticmethod
+    def settle(grant, prompt_tokens, completion_tokens):
+        """Charge the tokens a response used in place of the reservation.
+
+        Only the first call for a grant counts, so handlers can settle an
+        admitted grant with nothing on every exit path after the real one.
+        """
+        if grant.get('settled'):
+            return
+        grant['settled'] = True
+        prompt_tokens, completion_tokens = int(prompt_tokens or 0), int(completion_tokens or 0)
+        db = get_db()
+        if grant['reserved'] is not None:
+            db.execute('UPDATE rate_limit_buckets SET level = level - ? WHERE client_id = ? AND bucket = ?',
+                       (prompt_tokens + completion_tokens - grant['reserved'], grant['client_id'], 'tokens'))
+        RateLimiter._count(db, grant['client_id'], grant['scope'], prompt_tokens=prompt_tokens,
+                           completion_tokens=completion_tokens)
+        db.commit()
+
+    @staticmethod
+    def settle_response(grant, response_data, prompt_tokens):
+        """settle() for a generate_response() result; failed generations cost nothing."""
+        if response_data.get('prompt_tokens') is None and response_data.get('timings') is None:
+            RateLimiter.settle(grant, 0, 0)
+        else:
+            RateLimiter.settle(grant, response_data.get('prompt_tokens') or prompt_tokens,
+                               response_data.get('completion_tokens') or response_data['estimated_tokens'])
+
+    @staticmethod
+    def rejection(grant):
+        """429 response for a rejected grant."""
+        messages = {
+            'requests': 'Too many requests',
+            'tokens': 'Token rate limit exceeded',
+            'daily_quota': 'Daily token quota used up'
+        }
+        response = jsonify({
+            'error': f"{messages[grant['reason']]}, retry in {grant['retry_after']}s",
+            'reason': grant['reason'],
+            'retry_after': grant['retry_after'],
+            'success': False
+        })
+        response.headers['Retry-After'] = str(grant['retry_after'])
+        return response, 429
+
+    @staticmethod
+    def status(db, client_id):
+        """Bucket levels and today's usage of a client."""
+        now = time.time()
+        buckets = {}
+        for scope in ('chat', 'switch'):
+            for bucket, capacity, rate in RateLimiter.buckets(scope):
+                buckets[bucket] = {
+                    'level': round(RateLimiter._level(db, client_id, bucket, capacity, rate, now), 1),
+                    'capacity': capacity,
+                    'refill_per_minute': round(rate * 60, 2)
+                }
+        today = {row['scope']: dict(row) for row in db.execute(
+            "SELECT scope, requests, rejected, prompt_tokens, completion_tokens FROM client_usage "
+            "WHERE client_id = ? AND day = strftime('%Y-%m-%d', 'now')", (client_id,))}
+        return {
+            'client_id': client_id,
+            'enforced': RateLimiter.settings().get('enabled', True),
+            'buckets': buckets,
+            'daily_token_quota': RateLimiter.settings().get('daily_token_quota', 0) or None,
+            'today': today
+        }
+
+    @staticmethod
+    def usage(db, days=7):
+        """Usage per client over the last ``days`` days, heaviest first."""
+        return [dict(row) for row in db.execute('''
+            SELECT client_id,
+                   SUM(requests) AS requests,
+                   SUM(rejected) AS rejected,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   MAX(day) AS last_day
+            FROM client_usage
+            WHERE day >= strftime('%Y-%m-%d', 'now', ?)
+            GROUP BY client_id
+            ORDER BY SUM(prompt_tokens + completion_tokens) DESC, SUM(requests) DESC
+        ''', (f'-{days - 1} days',)).fetchall()]
+
+
+def read_peak_rss_mb(pid):
+    """Return the peak resident set size of a process in MB (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def read_llamacpp_pid():
+    """Return the PID recorded by start_server, if any."""
+    try:
+        with open(LLAMACPP_PID_FILE) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+class ModelBenchmark:
+    """Benchmarks available models and keeps the results for the model list."""
+
+    _lock = threading.Lock()
+    _job = {'state': 'idle'}
+
+    @staticmethod
+    def benchmark_model(model):
+        """Load one model and run the fixed prompt set against it."""
+        result = {
+            'model_file': model['name'],
+            'size_bytes': model['size_bytes'],
+            'load_time_ms': None,
+            'prompt_tokens_per_second': None,
+            'generation_tokens_per_second': None,
+            'peak_rss_mb': None,
+            'prompts': len(BENCHMARK_PROMPTS),
+            'error': None
+        }
+
+        LlamaCppManager.stop_server()
+        load_start = time.time()
+        if not LlamaCppManager.start_server(model['file_path']):
+            result['error'] = 'Failed to start llama-server with this model'
+            return result
+        result['load_time_ms'] = int((time.time() - load_start) * 1000)
+
+        prompt_tokens = prompt_ms = predicted_tokens = predicted_ms = 0
+        for prompt in BENCHMARK_PROMPTS:
+            try:
+                response = post_json(
+                    f"{LLAMACPP_API_URL}/v1/chat/completions",
+                    {
+                        "messages": [{"role": "user", "content": prompt}],
+                        "max_tokens": BENCHMARK_MAX_TOKENS,
+                        "temperature": 0,
+                        "cache_prompt": False
+                    },
+                    timeout=ConfigWatcher.current().timeouts
+                )
+                response.raise_for_status()
+                timings = json_loads(response.content).get('timings') or {}
+            except Exception as e:
+                result['error'] = f'Benchmark request failed: {e}'
+                break
+            prompt_tokens += timings.get('prompt_n') or 0
+            prompt_ms += timings.get('prompt_ms') or 0
+            predicted_tokens += timings.get('predicted_n') or 0
+            predicted_ms += timings.get('predicted_ms') or 0
+
+        if prompt_ms:
+            result['prompt_tokens_per_second'] = round(
+                prompt_tokens / (prompt_ms / 1000), 2)
+        if predicted_ms:
+            result['generation_tokens_per_second'] = round(
+                predicted_tokens / (predicted_ms / 1000), 2)
+
+        pid = read_llamacpp_pid()
+        if pid:
+            result['peak_rss_mb'] = read_peak_rss_mb(pid)
+        return result
+
+    @staticmethod
+    def run(model_names=None, progress=None):
+        """Benchmark the selected (default: all) models and store the results.
+
+        The previously loaded model is restored afterwards.
+        """
+        models = ModelManager.get_available_models()
+        if model_names:
+            models = [m for m in models if m['name'] in model_names]
+
+        previous_model = ModelManager.get_current_model()
+        results = []
+        with LlamaCppManager.lifecycle('benchmarking'):
+            try:
+                for index, model in enumerate(models):
+                    if progress:
+                        progress(index, len(models), model['name'])
+                    logger.info(f"Benchmarking model: {model['name']}")
+                    result = ModelBenchmark.benchmark_model(model)
+                    ModelBenchmark.save_result(result)
+                    results.append(result)
+            finally:
+                # Restore the model even if it was not benchmarked itself
+                if previous_model and models:
+                    previous_path = os.path.join(MODELS_DIR, previous_model)
+                    if os.path.exists(previous_path):
+                        LlamaCppManager.switch_model(previous_path)
+        return results
+
+    @staticmethod
+    def save_result(result):
+        with sqlite3.connect(DATABASE_PATH) as conn:
+            conn.execute('''
+                INSERT INTO model_benchmarks (model_file, size_bytes, load_time_ms, prompt_tokens_per_second,
+                                              generation_tokens_per_second, peak_rss_mb, prompts, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (result['model_file'], result['size_bytes'], result['load_time_ms'],
+                  result['prompt_tokens_per_second'], result['generation_tokens_per_second'],
+                  result['peak_rss_mb'], result['prompts'], result['error']))
+            conn.commit()
+
+    @staticmethod
+    def get_latest_results(db):
+        """Latest successful benchmark per model file."""
+        rows = db.execute('''
+            SELECT b.* FROM model_benchmarks b
+            JOIN (
+                SELECT model_file, MAX(id) AS id FROM model_benchmarks
+                WHERE error IS NULL GROUP BY model_file
+            ) latest ON latest.id = b.id
+        ''').fetchall()
+        return {row['model_file']: dict(row) for row in rows}
+
+    @staticmethod
+    def start_job(model_names=None):
+        """Run a benchmark on a background thread; False if one is running."""
+        with ModelBenchmark._lock:
+            if ModelBenchmark._job['state'] == 'running':
+                return False
+            ModelBenchmark._job = {
+                'state': 'running',
+                'started_at': datetime.now().isoformat(timespec='seconds'),
+                'completed': 0,
+                'total': None,
+                'current_model': None,
+                'results': []
+            }
+
+        def progress(index, total, model_name):
+            ModelBenchmark._job.update(
+                completed=index, total=total, current_model=model_name)
+
+        def worker():
+            try:
+                results = ModelBenchmark.run(model_names, progress)
+                ModelBenchmark._job.update(
+                    state='finished', results=results, completed=len(results),
+                    current_model=None)
+            except Exception as e:
+                logger.error(f"Model benchmark failed: {e}", exc_info=True)
+                ModelBenchmark._job.update(state='failed', error=str(e))
+            ModelBenchmark._job['finished_at'] = datetime.now().isoformat(
+                timespec='seconds')
+
+        threading.Thread(target=worker, name='model-benchmark',
+                         daemon=True).start()
+        return True
+
+    @staticmethod
+    def get_job():
+        return dict(ModelBenchmark._job)
+
+
+# Sampling options a batch item may set for its own request
+BATCH_ITEM_OPTIONS = ('temperature', 'top_p', 'top_k', 'min_p', 'max_tokens', 'stop', 'seed',
+                      'repeat_penalty', 'presence_penalty', 'frequency_penalty')
+
+
+class BatchJobs:
+    """Offline batch inference over a JSONL file of prompts.
+
+    Every input line is an object with a ``prompt`` and optionally an
+    ``id``, a ``model`` file, a ``system`` prompt and sampling ``options``.
+    Items are grouped by model, the loaded model first, so llama-server is
+    switched once per model; within a group ``concurrency`` requests run at
+    a time to keep the server's parallel slots busy. Nothing is written to
+    the conversations.
+
+    Results are appended to the output file as they arrive, and the output
+    file is the checkpoint: a resumed job keeps the results that succeeded
+    and runs the other items again. Status and counters live in
+    ``batch_jobs``, so every worker can report and cancel a job; one job
+    runs at a time, the others wait in the queue.
+    """
+
+    # Statuses of a job that a live process is working on
+    ACTIVE = ('queued', 'running', 'cancelling')
+    RETRY_DELAY_SECONDS = 2
+
+    run_lock = FileLock(DATABASE_PATH + '.batch.lock')
+
+    @staticmethod
+    def settings():
+        return CONFIG.get('batch', {})
+
+    @staticmethod
+    def directory():
+        """Where jobs submitted through the API keep their input and results."""
+        return BatchJobs.settings().get('directory') or os.path.join(
+            os.path.dirname(os.path.abspath(DATABASE_PATH)), 'batch')
+
+    @staticmethod
+    def results_path(input_path):
+        return os.path.splitext(input_path)[0] + '.results.jsonl'
+
+    @staticmethod
+    def read_items(path):
+        """Parse and check the items of an input file.
+
+        Items are numbered by their line in the file; blank lines are
+        skipped. Raises ValueError for the first invalid line.
+        """
+        items = []
+        with open(path, 'rb') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json_loads(line)
+                except ValueError as e:
+                    raise ValueError(f"Line {line_number}: invalid JSON ({e})")
+                if not isinstance(item, dict) or not isinstance(item.get('prompt'), str) \
+                        or not item['prompt'].strip():
+                    raise ValueError(f"Line {line_number}: expected an object with a prompt")
+                if not isinstance(item.get('system', ''), (str, type(None))):
+                    raise ValueError(f"Line {line_number}: system must be text")
+                options = item.get('options') or {}
+                if not isinstance(options, dict) or set(options) - set(BATCH_ITEM_OPTIONS):
+                    raise ValueError(f"Line {line_number}: options may only set "
+                                     f"{', '.join(BATCH_ITEM_OPTIONS)}")
+                items.append({
+                    'line': line_number,
+                    'id': item.get('id', line_number),
+                    'prompt': item['prompt'],
+                    'model': item.get('model'),
+                    'system': item.get('system'),
+                    'options': options
+                })
+        return items
+
+    @staticmethod
+    def create(db, input_path, output_path=None, model_file=None, concurrency=None):
+        """Check an input file and queue a job for it; returns the job id.
+
+        ``model_file`` is used for items that name no model; without it they
+        run on the model loaded when the job starts.
+        """
+        input_path = os.path.abspath(input_path)
+        items = BatchJobs.read_items(input_path)
+        if not items:
+            raise ValueError('The input file holds no prompts')
+        available = {model['name'] for model in ModelManager.get_available_models()}
+        unknown = ({model_file} | {item['model'] for item in items}) - available - {None}
+        if unknown:
+            raise ValueError(f"Models not found in {MODELS_DIR}: {', '.join(sorted(unknown))}")
+        concurrency = concurrency or BatchJobs.settings().get('concurrency', 4)
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        cursor = db.execute('''
+            INSERT INTO batch_jobs (input_path, output_path, model_file, concurrency, pid, total_items)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (input_path, os.path.abspath(output_path or BatchJobs.results_path(input_path)),
+              model_file, concurrency, os.getpid(), len(items)))
+        db.commit()
+        logger.info(f"Batch job {cursor.lastrowid} queued: {len(items)} prompts from {input_path}")
+        return cursor.lastrowid
+
+    @staticmethod
+    def _describe(row):
+        job = dict(row)
+        # The process of an active job died: it can be resumed
+        if job['status'] in BatchJobs.ACTIVE and not pid_alive(job['pid']):
+            job['status'] = 'interrupted'
+        return job
+
+    @staticmethod
+    def get_job(db, job_id):
+        row = db.execute('SELECT * FROM batch_jobs WHERE id = ?', (job_id,)).fetchone()
+        return BatchJobs._describe(row) if row else None
+
+    @staticmethod
+    def list_jobs(db, limit=50):
+        return [BatchJobs._describe(row) for row in db.execute(
+            'SELECT * FROM batch_jobs ORDER BY id DESC LIMIT ?', (limit,))]
+
+    @staticmethod
+    def cancel(db, job_id):
+        """Stop a job after the requests in flight; False if it is not active."""
+        job = BatchJobs.get_job(db, job_id)
+        if not job or job['status'] not in BatchJobs.ACTIVE + ('interrupted',):
+            return False
+        if job['status'] == 'interrupted':
+            db.execute("UPDATE batch_jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+                       "WHERE id = ?", (job_id,))
+        else:
+            db.execute("UPDATE batch_jobs SET status = 'cancelling' WHERE id = ?", (job_id,))
+        db.commit()
+        return True
+
+    @staticmethod
+    def resume(db, job_id):
+        """Queue a stopped job again, or a finished one with failed items.
+
+        Returns False when the job is active or has nothing left to run.
+        """
+        row = db.execute('SELECT status, pid FROM batch_jobs WHERE id = ?', (job_id,)).fetchone()
+        job = BatchJobs.get_job(db, job_id)
+        if not job or job['status'] in BatchJobs.ACTIVE or \
+                (job['status'] == 'finished' and not job['failed_items']):
+            return False
+        # Only one of several concurrent resumes wins
+        resumed = db.execute('''
+            UPDATE batch_jobs SET status = 'queued', pid = ?, error = NULL, finished_at = NULL
+            WHERE id = ? AND status = ? AND pid IS ?
+        ''', (os.getpid(), job_id, row['status'], row['pid'])).rowcount
+        db.commit()
+        return resumed == 1
+
+    @staticmethod
+    def start(job_id):
+        """Run a queued job on a background thread of this process."""
+        threading.Thread(target=BatchJobs.run, args=(job_id,),
+                         name=f'batch-job-{job_id}', daemon=True).start()
+
+    @staticmethod
+    def run(job_id, progress=None):
+        """Run a queued job to the end and return its final status.
+
+        Waits while another job runs. ``progress`` is called with the job
+        whenever its counters are updated.
+        """
+        with BatchJobs.run_lock, sqlite3.connect(DATABASE_PATH, timeout=30) as db:
+            db.row_factory = sqlite3.Row
+            claimed = db.execute('''
+                UPDATE batch_jobs SET status = 'running', pid = ?, started_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+            ''', (os.getpid(), job_id)).rowcount
+            db.commit()
+            if not claimed:
+                # Cancelled while it waited
+                db.execute("UPDATE batch_jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+                           "WHERE id = ? AND status = 'cancelling'", (job_id,))
+                db.commit()
+                return BatchJobs.get_job(db, job_id)['status']
+
+            error = None
+            try:
+                status = BatchJobs._run(db, BatchJobs.get_job(db, job_id), progress)
+            except Exception as e:
+                logger.error(f"Batch job {job_id} failed: {e}", exc_info=True)
+                status, error = 'failed', str(e)
+            db.execute('''
+                UPDATE batch_jobs SET status = ?, error = ?, current_model = NULL,
+                                      finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, error, job_id))
+            db.commit()
+            job = BatchJobs.get_job(db, job_id)
+        logger.info(f"Batch job {job_id} {status}: {job['completed_items']} of {job['total_items']} "
+                    f"prompts completed, {job['failed_items']} failed")
+        return status
+
+    @staticmethod
+    def _checkpoint(output_path):
+        """Lines of the items that already have a result.
+
+        Failed results, and a line cut short by a crash, are dropped from
+        the output file so that those items run again.
+        """
+        done = set()
+        if not os.path.exists(output_path):
+            return done
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(output_path, 'rb') as source, open(temp_path, 'wb') as target:
+            for line in source:
+                try:
+                    result = json_loads(line)
+                except ValueError:
+                    continue
+                if isinstance(result, dict) and result.get('error') is None:
+                    done.add(result['line'])
+                    target.write(line if line.endswith(b'\n') else line + b'\n')
+        os.replace(temp_path, output_path)
+        return done
+
+    @staticmethod
+    def _run(db, job, progress):
+        items = BatchJobs.read_items(job['input_path'])
+        done = BatchJobs._checkpoint(job['output_path'])
+        loaded = ModelManager.get_current_model()
+        groups = {}
+        for item in items:
+            if item['line'] in done:
+                continue
+            model_file = item['model'] or job['model_file'] or loaded
+            if not model_file:
+                raise ValueError('No model given for the prompts and none is loaded')
+            groups.setdefault(model_file, []).append(item)
+        logger.info(f"Batch job {job['id']}: {sum(map(len, groups.values()))} of {len(items)} "
+                    f"prompts to run on {len(groups)} model(s)")
+
+        counts = {'completed': len(done), 'failed': 0}
+        cancelled = False
+        last_update = 0
+        pool = concurrent.futures.ThreadPoolExecutor(
+            job['concurrency'], thread_name_prefix=f"batch-{job['id']}")
+        try:
+            with open(job['output_path'], 'ab') as output:
+                # The loaded model first, the others in the order they are used
+                for model_file in sorted(groups, key=lambda name: name != loaded):
+                    if cancelled or not BatchJobs._update(db, job, counts, model_file, progress):
+                        cancelled = True
+                        break
+                    model_path = os.path.join(MODELS_DIR, model_file)
+                    if BatchJobs._ensure_model(model_path):
+                        futures = {pool.submit(BatchJobs._generate, item, model_path)
+                                   for item in groups[model_file]}
+                    else:
+                        futures = set()
+                        for item in groups[model_file]:
+                            output.write(json_bytes(BatchJobs._result(
+                                item, model_file, {'response': f'Could not load {model_file}'})) + b'\n')
+                        counts['failed'] += len(groups[model_file])
+
+                    while futures:
+                        finished, futures = concurrent.futures.wait(
+                            futures, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in finished:
+                            if future.cancelled():
+                                continue
+                            result = future.result()
+                            output.write(json_bytes(result) + b'\n')
+                            counts['failed' if result['error'] else 'completed'] += 1
+                            METRICS.inc('llama_chat_batch_items_total',
+                                        {'outcome': 'error' if result['error'] else 'success'})
+                        output.flush()
+                        if time.time() - last_update >= 1:
+                            os.fsync(output.fileno())
+                            last_update = time.time()
+                            if not cancelled and not BatchJobs._update(db, job, counts, model_file, progress):
+                                # Requests in flight finish and keep their results
+                                cancelled = True
+                                for future in futures:
+                                    future.cancel()
+                os.fsync(output.fileno())
+        finally:
+            # Prompts still queued are dropped when the job stops early
+            pool.shutdown(cancel_futures=True)
+        BatchJobs._update(db, job, counts, None, progress)
+        return 'cancelled' if cancelled else 'finished'
+
+    @staticmethod
+    def _update(db, job, counts, model_file, progress):
+        """Store the counters; False once the job is being cancelled."""
+        db.execute('''
+            UPDATE batch_jobs SET completed_items = ?, failed_items = ?, current_model = ?
+            WHERE id = ?
+        ''', (counts['completed'], counts['failed'], model_file, job['id']))
+        db.commit()
+        job = BatchJobs.get_job(db, job['id'])
+        if progress:
+            progress(job)
+        return job['status'] != 'cancelling'
+
+    @staticmethod
+    def _ensure_model(model_path):
+        """Load ``model_path`` unless llama-server already serves it."""
+        if ModelManager.get_current_model() == os.path.basename(model_path):
+            return True
+        return LlamaCppManager.switch_model(model_path)
+
+    @staticmethod
+    def _generate(item, model_path):
+        """Run one item, retrying failed requests, and return its result."""
+        model_file = os.path.basename(model_path)
+        started = time.time()
+        max_attempts = max(1, BatchJobs.settings().get('max_attempts', 3))
+        for attempt in range(1, max_attempts + 1):
+            # A chat may have switched to another model meanwhile
+            if not BatchJobs._ensure_model(model_path):
+                response = {'response': f'Could not load {model_file}'}
+            else:
+                response = LlamaCppAPI.generate_response(
+                    model_file, item['prompt'], system_prompt=item['system'],
+                    options=dict(item['options'], stream=False))
+                if response.get('timings') is not None:
+                    break
+            if attempt < max_attempts:
+                time.sleep(BatchJobs.RETRY_DELAY_SECONDS)
+        return BatchJobs._result(item, model_file, response, attempt, started)
+
+    @staticmethod
+    def _result(item, model_file, response, attempts=0, started=None):
+        """Output line of an item."""
+        failed = response.get('timings') is None
+        return {
+            'line': item['line'],
+            'id': item['id'],
+            'model': model_file,
+            'response': None if failed else response['response'],
+            'error': response['response'] if failed else None,
+            'attempts': attempts,
+            'prompt_tokens': response.get('prompt_tokens'),
+            'completion_tokens': response.get('completion_tokens'),
+            'response_time_ms': response.get('response_time_ms'),
+            'total_time_ms': int((time.time() - started) * 1000) if started else None,
+            'timings': response.get('timings'),
+            'finished_at': datetime.now().isoformat(timespec='seconds')
+        }
+
+
+# GGUF metadata value types (see gguf.h in ggml)
+GGUF_SCALAR_FORMATS = {
+    0: '<B', 1: '<b', 2: '<H', 3: '<h', 4: '<I', 5: '<i',
+    6: '<f', 7: '<?', 10: '<Q', 11: '<q', 12: '<d'
+}
+GGUF_TYPE_STRING = 8
+GGUF_TYPE_ARRAY = 9
+# Arrays longer than this (e.g. the tokenizer vocabulary) are skipped and
+# only their length is reported
+GGUF_MAX_ARRAY_ITEMS = 64
+
+
+def read_gguf_metadata(path, hash_arrays=False):
+    """Read the key/value metadata header of a GGUF model file.
+
+    Long arrays are returned as ``{'type': ..., 'length': ...}``, with a
+    ``sha1`` of their contents when ``hash_arrays`` is set (used to compare
+    tokenizer vocabularies). Returns None if the file is not a readable
+    GGUF file.
+    """
+    def read(f, fmt):
+        size = struct.calcsize(fmt)
+        data = f.read(size)
+        if len(data) != size:
+            raise ValueError('Unexpected end of GGUF header')
+        return struct.unpack(fmt, data)[0]
+
+    def read_string(f):
+        return f.read(read(f, '<Q')).decode('utf-8', errors='replace')
+
+    def read_value(f, value_type):
+        if value_type == GGUF_TYPE_STRING:
+            return read_string(f)
+        if value_type == GGUF_TYPE_ARRAY:
+            item_type = read(f, '<I')
+            length = read(f, '<Q')
+            if length <= GGUF_MAX_ARRAY_ITEMS:
+                return [read_value(f, item_type) for _ in range(length)]
+            summary = {'type': item_type, 'length': length}
+            digest = hashlib.sha1() if hash_arrays else None
+            if item_type in GGUF_SCALAR_FORMATS:
+                size = length * struct.calcsize(GGUF_SCALAR_FORMATS[item_type])
+                if digest:
+                    digest.update(f.read(size))
+                else:
+                    f.seek(size, os.SEEK_CUR)
+            else:
+                for _ in range(length):
+                    value = read_value(f, item_type)
+                    if digest:
+                        digest.update(repr(value).encode())
+            if digest:
+                summary['sha1'] = digest.hexdigest()
+            return summary
+        return read(f, GGUF_SCALAR_FORMATS[value_type])
+
+    try:
+        with open(path, 'rb') as f:
+            if f.read(4) != b'GGUF':
+                return None
+            version = read(f, '<I')
+            count_format = '<I' if version == 1 else '<Q'
+            read(f, count_format)  # tensor count
+            metadata = {}
+            for _ in range(read(f, count_format)):
+                key = read_string(f)
+                metadata[key] = read_value(f, read(f, '<I'))
+            return metadata
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logger.warning(f"Could not read GGUF metadata from {path}: {e}")
+        return None
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def _read_meminfo():
+    """Return /proc/meminfo as a dict of MB values."""
+    meminfo = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                meminfo[key] = int(value.split()[0]) // 1024
+    except (OSError, ValueError):
+        pass
+    return meminfo
+
+
+def _cgroup_cpu_limit():
+    """CPU quota of this process' cgroup in CPUs, or None if unlimited."""
+    quota = _read_first_line('/sys/fs/cgroup/cpu.max')
+    if quota:
+        value, period = quota.split()
+        if value != 'max':
+            return int(value) / int(period)
+        return None
+    value = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if value and period and int(value) > 0:
+        return int(value) / int(period)
+    return None
+
+
+def _cgroup_memory_available_mb():
+    """Memory left under this process' cgroup limit in MB, or None."""
+    for limit_path, usage_path in (
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+             '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        limit = _read_first_line(limit_path)
+        if not limit or limit == 'max':
+            continue
+        limit = int(limit)
+        if limit >= 1 << 60:  # cgroup v1 reports "unlimited" as a huge number
+            return None
+        usage = int(_read_first_line(usage_path) or 0)
+        return max(0, limit - usage) // (1024 * 1024)
+    return None
+
+
+def detect_hardware():
+    """Describe the CPUs and memory this process may actually use."""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = list(range(os.cpu_count() or 1))
+
+    # Physical cores are distinct (package, core) pairs among usable CPUs
+    cores = set()
+    for cpu in cpus:
+        topology = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        core_id = _read_first_line(f'{topology}/core_id')
+        package_id = _read_first_line(f'{topology}/physical_package_id')
+        if core_id is None:
+            cores = None
+            break
+        cores.add((package_id, core_id))
+
+    cpu_model = None
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu_model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+
+    meminfo = _read_meminfo()
+    memory_available_mb = meminfo.get('MemAvailable')
+    cgroup_memory_mb = _cgroup_memory_available_mb()
+    if cgroup_memory_mb is not None:
+        memory_available_mb = min(memory_available_mb or cgroup_memory_mb, cgroup_memory_mb)
+
+    memlock_limit_mb = None
+    try:
+        import resource
+        soft_limit = resource.getrlimit(resource.RLIMIT_MEMLOCK)[0]
+        if soft_limit != resource.RLIM_INFINITY:
+            memlock_limit_mb = soft_limit // (1024 * 1024)
+    except (ImportError, ValueError, OSError):
+        pass
+
+    return {
+        'hostname': socket.gethostname(),
+        'cpu_model': cpu_model,
+        'logical_cpus': os.cpu_count(),
+        'usable_cpus': len(cpus),
+        'physical_cores': len(cores) if cores else len(cpus),
+        'cgroup_cpu_limit': _cgroup_cpu_limit(),
+        'numa_nodes': len(glob.glob('/sys/devices/system/node/node[0-9]*')) or 1,
+        'memory_total_mb': meminfo.get('MemTotal'),
+        'memory_available_mb': memory_available_mb,
+        'memlock_limit_mb': memlock_limit_mb
+    }
+
+
+class LaunchTuner:
+    """Chooses llama-server launch parameters for a model on this host."""
+
+    # Memory kept free for the OS, the Flask app and llama.cpp compute buffers
+    RESERVED_MEMORY_MB = 512
+    MIN_CTX_SIZE = 512
+    CALIBRATION_PROMPT = "Write a short paragraph about the history of computing."
+    CALIBRATION_MAX_TOKENS = 64
+
+    @staticmethod
+    def config_params():
+        """Launch parameters taken as-is from config.json."""
+        threads = CONFIG['performance']['num_thread']
+        if threads == -1:
+            threads = os.cpu_count() or 4
+        return {
+            'threads': threads,
+            'ctx_size': CONFIG['model_options']['num_ctx'],
+            'batch_size': CONFIG['performance']['batch_size'],
+            'gpu_layers': CONFIG['performance']['num_gpu']
+        }
+
+    @staticmethod
+    def host_id(hardware):
+        """Stable identifier of the hardware a tuning was computed for."""
+        fingerprint = '|'.join(str(hardware.get(key)) for key in (
+            'hostname', 'cpu_model', 'usable_cpus', 'physical_cores',
+            'cgroup_cpu_limit', 'numa_nodes', 'memory_total_mb'))
+        return hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def kv_bytes_per_token(metadata):
+        """KV cache size per context token (f16 cache) from GGUF metadata."""
+        if not metadata:
+            return None
+        arch = metadata.get('general.architecture')
+        n_layer = metadata.get(f'{arch}.block_count')
+        n_embd = metadata.get(f'{arch}.embedding_length')
+        n_head = metadata.get(f'{arch}.attention.head_count')
+        if not (n_layer and n_embd and n_head) or isinstance(n_head, (list, dict)):
+            return None
+        n_head_kv = metadata.get(f'{arch}.attention.head_count_kv', n_head)
+        if isinstance(n_head_kv, (list, dict)):
+            n_head_kv = n_head
+        head_dim = metadata.get(f'{arch}.attention.key_length', n_embd // n_head)
+        return 2 * n_layer * n_head_kv * head_dim * 2
+
+    @staticmethod
+    def recommend(model_path, hardware=None):
+        """Derive launch parameters from the hardware and the model size."""
+        hardware = hardware or detect_hardware()
+        params = LaunchTuner.config_params()
+        notes = []
+
+        # Generation is memory-bandwidth bound: one thread per physical core
+        # beats using SMT siblings. Prompt processing is compute bound and
+        # can use every CPU the cgroup allows.
+        usable_cpus = hardware['usable_cpus']
+        if hardware['cgroup_cpu_limit']:
+            usable_cpus = max(1, min(usable_cpus, math.ceil(hardware['cgroup_cpu_limit'])))
+            notes.append(f"cgroup limits CPUs to {hardware['cgroup_cpu_limit']:g}")
+        params['threads'] = max(1, min(hardware['physical_cores'], usable_cpus))
+        params['threads_batch'] = usable_cpus
+
+        if hardware['numa_nodes'] > 1:
+            params['numa'] = 'distribute'
+
+        model_mb = os.path.getsize(model_path) // (1024 * 1024)
+        metadata = read_gguf_metadata(model_path)
+        available_mb = hardware['memory_available_mb']
+
+        # Context: the configured size, capped by the training context and by
+        # what the KV cache can use after the weights are resident
+        arch = (metadata or {}).get('general.architecture')
+        train_ctx = (metadata or {}).get(f'{arch}.context_length')
+        if isinstance(train_ctx, int) and train_ctx < params['ctx_size']:
+            params['ctx_size'] = train_ctx
+            notes.append(f"ctx capped at the model's training context {train_ctx}")
+
+        kv_per_token = LaunchTuner.kv_bytes_per_token(metadata)
+        kv_mb = 0
+        if kv_per_token and available_mb:
+            free_mb = available_mb - model_mb - LaunchTuner.RESERVED_MEMORY_MB
+            max_ctx = int(free_mb * 1024 * 1024 // kv_per_token) // 256 * 256
+            if max_ctx < params['ctx_size']:
+                params['ctx_size'] = max(LaunchTuner.MIN_CTX_SIZE, max_ctx)
+                notes.append(f"ctx reduced to {params['ctx_size']} to fit available memory")
+            kv_mb = params['ctx_size'] * kv_per_token // (1024 * 1024)
+
+        # Smaller micro-batches shrink the compute buffer when memory is tight
+        headroom_mb = (available_mb or 0) - model_mb - kv_mb
+        params['batch_size'] = max(params['batch_size'], 64)
+        if available_mb is None or headroom_mb >= 2048:
+            params['ubatch_size'] = min(params['batch_size'], 512)
+        elif headroom_mb >= 1024:
+            params['ubatch_size'] = min(params['batch_size'], 256)
+        else:
+            params['ubatch_size'] = min(params['batch_size'], 128)
+
+        # mmap keeps the weights in the shared page cache; only disable it on
+        # request and only when the whole model fits. mlock pins the weights
+        # when there is clearly room for them and the memlock limit allows it.
+        fits = available_mb is not None and \
+            model_mb + kv_mb + LaunchTuner.RESERVED_MEMORY_MB <= available_mb
+        params['no_mmap'] = fits and not CONFIG['performance'].get('use_mmap', True)
+        memlock_ok = hardware['memlock_limit_mb'] is None or hardware['memlock_limit_mb'] >= model_mb
+        params['mlock'] = bool(CONFIG['performance'].get('use_mlock', False) and fits and
+                               model_mb + kv_mb <= available_mb * 0.8 and memlock_ok)
+        if not fits:
+            notes.append('model and KV cache may not fit in available memory')
+        elif CONFIG['performance'].get('use_mlock', False) and not memlock_ok:
+            notes.append('mlock disabled: RLIMIT_MEMLOCK is lower than the model size')
+
+        params['notes'] = notes
+        return params
+
+    @staticmethod
+    def calibrate(model_path, params):
+        """Try a few thread counts with short generations and keep the fastest.
+
+        Restarts llama-server once per candidate and leaves it stopped.
+        """
+        candidates = sorted({params['threads'], params['threads_batch'],
+                             max(1, params['threads'] - 1), max(1, params['threads'] // 2)})
+        best_params, best_tps = params, None
+        for threads in candidates:
+            candidate = dict(params, threads=threads)
+            LlamaCppManager.stop_server()
+            if not LlamaCppManager.start_server(model_path, launch_params=candidate):
+                continue
+            try:
+                response = post_json(
+                    f"{LLAMACPP_API_URL}/v1/chat/completions",
+                    {
+                        "messages": [{"role": "user", "content": LaunchTuner.CALIBRATION_PROMPT}],
+                        "max_tokens": LaunchTuner.CALIBRATION_MAX_TOKENS,
+                        "temperature": 0,
+                        "cache_prompt": False
+                    },
+                    timeout=ConfigWatcher.current().timeouts
+                )
+                response.raise_for_status()
+                tps = (json_loads(response.content).get('timings') or {}).get('predicted_per_second')
+            except Exception as e:
+                logger.warning(f"Calibration run with {threads} threads failed: {e}")
+                continue
+            logger.info(f"Calibration: {threads} threads -> {tps} tokens/s")
+            if tps and (best_tps is None or tps > best_tps):
+                best_params, best_tps = candidate, tps
+        LlamaCppManager.stop_server()
+        return best_params, best_tps
+
+    @staticmethod
+    def get_params(model_path, calibrate=False, refresh=False):
+        """Cached launch parameters for (model, host), computed on a miss.
+
+        The cache entry is ignored when the model file changes, and an
+        uncalibrated entry is recomputed when calibration is requested.
+        """
+        hardware = detect_hardware()
+        host_id = LaunchTuner.host_id(hardware)
+        model_file = os.path.basename(model_path)
+        stat = os.stat(model_path)
+
+        with sqlite3.connect(DATABASE_PATH) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                'SELECT * FROM launch_tunings WHERE model_file = ? AND host_id = ?',
+                (model_file, host_id)).fetchone()
+        if row and not refresh and row['model_size'] == stat.st_size and \
+                row['model_mtime'] == int(stat.st_mtime) and (row['calibrated'] or not calibrate):
+            return json.loads(row['params'])
+
+        params = LaunchTuner.recommend(model_path, hardware)
+        tokens_per_second = None
+        if calibrate:
+            params, tokens_per_second = LaunchTuner.calibrate(model_path, params)
+
+        with sqlite3.connect(DATABASE_PATH) as conn:
+            conn.execute('''
+                INSERT INTO launch_tunings (model_file, host_id, model_size, model_mtime, params,
+                                            calibrated, generation_tokens_per_second, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(model_file, host_id) DO UPDATE SET
+                    model_size = excluded.model_size,
+                    model_mtime = excluded.model_mtime,
+                    params = excluded.params,
+                    calibrated = excluded.calibrated,
+                    generation_tokens_per_second = excluded.generation_tokens_per_second,
+                    created_at = excluded.created_at
+            ''', (model_file, host_id, stat.st_size, int(stat.st_mtime), json.dumps(params),
+                  int(calibrate and tokens_per_second is not None), tokens_per_second))
+            conn.commit()
+        return params
+
+    @staticmethod
+    def build_args(params):
+        """llama-server command line arguments for a parameter dict."""
+        args = [
+            "--ctx-size", str(params['ctx_size']),
+            "--batch-size", str(params['batch_size']),
+            "--threads", str(params['threads'])
+        ]
+        if params.get('threads_batch'):
+            args.extend(["--threads-batch", str(params['threads_batch'])])
+        if params.get('ubatch_size'):
+            args.extend(["--ubatch-size", str(params['ubatch_size'])])
+        if params.get('gpu_layers', 0) > 0:
+            args.extend(["--n-gpu-layers", str(params['gpu_layers'])])
+        if params.get('mlock'):
+            args.append("--mlock")
+        if params.get('no_mmap'):
+            args.append("--no-mmap")
+        if params.get('numa'):
+            args.extend(["--numa", params['numa']])
+        return args
+
+
+class SpeculativeDecoding:
+    """Pairs target models with small draft models for speculative decoding.
+
+    A draft is compatible when its tokenizer (type, vocabulary and special
+    tokens) is identical to the target's, as llama-server verifies draft
+    tokens by id.
+    """
+
+    # (path, size, mtime) -> tokenizer fingerprint, reading a 150k-entry
+    # vocabulary is too slow to repeat on every model list request
+    _fingerprints = {}
+
+    @staticmethod
+    def settings():
+        return CONFIG.get('speculative', {})
+
+    @staticmethod
+    def tokenizer_fingerprint(model_path):
+        stat = os.stat(model_path)
+        key = (os.path.abspath(model_path), stat.st_size, int(stat.st_mtime))
+        if key not in SpeculativeDecoding._fingerprints:
+            metadata = read_gguf_metadata(model_path, hash_arrays=True) or {}
+            tokens = metadata.get('tokenizer.ggml.tokens')
+            SpeculativeDecoding._fingerprints[key] = {
+                'architecture': metadata.get('general.architecture'),
+                'basename': metadata.get('general.basename'),
+                'tokenizer': (
+                    metadata.get('tokenizer.ggml.model'),
+                    tokens.get('sha1') if isinstance(tokens, dict) else None,
+                    metadata.get('tokenizer.ggml.bos_token_id'),
+                    metadata.get('tokenizer.ggml.eos_token_id')
+                ) if tokens else None
+            }
+        return SpeculativeDecoding._fingerprints[key]
+
+    @staticmethod
+    def find_draft(model_path, models=None):
+        """Pick the smallest compatible draft for a model, or None.
+
+        Candidates must be at most ``max_draft_size_ratio`` of the target's
+        size; drafts of the same model family are preferred.
+        """
+        models = models if models is not None else ModelManager.get_available_models()
+        target_size = os.path.getsize(model_path)
+        max_size = target_size * \
+            SpeculativeDecoding.settings().get('max_draft_size_ratio', 0.25)
+        target = SpeculativeDecoding.tokenizer_fingerprint(model_path)
+        if not target['tokenizer']:
+            return None
+
+        candidates = []
+        for model in models:
+            if model['size_bytes'] > max_size or \
+                    os.path.abspath(model['file_path']) == os.path.abspath(model_path):
+                continue
+            draft = SpeculativeDecoding.tokenizer_fingerprint(
+                model['file_path'])
+            if draft['tokenizer'] != target['tokenizer']:
+                continue
+            same_family = draft['basename'] == target['basename'] and \
+                draft['architecture'] == target['architecture']
+            candidates.append((not same_family, model['size_bytes'], model))
+        return min(candidates, key=lambda c: c[:2])[2] if candidates else None
+
+    @staticmethod
+    def get_setting(conn, model_file):
+        """Per-model setting: enabled flag and optional fixed draft model."""
+        row = conn.execute(
+            'SELECT enabled, draft_model_file FROM speculative_settings WHERE model_file = ?',
+            (model_file,)).fetchone()
+        if row is None:
+            return {'enabled': bool(SpeculativeDecoding.settings().get('enabled_by_default', False)),
+                    'draft_model_file': None}
+        return {'enabled': bool(row[0]), 'draft_model_file': row[1]}
+
+    @staticmethod
+    def set_setting(db, model_file, enabled, draft_model_file=None):
+        db.execute('''
+            INSERT INTO speculative_settings (model_file, enabled, draft_model_file, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(model_file) DO UPDATE SET
+                enabled = excluded.enabled,
+                draft_model_file = excluded.draft_model_file,
+                updated_at = excluded.updated_at
+        ''', (model_file, int(enabled), draft_model_file))
+        db.commit()
+
+    @staticmethod
+    def resolve_draft(model_path):
+        """Draft model to launch with ``model_path``, or None if disabled."""
+        try:
+            with sqlite3.connect(DATABASE_PATH) as conn:
+                setting = SpeculativeDecoding.get_setting(
+                    conn, os.path.basename(model_path))
+            if not setting['enabled']:
+                return None
+
+            models = ModelManager.get_available_models()
+            if setting['draft_model_file']:
+                draft = next((m for m in models if m['name'] == setting['draft_model_file']), None)
+                if draft:
+                    return draft
+                logger.warning(
+                    f"Configured draft model {setting['draft_model_file']} not found, pairing automatically")
+            draft = SpeculativeDecoding.find_draft(model_path, models)
+            if not draft:
+                logger.info(
+                    f"No compatible draft model found for {os.path.basename(model_path)}")
+            return draft
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Speculative decoding disabled, could not resolve draft: {e}")
+            return None
+
+    @staticmethod
+    def build_args(draft_path):
+        settings = SpeculativeDecoding.settings()
+        return [
+            "--model-draft", draft_path,
+            "--draft-max", str(settings.get('draft_max', 16)),
+            "--draft-min", str(settings.get('draft_min', 1)),
+            "--draft-p-min", str(settings.get('draft_p_min', 0.75))
+        ]
+
+    @staticmethod
+    def record(db, model_file, timings):
+        """Accumulate generation and draft acceptance counts per pair.
+
+        Generations without a draft are recorded under an empty draft name
+        and serve as the baseline for the speedup.
+        """
+        if not model_file or not timings.get('predicted_n') or not timings.get('predicted_ms'):
+            return
+        db.execute('''
+            INSERT INTO speculative_stats (model_file, draft_model_file, generations, predicted_tokens,
+                                           predicted_ms, draft_tokens, draft_accepted_tokens)
+            VALUES (?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT(model_file, draft_model_file) DO UPDATE SET
+                generations = generations + 1,
+                predicted_tokens = predicted_tokens + excluded.predicted_tokens,
+                predicted_ms = predicted_ms + excluded.predicted_ms,
+                draft_tokens = draft_tokens + excluded.draft_tokens,
+                draft_accepted_tokens = draft_accepted_tokens + excluded.draft_accepted_tokens,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (model_file, (LlamaCppManager.active_draft() or ''), timings['predicted_n'],
+              timings['predicted_ms'], timings.get('draft_n') or 0,
+              timings.get('draft_n_accepted') or 0))
+
+    @staticmethod
+    def get_stats(db):
+        """Acceptance rate and speedup over the no-draft baseline per pair."""
+        rows = db.execute('SELECT * FROM speculative_stats').fetchall()
+        baseline = {
+            row['model_file']: row['predicted_tokens'] / (row['predicted_ms'] / 1000)
+            for row in rows if row['draft_model_file'] == '' and row['predicted_ms']
+        }
+        stats = {}
+        for row in rows:
+            if row['draft_model_file'] == '' or not row['predicted_ms']:
+                continue
+            tokens_per_second = row['predicted_tokens'] / \
+                (row['predicted_ms'] / 1000)
+            base = baseline.get(row['model_file'])
+            stats.setdefault(row['model_file'], []).append({
+                'draft_model_file': row['draft_model_file'],
+                'generations': row['generations'],
+                'tokens_per_second': round(tokens_per_second, 2),
+                'baseline_tokens_per_second': round(base, 2) if base else None,
+                'speedup': round(tokens_per_second / base, 2) if base else None,
+                'acceptance_rate': round(row['draft_accepted_tokens'] / row['draft_tokens'], 3)
+                if row['draft_tokens'] else None
+            })
+        return stats
+
+    @staticmethod
+    def describe_models(db, models):
+        """Speculative decoding state for each entry of the model list."""
+        stats = SpeculativeDecoding.get_stats(db)
+        result = {}
+        for model in models:
+            setting = SpeculativeDecoding.get_setting(db, model['name'])
+            draft = None
+            if setting['draft_model_file']:
+                draft = setting['draft_model_file']
+            else:
+                try:
+                    paired = SpeculativeDecoding.find_draft(
+                        model['file_path'], models)
+                    draft = paired['name'] if paired else None
+                except OSError as e:
+                    logger.warning(f"Could not pair draft for {model['name']}: {e}")
+            result[model['name']] = {
+                'enabled': setting['enabled'],
+                'draft_model_file': draft,
+                'draft_pinned': setting['draft_model_file'] is not None,
+                'active': model['name'] == os.path.basename(LlamaCppManager.active_model() or '') and
+                LlamaCppManager.active_draft() is not None,
+                'stats': stats.get(model['name'], [])
+            }
+        return result
+
+
+def page_cache_residency(path):
+    """Fraction of a file's pages currently in the page cache, or None.
+
+    Uses mincore(2) through ctypes, so it is only available on Linux.
+    """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                              ctypes.c_int, ctypes.c_int, ctypes.c_long]
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0:
+            return None
+        address = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            return None
+        try:
+            pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+            vector = (ctypes.c_ubyte * pages)()
+            if libc.mincore(ctypes.c_void_p(address), size, vector) != 0:
+                return None
+            return round((pages - bytes(vector).count(0)) / pages, 3)
+        finally:
+            libc.munmap(ctypes.c_void_p(address), size)
+    finally:
+        os.close(fd)
+
+
+def residency_label(residency):
+    """Classify a page cache residency fraction for reporting."""
+    if residency is None:
+        return 'unknown'
+    if residency >= 0.9:
+        return 'warm'
+    if residency < 0.1:
+        return 'cold'
+    return 'partial'
+
+
+class ModelPrefetcher:
+    """Warms GGUF files into the page cache ahead of llama-server loading them.
+
+    Files are read on one background thread (mmap + MADV_WILLNEED, touching
+    every page) at a throttled rate, so prefetching does not starve the
+    running model or the database of disk bandwidth. On-demand requests
+    jump ahead of, and cancel, predictive ones.
+    """
+
+    PRIORITY_ON_DEMAND = 0
+    PRIORITY_PREDICTED = 1
+
+    _lock = threading.Lock()
+    _queue = queue.PriorityQueue()
+    _sequence = itertools.count()
+    _worker = None
+    _jobs = {}
+
+    @staticmethod
+    def settings():
+        return CONFIG.get('prefetch', {})
+
+    @staticmethod
+    def prefetch(model_path, reason='on_demand'):
+        """Queue a model file for warming and return its job.
+
+        An already queued or running job for the file is returned as is.
+        Returns None when prefetching is disabled.
+        """
+        settings = ModelPrefetcher.settings()
+        if not settings.get('enabled', True):
+            return None
+
+        model_file = os.path.basename(model_path)
+        priority = ModelPrefetcher.PRIORITY_PREDICTED if reason == 'predicted' \
+            else ModelPrefetcher.PRIORITY_ON_DEMAND
+
+        with ModelPrefetcher._lock:
+            job = ModelPrefetcher._jobs.get(model_file)
+            if job and job['state'] in ('queued', 'running') and job['priority'] <= priority:
+                return dict(job)
+
+            size = os.path.getsize(model_path)
+            job = {
+                'model_file': model_file,
+                'reason': reason,
+                'priority': priority,
+                'state': 'queued',
+                'total_bytes': size,
+                'bytes_done': 0,
+                'queued_at': datetime.now().isoformat(timespec='seconds')
+            }
+
+            residency = page_cache_residency(model_path)
+            if residency is not None and residency >= 0.99:
+                job.update(state='resident', residency_before=residency)
+                ModelPrefetcher._jobs[model_file] = job
+                return dict(job)
+
+            # Page cache is shared with the loaded model: don't push it out
+            # for a file that would not stay resident anyway
+            available_mb = _read_meminfo().get('MemAvailable')
+            max_fraction = settings.get('max_memory_fraction', 0.5)
+            if available_mb and size / (1024 * 1024) > available_mb * max_fraction:
+                job.update(state='skipped',
+                           error=f'File is larger than {max_fraction:.0%} of available memory')
+                ModelPrefetcher._jobs[model_file] = job
+                return dict(job)
+
+            if priority == ModelPrefetcher.PRIORITY_ON_DEMAND:
+                for other in ModelPrefetcher._jobs.values():
+                    if other['priority'] == ModelPrefetcher.PRIORITY_PREDICTED and \
+                            other['state'] in ('queued', 'running'):
+                        other['cancel'] = True
+
+            ModelPrefetcher._jobs[model_file] = job
+            ModelPrefetcher._queue.put(
+                (priority, next(ModelPrefetcher._sequence), model_path, job))
+            if ModelPrefetcher._worker is None or not ModelPrefetcher._worker.is_alive():
+                ModelPrefetcher._worker = threading.Thread(
+                    target=ModelPrefetcher._run, name='model-prefetch', daemon=True)
+                ModelPrefetcher._worker.start()
+            return dict(job)
+
+    @staticmethod
+    def _run():
+        while True:
+            _, _, model_path, job = ModelPrefetcher._queue.get()
+            if job.get('cancel'):
+                job['state'] = 'cancelled'
+                continue
+            try:
+                ModelPrefetcher.warm(model_path, job)
+            except Exception as e:
+                logger.error(f"Prefetch of {job['model_file']} failed: {e}")
+                job.update(state='failed', error=str(e))
+
+    @staticmethod
+    def warm(model_path, job=None):
+        """Read a file into the page cache, throttled to max_mb_per_second."""
+        job = job if job is not None else {}
+        settings = ModelPrefetcher.settings()
+        chunk_size = max(1, int(settings.get('chunk_mb', 16))) * 1024 * 1024
+        rate = settings.get('max_mb_per_second', 200) * 1024 * 1024
+
+        job.update(state='running', started_at=datetime.now().isoformat(timespec='seconds'),
+                   residency_before=page_cache_residency(model_path))
+        start = time.perf_counter()
+        with open(model_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    can_advise = hasattr(mm, 'madvise')
+                    if can_advise:
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    for offset in range(0, size, chunk_size):
+                        if job.get('cancel'):
+                            job['state'] = 'cancelled'
+                            return job
+                        length = min(chunk_size, size - offset)
+                        if can_advise:
+                            mm.madvise(mmap.MADV_WILLNEED, offset, length)
+                        # Touch one byte per page so the chunk is read before throttling
+                        mm[offset:offset + length:mmap.PAGESIZE]
+                        job['bytes_done'] = offset + length
+                        if rate > 0:
+                            ahead = job['bytes_done'] / rate - (time.perf_counter() - start)
+                            if ahead > 0:
+                                time.sleep(ahead)
+
+        duration = time.perf_counter() - start
+        job.update(state='finished', duration_ms=int(duration * 1000),
+                   mb_per_second=round(size / (1024 * 1024) / duration, 1) if duration else None,
+                   residency_after=page_cache_residency(model_path),
+                   finished_at=datetime.now().isoformat(timespec='seconds'))
+        METRICS.inc('llama_chat_prefetch_bytes_total', value=size)
+        logger.info(f"Prefetched {job.get('model_file', model_path)} in {duration:.1f}s")
+        return job
+
+    @staticmethod
+    def get_jobs():
+        with ModelPrefetcher._lock:
+            return [dict(job) for job in ModelPrefetcher._jobs.values()]
+
+    @staticmethod
+    def predict_next(conn, current_model_file, limit=1):
+        """Models most likely to be loaded after the current one.
+
+        Ranked by past switches away from the current model, then by
+        requests per model over the last two weeks.
+        """
+        available = {m['name']: m for m in ModelManager.get_available_models()}
+        ranked = [row[0] for row in conn.execute('''
+            SELECT model_file FROM model_switches
+            WHERE from_model_file = ? AND success = 1 AND model_file != ?
+            GROUP BY model_file ORDER BY COUNT(*) DESC
+        ''', (current_model_file or '', current_model_file or ''))]
+        ranked += [row[0] for row in conn.execute('''
+            SELECT model_file FROM usage_rollups
+            WHERE granularity = 'day' AND bucket_start >= date('now', '-14 days')
+              AND model_file != '' AND model_file != ?
+            GROUP BY model_file ORDER BY SUM(request_count) DESC
+        ''', (current_model_file or '',))]
+
+        predicted = []
+        for model_file in ranked:
+            if model_file in available and model_file not in predicted:
+                predicted.append(model_file)
+        return [available[name] for name in predicted[:limit]]
+
+    @staticmethod
+    def prefetch_predicted(current_model_file):
+        """Queue predictive prefetches for the likely next models."""
+        settings = ModelPrefetcher.settings()
+        if not settings.get('enabled', True) or not settings.get('predictive', True):
+            return []
+        with sqlite3.connect(DATABASE_PATH) as conn:
+            models = ModelPrefetcher.predict_next(
+                conn, current_model_file, settings.get('predict_count', 1))
+        return [ModelPrefetcher.prefetch(m['file_path'], reason='predicted') for m in models]
+
+    @staticmethod
+    def record_switch(from_model_file, model_file, success, duration_ms, load_ms, residency):
+        with sqlite3.connect(DATABASE_PATH) as conn:
+            conn.execute('''
+                INSERT INTO model_switches (from_model_file, model_file, success, duration_ms,
+                                            load_ms, residency_at_load)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (from_model_file, model_file, int(success), duration_ms, load_ms, residency))
+            conn.commit()
+
+    @staticmethod
+    def get_switch_report(db):
+        """Average switch and load times per model by page cache state at load."""
+        rows = db.execute('''
+            SELECT model_file,
+                   CASE WHEN residency_at_load IS NULL THEN 'unknown'
+                        WHEN residency_at_load >= 0.9 THEN 'warm'
+                        WHEN residency_at_load < 0.1 THEN 'cold'
+                        ELSE 'partial' END AS cache,
+                   COUNT(*) AS switches,
+                   AVG(load_ms) AS avg_load_ms,
+                   AVG(duration_ms) AS avg_switch_ms
+            FROM model_switches
+            WHERE success = 1
+            GROUP BY model_file, cache
+            ORDER BY model_file, cache
+        ''').fetchall()
+        report = {}
+        for row in rows:
+            report.setdefault(row['model_file'], {})[row['cache']] = {
+                'switches': row['switches'],
+                'avg_load_ms': int(row['avg_load_ms'] or 0),
+                'avg_switch_ms': int(row['avg_switch_ms'] or 0)
+            }
+        for states in report.values():
+            if 'warm' in states and 'cold' in states and states['warm']['avg_load_ms']:
+                states['cold_to_warm_ratio'] = round(
+                    states['cold']['avg_load_ms'] / states['warm']['avg_load_ms'], 2)
+        return report
+
+
+class HealthMonitor:
+    """Background llama-server health checks, crash recovery and status push.
+
+    The monitor thread probes llama-server every ``interval_seconds`` with a
+    short timeout and keeps the result, so status endpoints never wait on
+    the network. When the server is down for ``failure_threshold`` probes
+    in a row it is restarted with the last known model, with exponential
+    backoff between attempts. Subscribers (the SSE endpoint) are woken on
+    every state change.
+    """
+
+    _thread = None
+    _start_lock = threading.Lock()
+    _changed = threading.Condition()
+    _wake = threading.Event()
+    _version = 0
+    _status = {
+        'state': 'unknown',
+        'server_running': False,
+        'current_model': None,
+        'checked_at': None,
+        'latency_ms': None,
+        'consecutive_failures': 0,
+        'restarts': 0,
+        'next_restart_at': None,
+        'last_error': None
+    }
+    # Fields whose change is pushed to subscribers
+    PUSHED_FIELDS = ('state', 'server_running', 'current_model', 'restarts', 'last_error')
+
+    _event_streams = 0
+    _event_streams_lock = threading.Lock()
+
+    _last_model_path = None
+    _refresh_model = True
+    _backoff = None
+    _healthy_since = None
+
+    @staticmethod
+    def settings():
+        return CONFIG.get('health', {})
+
+    @staticmethod
+    def start():
+        """Start the monitor thread once per process."""
+        with HealthMonitor._start_lock:
+            if HealthMonitor._thread and HealthMonitor._thread.is_alive():
+                return
+            HealthMonitor._thread = threading.Thread(
+                target=HealthMonitor._run, name='health-monitor', daemon=True)
+            HealthMonitor._thread.start()
+            logger.info("Health monitor started")
+
+    @staticmethod
+    def is_running():
+        return HealthMonitor._thread is not None and HealthMonitor._thread.is_alive()
+
+    @staticmethod
+    def get_status():
+        with HealthMonitor._changed:
+            return dict(HealthMonitor._status)
+
+    @staticmethod
+    def wake():
+        """Probe immediately instead of waiting for the next interval."""
+        HealthMonitor._refresh_model = True
+        HealthMonitor._wake.set()
+
+    @staticmethod
+    def update(**changes):
+        with HealthMonitor._changed:
+            pushed = any(HealthMonitor._status.get(key) != value
+                         for key, value in changes.items() if key in HealthMonitor.PUSHED_FIELDS)
+            HealthMonitor._status.update(changes)
+            if pushed:
+                HealthMonitor._version += 1
+                HealthMonitor._changed.notify_all()
+
+    @staticmethod
+    def wait_for_change(version, timeout):
+        """Block until the status differs from ``version`` or timeout.
+
+        Returns (status, version), with status None on timeout.
+        """
+        with HealthMonitor._changed:
+            changed = HealthMonitor._changed.wait_for(
+                lambda: HealthMonitor._version != version, timeout)
+            if not changed:
+                return None, version
+            return dict(HealthMonitor._status), HealthMonitor._version
+
+    @staticmethod
+    def open_event_stream():
+        """Count a new SSE subscriber; False once ``max_event_streams`` are open.
+
+        Every stream holds a request thread of this process for as long as
+        the browser tab is open, so the cap keeps threads free for requests.
+        """
+        limit = HealthMonitor.settings().get('max_event_streams', 4)
+        with HealthMonitor._event_streams_lock:
+            if limit and HealthMonitor._event_streams >= limit:
+                return False
+            HealthMonitor._event_streams += 1
+            return True
+
+    @staticmethod
+    def close_event_stream():
+        with HealthMonitor._event_streams_lock:
+            HealthMonitor._event_streams -= 1
+
+    @staticmethod
+    def _run():
+        while True:
+            try:
+                HealthMonitor.check()
+            except Exception as e:
+                logger.error(f"Health check failed: {e}", exc_info=True)
+            HealthMonitor._wake.wait(HealthMonitor.settings().get('interval_seconds', 5))
+            HealthMonitor._wake.clear()
+
+    @staticmethod
+    def probe():
+        """Return (state, latency_ms, error) from one /health request."""
+        timeout = HealthMonitor.settings().get('probe_timeout_seconds', 1)
+        start = time.perf_counter()
+        try:
+            response = requests.get(f"{LLAMACPP_API_URL}/health", timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            return 'down', None, e.__class__.__name__
+        latency_ms = int((time.perf_counter() - start) * 1000)
+        if response.status_code == 200:
+            return 'healthy', latency_ms, None
+        if response.status_code == 503:
+            # llama-server answers 503 while it is still loading the model
+            return 'loading', latency_ms, None
+        return 'unhealthy', latency_ms, f'HTTP {response.status_code}'
+
+    @staticmethod
+    def check():
+        """Run one probe, update the cached status and restart if needed."""
+        busy = LlamaCppManager.busy()
+        state, latency_ms, error = HealthMonitor.probe()
+        status = HealthMonitor.get_status()
+        now = time.time()
+
+        if busy and state != 'healthy':
+            # Switches and benchmarks stop the server on purpose
+            HealthMonitor.update(state=busy, server_running=False, latency_ms=latency_ms,
+                                 checked_at=datetime.now().isoformat(timespec='seconds'))
+            return
+
+        current_model = status['current_model']
+        if state == 'healthy':
+            if status['state'] != 'healthy' or HealthMonitor._refresh_model or not current_model:
+                current_model = HealthMonitor._fetch_model() or current_model
+                HealthMonitor._refresh_model = False
+            if HealthMonitor._healthy_since is None:
+                HealthMonitor._healthy_since = now
+            elif now - HealthMonitor._healthy_since > HealthMonitor.settings().get('stable_seconds', 120):
+                HealthMonitor._backoff = None
+            failures = 0
+        else:
+            HealthMonitor._healthy_since = None
+            failures = status['consecutive_failures'] + (state in ('down', 'unhealthy'))
+
+        METRICS.set('llama_chat_llamacpp_up', state == 'healthy')
+        HealthMonitor.update(
+            state=state, server_running=state == 'healthy',
+            current_model=current_model if state in ('healthy', 'loading') else None,
+            latency_ms=latency_ms, last_error=error, consecutive_failures=failures,
+            checked_at=datetime.now().isoformat(timespec='seconds'))
+
+        if failures >= HealthMonitor.settings().get('failure_threshold', 3):
+            HealthMonitor._maybe_restart()
+
+    @staticmethod
+    def _fetch_model():
+        try:
+            response = requests.get(
+                f"{LLAMACPP_API_URL}/v1/models",
+                timeout=HealthMonitor.settings().get('probe_timeout_seconds', 1))
+            data = json_loads(response.content).get('data') or []
+            if response.status_code == 200 and data:
+                model_id = data[0]['id']
+                model_path = model_id if os.path.isfile(model_id) else \
+                    os.path.join(MODELS_DIR, os.path.basename(model_id))
+                if os.path.isfile(model_path):
+                    HealthMonitor._last_model_path = model_path
+                return os.path.basename(model_id)
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logger.debug(f"Could not read current model: {e}")
+        return None
+
+    @staticmethod
+    def _maybe_restart():
+        settings = HealthMonitor.settings()
+        if not settings.get('auto_restart', True):
+            return
+        model_path = LlamaCppManager.active_model() or HealthMonitor._last_model_path
+        if not model_path or not os.path.exists(model_path):
+            return
+
+        now = time.time()
+        status = HealthMonitor.get_status()
+        if status['next_restart_at'] and now < status['next_restart_at']:
+            return
+        if not LlamaCppManager.lifecycle_lock.acquire(blocking=False):
+            return
+
+        try:
+            # Another worker may have restarted it meanwhile
+            if HealthMonitor.probe()[0] in ('healthy', 'loading'):
+                return
+            backoff = HealthMonitor._backoff or settings.get('restart_backoff_seconds', 5)
+            logger.warning(
+                f"llama-server is down, restarting with {os.path.basename(model_path)} "
+                f"(next attempt in {backoff}s if this fails)")
+            with LlamaCppManager.lifecycle('restarting'):
+                LlamaCppManager.stop_server()
+                success = LlamaCppManager.start_server(model_path)
+        finally:
+            LlamaCppManager.lifecycle_lock.release()
+
+        METRICS.inc('llama_chat_llamacpp_restarts_total',
+                    {'result': 'success' if success else 'failure'})
+        HealthMonitor._backoff = min(backoff * 2, settings.get('max_restart_backoff_seconds', 300))
+        HealthMonitor.update(restarts=status['restarts'] + 1, next_restart_at=time.time() + backoff,
+                             consecutive_failures=0)
+        HealthMonitor.wake()
+
+
+def read_process_stats(pid):
+    """Read resource usage of a process from /proc (Linux only).
+
+    Returns None when the process does not exist. CPU times are in seconds,
+    memory in bytes; I/O counters are None when /proc/<pid>/io is not
+    readable.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+        with open(f'/proc/{pid}/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+
+    # The command name may contain spaces; fields after it are positional
+    fields = stat[stat.rindex(')') + 2:].split()
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+
+    def status_bytes(key):
+        value = status.get(key)
+        return int(value.split()[0]) * 1024 if value else None
+
+    stats = {
+        'pid': pid,
+        'state': fields[0],
+        'user_cpu_seconds': int(fields[11]) / clock_ticks,
+        'system_cpu_seconds': int(fields[12]) / clock_ticks,
+        'major_faults': int(fields[9]),
+        'threads': int(fields[17]),
+        'rss_bytes': status_bytes('VmRSS'),
+        'rss_anon_bytes': status_bytes('RssAnon'),
+        'rss_file_bytes': status_bytes('RssFile'),
+        'peak_rss_bytes': status_bytes('VmHWM'),
+        'read_bytes': None,
+        'write_bytes': None
+    }
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            io = dict(line.split(':', 1) for line in f if ':' in line)
+        stats['read_bytes'] = int(io['read_bytes'])
+        stats['write_bytes'] = int(io['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        pass
+    return stats
+
+
+class ResourceSampler:
+    """Samples llama-server's resource usage into a fixed-size ring buffer.
+
+    Every ``sample_interval_seconds`` the process recorded in the PID file
+    is read from /proc; CPU use is derived from the difference to the
+    previous sample. The newest sample also feeds the memory-fit check made
+    before model switches.
+    """
+
+    _thread = None
+    _start_lock = threading.Lock()
+    _samples = deque(maxlen=CONFIG.get('resources', {}).get('history_size', 720))
+    _previous = None
+
+    @staticmethod
+    def settings():
+        return CONFIG.get('resources', {})
+
+    @staticmethod
+    def start():
+        """Start the sampler thread once per process."""
+        with ResourceSampler._start_lock:
+            if ResourceSampler._thread and ResourceSampler._thread.is_alive():
+                return
+            ResourceSampler._thread = threading.Thread(
+                target=ResourceSampler._run, name='resource-sampler', daemon=True)
+            ResourceSampler._thread.start()
+            logger.info("Resource sampler started")
+
+    @staticmethod
+    def _run():
+        while True:
+            try:
+                ResourceSampler.sample()
+            except Exception as e:
+                logger.error(f"Resource sampling failed: {e}", exc_info=True)
+            time.sleep(ResourceSampler.settings().get('sample_interval_seconds', 5))
+
+    @staticmethod
+    def sample():
+        """Take one sample of the llama-server process, if it is running."""
+        pid = read_llamacpp_pid()
+        stats = read_process_stats(pid) if pid else None
+        if stats is None or stats['state'] == 'Z':
+            ResourceSampler._previous = None
+            for name in ('llama_chat_llamacpp_rss_bytes', 'llama_chat_llamacpp_cpu_percent',
+                         'llama_chat_llamacpp_threads'):
+                METRICS.set(name, 0)
+            return None
+
+        now = time.time()
+        cpu_seconds = stats['user_cpu_seconds'] + stats['system_cpu_seconds']
+        model_path = LlamaCppManager.active_model()
+        sample = dict(stats, timestamp=datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+                      model_file=os.path.basename(model_path) if model_path else None,
+                      cpu_percent=None)
+
+        previous = ResourceSampler._previous
+        if previous and previous['pid'] == pid:
+            elapsed = now - previous['time']
+            if elapsed > 0:
+                sample['cpu_percent'] = round((cpu_seconds - previous['cpu_seconds']) / elapsed * 100, 1)
+            # Counters grow by the difference; a new PID starts a new baseline
+            METRICS.inc('llama_chat_llamacpp_cpu_seconds_total',
+                        value=max(0.0, cpu_seconds - previous['cpu_seconds']))
+            METRICS.inc('llama_chat_llamacpp_major_faults_total',
+                        value=max(0, stats['major_faults'] - previous['major_faults']))
+            for direction in ('read', 'write'):
+                current, before = stats[f'{direction}_bytes'], previous[f'{direction}_bytes']
+                if current is not None and before is not None:
+                    METRICS.inc('llama_chat_llamacpp_io_bytes_total', {'direction': direction},
+                                max(0, current - before))
+        ResourceSampler._previous = {
+            'pid': pid, 'time': now, 'cpu_seconds': cpu_seconds,
+            'major_faults': stats['major_faults'],
+            'read_bytes': stats['read_bytes'], 'write_bytes': stats['write_bytes']
+        }
+
+        METRICS.set('llama_chat_llamacpp_rss_bytes', stats['rss_bytes'] or 0)
+        METRICS.set('llama_chat_llamacpp_threads', stats['threads'])
+        if sample['cpu_percent'] is not None:
+            METRICS.set('llama_chat_llamacpp_cpu_percent', sample['cpu_percent'])
+        ResourceSampler._samples.append(sample)
+        return sample
+
+    @staticmethod
+    def get_samples(limit=None):
+        samples = list(ResourceSampler._samples)
+        return samples[-limit:] if limit else samples
+
+    @staticmethod
+    def latest():
+        """Newest sample if it belongs to the running llama-server."""
+        samples = ResourceSampler._samples
+        if not samples:
+            return None
+        sample = samples[-1]
+        return sample if sample['pid'] == read_llamacpp_pid() else None
+
+    @staticmethod
+    def check_fit(model_path):
+        """Estimate whether a model fits in memory once the current one is unloaded.
+
+        The requirement is the model file plus the KV cache for the context
+        it would be started with plus LaunchTuner's reserve. Memory held by
+        the running llama-server counts as available: its anonymous memory
+        is freed on stop and its file-backed pages are reclaimable cache.
+        """
+        hardware = detect_hardware()
+        available_mb = hardware['memory_available_mb']
+        model_mb = os.path.getsize(model_path) // (1024 * 1024)
+
+        current = ResourceSampler.latest()
+        if current is None and read_llamacpp_pid():
+            current = ResourceSampler.sample()
+        released_mb = (current['rss_anon_bytes'] or 0) // (1024 * 1024) if current else 0
+
+        # Auto-tuning shrinks the context to what fits, down to its minimum
+        if CONFIG['performance'].get('auto_tune', False):
+            ctx_size = LaunchTuner.MIN_CTX_SIZE
+        else:
+            ctx_size = LaunchTuner.config_params()['ctx_size']
+        kv_per_token = LaunchTuner.kv_bytes_per_token(read_gguf_metadata(model_path))
+        kv_mb = ctx_size * kv_per_token // (1024 * 1024) if kv_per_token else 0
+
+        required_mb = model_mb + kv_mb + LaunchTuner.RESERVED_MEMORY_MB
+        usable_mb = available_mb + released_mb if available_mb is not None else None
+        return {
+            'model_file': os.path.basename(model_path),
+            'fits': usable_mb is None or required_mb <= usable_mb,
+            'required_mb': required_mb,
+            'model_mb': model_mb,
+            'kv_cache_mb': kv_mb,
+            'ctx_size': ctx_size,
+            'available_mb': available_mb,
+            'released_mb': released_mb,
+            'usable_mb': usable_mb
+        }
+
+
+class StaticAssets:
+    """Content-hashed, precompressed copies of the static files.
+
+    ``build-assets`` copies every file under static/ to static/dist/ with a
+    hash of its content in the name (``js/app.3f2a9c0d1e.js``), next to
+    gzip and, when the optional ``brotli`` package is installed, brotli
+    compressed versions, and records them in ``manifest.json``. Templates
+    link assets through ``asset_url()``, which points at the hashed copy
+    served from /assets/ with an immutable cache lifetime. A source file
+    changed after the build is linked unhashed from /static/ until the next
+    build.
+    """
+
+    DIST_DIR = os.path.join(app.static_folder, 'dist')
+    MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+    COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt', '.map')
+
+    # Hashed names change with the content, so they can be cached forever
+    IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+    _manifest = None
+    _manifest_mtime = None
+    _stale = set()
+
+    @staticmethod
+    def build():
+        """Write hashed and compressed copies of static files; returns the manifest."""
+        files = {}
+        for directory, subdirectories, filenames in os.walk(app.static_folder):
+            if os.path.abspath(directory) == StaticAssets.DIST_DIR:
+                subdirectories[:] = []
+                continue
+            for filename in sorted(filenames):
+                source = os.path.join(directory, filename)
+                name = os.path.relpath(source, app.static_folder).replace(os.sep, '/')
+                with open(source, 'rb') as f:
+                    data = f.read()
+                stem, ext = os.path.splitext(name)
+                hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+                outputs = {'identity': data}
+                if ext in StaticAssets.COMPRESSIBLE:
+                    outputs['gzip'] = gzip.compress(data, 9, mtime=0)
+                    if brotli is not None:
+                        outputs['br'] = brotli.compress(data, quality=11)
+
+                os.makedirs(os.path.dirname(os.path.join(StaticAssets.DIST_DIR, hashed)), exist_ok=True)
+                encodings = []
+                for encoding, output in outputs.items():
+                    if encoding != 'identity' and len(output) >= len(data):
+                        continue
+                    suffix = {'identity': '', 'gzip': '.gz', 'br': '.br'}[encoding]
+                    with open(os.path.join(StaticAssets.DIST_DIR, hashed + suffix), 'wb') as f:
+                        f.write(output)
+                    if encoding != 'identity':
+                        encodings.append(encoding)
+
+                stat = os.stat(source)
+                files[name] = {'path': hashed, 'size': stat.st_size,
+                               'mtime_ns': stat.st_mtime_ns, 'encodings': encodings}
+
+        # Remove copies of earlier builds
+        keep = {os.path.normpath(entry['path'] + suffix) for entry in files.values()
+                for suffix in ('', '.gz', '.br')}
+        for directory, _, filenames in os.walk(StaticAssets.DIST_DIR):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(directory, filename), StaticAssets.DIST_DIR)
+                if path not in keep and filename != 'manifest.json':
+                    os.remove(os.path.join(directory, filename))
+
+        manifest = {'built_at': datetime.now().isoformat(timespec='seconds'), 'files': files}
+        with open(StaticAssets.MANIFEST_PATH + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(StaticAssets.MANIFEST_PATH + '.tmp', StaticAssets.MANIFEST_PATH)
+        return manifest
+
+    @staticmethod
+    def manifest():
+        """Built files by source name, re-read when build-assets runs again."""
+        try:
+            mtime = os.stat(StaticAssets.MANIFEST_PATH).st_mtime_ns
+        except OSError:
+            return {}
+        if mtime != StaticAssets._manifest_mtime:
+            try:
+                with open(StaticAssets.MANIFEST_PATH) as f:
+                    StaticAssets._manifest = json.load(f)['files']
+            except (OSError, ValueError, KeyError):
+                StaticAssets._manifest = {}
+            StaticAssets._manifest_mtime = mtime
+            StaticAssets._stale.clear()
+        return StaticAssets._manifest
+
+    @staticmethod
+    def url(filename):
+        """URL of a static file: its hashed copy if the source is unchanged since the build."""
+        entry = StaticAssets.manifest().get(filename)
+        if entry is not None:
+            try:
+                stat = os.stat(os.path.join(app.static_folder, filename))
+                if (stat.st_size, stat.st_mtime_ns) == (entry['size'], entry['mtime_ns']):
+                    return url_for('serve_asset', filename=entry['path'])
+            except OSError:
+                pass
+            if filename not in StaticAssets._stale:
+                StaticAssets._stale.add(filename)
+                logger.warning(f"Static file {filename} changed since build-assets, serving it unhashed")
+        return url_for('static', filename=filename)
+
+
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': StaticAssets.url}
+
+
+# Routes
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.trace_spans = []
+    g.profiler = None
+    if request.path.startswith('/api/') and _should_profile():
+        g.profiler = StackSampler(threading.get_ident()).start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    METRICS.inc('llama_chat_http_requests_total', {
+        'route': route,
+        'method': request.method,
+        'status': response.status_code
+    })
+    METRICS.observe('llama_chat_http_request_duration_seconds',
+                    elapsed, {'route': route, 'method': request.method})
+
+    spans = g.get('trace_spans') or []
+    total_ms = round(elapsed * 1000, 2)
+    response.headers['Server-Timing'] = ', '.join(
+        [f"{name};dur={duration}" for name, duration in spans]
+        + [f"total;dur={total_ms}"])
+
+    profiler = g.pop('profiler', None)
+    if request.path.startswith('/api/') and not request.path.startswith('/api/debug/'):
+        trace_id = next(_trace_ids)
+        response.headers['X-Trace-Id'] = str(trace_id)
+        TRACE_BUFFER.append({
+            'id': trace_id,
+            'method': request.method,
+            'route': route,
+            'path': request.path,
+            'status': response.status_code,
+            'started_at': datetime.now().isoformat(timespec='milliseconds'),
+            'total_ms': total_ms,
+            'spans': [{'name': name, 'duration_ms': duration}
+                      for name, duration in spans],
+            'profile': profiler.stop() if profiler else None
+        })
+    elif profiler:
+        profiler.stop()
+    return response
+
+
+@app.teardown_request
+def stop_request_profiler(error):
+    # after_request is skipped when a response could not be produced
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.stop()
+
+
+def api_etag(*parts):
+    """Weak ETag for an API read, from what its response depends on."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+def not_modified(etag):
+    """A 304 response when the client already has ``etag``, else None.
+
+    Lets API reads answer revalidations before loading their data.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+
+def gzip_stream(chunks, level):
+    """gzip a streamed body chunk by chunk."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.after_request
+def optimize_response(response):
+    """Validators and compression for API responses (see the "http" config section).
+
+    JSON reads get an ETag (hashed from the body unless the endpoint set
+    one) so unchanged data is answered with 304, and bodies of at least
+    ``compression_min_bytes`` are gzipped. Streamed JSON (large lists) is
+    gzipped as it is sent; other streamed responses (server events, NDJSON
+    exports) and files are passed through untouched.
+    """
+    if response.direct_passthrough or response.status_code != 200:
+        return response
+    settings = CONFIG.get('http', {})
+
+    if response.is_streamed:
+        if (settings.get('compression', True) and response.mimetype == 'application/json'
+                and 'gzip' in request.accept_encodings):
+            response.response = gzip_stream(response.response, settings.get('compression_level', 6))
+            response.headers['Content-Encoding'] = 'gzip'
+            response.vary.add('Accept-Encoding')
+        return response
+
+    if request.method == 'GET' and request.path.startswith('/api/') and response.is_json:
+        if not response.get_etag()[0]:
+            response.add_etag(weak=True)
+        response.headers.setdefault('Cache-Control', 'no-cache')
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    if (settings.get('compression', True) and 'Content-Encoding' not in response.headers
+            and (response.mimetype.startswith('text/') or response.mimetype == 'application/json')
+            and 'gzip' in request.accept_encodings):
+        data = response.get_data()
+        if len(data) >= settings.get('compression_min_bytes', 1024):
+            response.set_data(gzip.compress(data, settings.get('compression_level', 6)))
+            response.headers['Content-Encoding'] = 'gzip'
+            response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Expose runtime metrics in Prometheus text format."""
+    # The health monitor keeps llamacpp_up current; probe only without it
+    if not HealthMonitor.is_running():
+        try:
+            response = requests.get(f"{LLAMACPP_API_URL}/health", timeout=1)
+            llamacpp_up = response.status_code == 200
+        except requests.exceptions.RequestException:
+            llamacpp_up = False
+        METRICS.set('llama_chat_llamacpp_up', llamacpp_up)
+
+    return Response(METRICS.render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/')
+def index():
+    """Main chat interface."""
+    return render_template('index.html')
+
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Serve a built static asset, precompressed when the client accepts it."""
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in request.accept_encodings and \
+                os.path.isfile(os.path.join(StaticAssets.DIST_DIR, filename + suffix)):
+            response = send_from_directory(StaticAssets.DIST_DIR, filename + suffix,
+                                           mimetype=mimetype, max_age=StaticAssets.IMMUTABLE_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(StaticAssets.DIST_DIR, filename, mimetype=mimetype,
+                                       max_age=StaticAssets.IMMUTABLE_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/api/models/available')
+def api_available_models():
+    """Get all available models in the models directory."""
+    try:
+        models = ModelManager.get_available_models()
+        current_model = ModelManager.get_current_model()
+
+        db = get_db()
+        benchmarks = ModelBenchmark.get_latest_results(db)
+        speculative = SpeculativeDecoding.describe_models(db, models)
+        for model in models:
+            model['benchmark'] = benchmarks.get(model['name'])
+            model['speculative'] = speculative.get(model['name'])
+
+        return jsonify({
+            'models': models,
+            'current_model': current_model,
+            'count': len(models),
+            'models_dir': MODELS_DIR
+        })
+    except Exception as e:
+        logger.error(f"Error in /api/models/available endpoint: {e}")
+        return jsonify({
+            'models': [],
+            'current_model': None,
+            'count': 0,
+            'error': str(e),
+            'models_dir': MODELS_DIR
+        }), 500
+
+
+@app.route('/api/models')
+def api_models():
+    """Get currently loaded model."""
+    try:
+        models = LlamaCppAPI.get_models()
+        current_model = ModelManager.get_current_model()
+
+        return jsonify({
+            'models': models,
+            'current_model': current_model,
+            'count': len(models),
+            'llamacpp_url': LLAMACPP_API_URL
+        })
+    except Exception as e:
+        logger.error(f"Error in /api/models endpoint: {e}")
+        return jsonify({
+            'models': [],
+            'current_model': None,
+            'count': 0,
+            'error': str(e),
+            'llamacpp_url': LLAMACPP_API_URL
+        }), 500
+
+
+@app.route('/api/models/switch', methods=['POST'])
+def api_switch_model():
+    """Switch to a different model."""
+    try:
+        data = request.get_json()
+        model_name = data.get('model_name')
+
+        if not model_name:
+            return jsonify({'error': 'Model name is required'}), 400
+
+        # Find the model file
+        model_path = os.path.join(MODELS_DIR, model_name)
+        if not os.path.exists(model_path):
+            return jsonify({'error': f'Model file not found: {model_name}'}), 404
+
+        grant = RateLimiter.admit('switch')
+        if not grant['allowed']:
+            return RateLimiter.rejection(grant)
+
+        # Refuse models that would not fit in memory unless forced
+        force = bool(data.get('force', False))
+        if not force and CONFIG.get('resources', {}).get('check_memory_fit', True):
+            fit = ResourceSampler.check_fit(model_path)
+            if not fit['fits']:
+                return jsonify({
+                    'error': f"Not enough memory for {model_name}: needs about "
+                             f"{fit['required_mb']} MB, {fit['usable_mb']} MB available",
+                    'fit': fit,
+                    'success': False
+                }), 409
+
+        # Switch model
+        logger.info(f"Switching to model: {model_name}")
+        success = LlamaCppManager.switch_model(model_path, check_memory=False)
+
+        if success:
+            # Verify the switch was successful
+            time.sleep(2)  # Give server time to fully initialize
+            current_model = ModelManager.get_current_model()
+
+            return jsonify({
+                'success': True,
+                'message': f'Successfully switched to {model_name}',
+                'current_model': current_model,
+                'model_file': model_name
+            })
+        else:
+            return jsonify({
+                'error': f'Failed to switch to model: {model_name}',
+                'success': False
+            }), 500
+
+    except Exception as e:
+        logger.error(f"Error switching model: {e}")
+        return jsonify({
+            'error': f'Error switching model: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/models/benchmark', methods=['POST'])
+def api_start_model_benchmark():
+    """Start a background benchmark of the available models."""
+    data = request.get_json(silent=True) or {}
+    model_names = data.get('models')
+    if model_names is not None and not isinstance(model_names, list):
+        return jsonify({
+            'error': 'models must be a list of model file names',
+            'success': False
+        }), 400
+
+    if not ModelBenchmark.start_job(model_names):
+        return jsonify({
+            'error': 'A model benchmark is already running',
+            'job': ModelBenchmark.get_job(),
+            'success': False
+        }), 409
+
+    return jsonify({
+        'success': True,
+        'message': 'Model benchmark started. llama-server will be restarted for each model.',
+        'job': ModelBenchmark.get_job()
+    }), 202
+
+
+@app.route('/api/models/benchmark')
+def api_model_benchmark():
+    """Get the benchmark job status and the latest result per model."""
+    try:
+        return jsonify({
+            'job': ModelBenchmark.get_job(),
+            'results': list(ModelBenchmark.get_latest_results(get_db()).values()),
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error getting model benchmarks: {e}")
+        return jsonify({
+            'error': f'Failed to get model benchmarks: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/models/prefetch', methods=['POST'])
+def api_prefetch_model():
+    """Warm a model file (or the likely next models) into the page cache."""
+    try:
+        data = request.get_json(silent=True) or {}
+        model_name = data.get('model_name')
+
+        if model_name:
+            model_path = os.path.join(MODELS_DIR, model_name)
+            if not os.path.exists(model_path):
+                return jsonify({
+                    'error': f'Model file not found: {model_name}',
+                    'success': False
+                }), 404
+            jobs = [ModelPrefetcher.prefetch(model_path)]
+        elif data.get('predict'):
+            current_model = LlamaCppManager.active_model() or ModelManager.get_current_model()
+            jobs = ModelPrefetcher.prefetch_predicted(
+                os.path.basename(current_model) if current_model else None)
+        else:
+            return jsonify({
+                'error': 'model_name or predict is required',
+                'success': False
+            }), 400
+
+        return jsonify({
+            'success': True,
+            'jobs': [job for job in jobs if job]
+        }), 202
+    except Exception as e:
+        logger.error(f"Error starting model prefetch: {e}")
+        return jsonify({
+            'error': f'Failed to start model prefetch: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/models/prefetch')
+def api_model_prefetch_status():
+    """Get prefetch jobs, page cache residency and switch times warm vs cold."""
+    try:
+        return jsonify({
+            'jobs': ModelPrefetcher.get_jobs(),
+            'residency': {
+                m['name']: page_cache_residency(m['file_path'])
+                for m in ModelManager.get_available_models()
+            },
+            'switch_report': ModelPrefetcher.get_switch_report(get_db()),
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error getting model prefetch status: {e}")
+        return jsonify({
+            'error': f'Failed to get model prefetch status: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/models/speculative')
+def api_speculative_models():
+    """Get speculative decoding settings, draft pairing and stats per model."""
+    try:
+        models = ModelManager.get_available_models()
+        speculative = SpeculativeDecoding.describe_models(get_db(), models)
+        return jsonify({
+            'models': [dict(speculative[m['name']], model_file=m['name']) for m in models],
+            'active_draft': LlamaCppManager.active_draft(),
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error getting speculative decoding state: {e}")
+        return jsonify({
+            'error': f'Failed to get speculative decoding state: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/models/speculative/<model_file>', methods=['PUT'])
+def api_update_speculative_model(model_file):
+    """Turn speculative decoding on or off for a model.
+
+    The change is applied immediately (by restarting llama-server) when the
+    model is currently loaded.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data.get('enabled'), bool):
+            return jsonify({
+                'error': 'enabled must be true or false',
+                'success': False
+            }), 400
+
+        models = {m['name']: m for m in ModelManager.get_available_models()}
+        if model_file not in models:
+            return jsonify({
+                'error': f'Model file not found: {model_file}',
+                'success': False
+            }), 404
+
+        draft_model_file = data.get('draft_model_file')
+        if draft_model_file is not None and draft_model_file not in models:
+            return jsonify({
+                'error': f'Draft model file not found: {draft_model_file}',
+                'success': False
+            }), 404
+
+        db = get_db()
+        SpeculativeDecoding.set_setting(
+            db, model_file, data['enabled'], draft_model_file)
+
+        restarted = False
+        if data.get('apply', True) and ModelManager.get_current_model() == model_file:
+            restarted = LlamaCppManager.switch_model(
+                models[model_file]['file_path'])
+            if not restarted:
+                return jsonify({
+                    'error': 'Setting saved but llama-server failed to restart',
+                    'success': False
+                }), 500
+
+        return jsonify({
+            'success': True,
+            'model_file': model_file,
+            'restarted': restarted,
+            'speculative': SpeculativeDecoding.describe_models(
+                db, list(models.values()))[model_file]
+        })
+    except Exception as e:
+        logger.error(f"Error updating speculative decoding: {e}")
+        return jsonify({
+            'error': f'Failed to update speculative decoding: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/models/tuning')
+def api_model_tuning():
+    """Get detected hardware and the launch parameters chosen per model."""
+    try:
+        hardware = detect_hardware()
+        host_id = LaunchTuner.host_id(hardware)
+        cached = {
+            row['model_file']: dict(row, params=json.loads(row['params']))
+            for row in get_db().execute(
+                'SELECT * FROM launch_tunings WHERE host_id = ?', (host_id,)).fetchall()
+        }
+
+        models = ModelManager.get_available_models()
+        model_name = request.args.get('model')
+        if model_name:
+            models = [m for m in models if m['name'] == model_name]
+            if not models:
+                return jsonify({
+                    'error': f'Model not found: {model_name}',
+                    'success': False
+                }), 404
+
+        return jsonify({
+            'auto_tune': CONFIG['performance'].get('auto_tune', False),
+            'hardware': hardware,
+            'host_id': host_id,
+            'models': [{
+                'model_file': m['name'],
+                'recommended': LaunchTuner.recommend(m['file_path'], hardware),
+                'cached': cached.get(m['name'])
+            } for m in models],
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error getting launch tuning: {e}")
+        return jsonify({
+            'error': f'Failed to get launch tuning: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/config')
+def api_config():
+    """Get the active configuration, its version and settings waiting for a restart."""
+    try:
+        config = ConfigWatcher.current()
+        sections = {section: _thaw(config.data[section])
+                    for section in ConfigWatcher.PUBLIC_SECTIONS if section in config.data}
+        return jsonify(dict(sections, **ConfigWatcher.get_status(), success=True))
+    except Exception as e:
+        logger.error(f"Error getting config status: {e}")
+        return jsonify({
+            'error': f'Failed to get config status: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/config/reload', methods=['POST'])
+def api_config_reload():
+    """Reload config.json now instead of waiting for the watcher."""
+    try:
+        changed = ConfigWatcher.reload(force=True)
+        return jsonify(dict(ConfigWatcher.get_status(), changed=changed, success=True))
+    except ValueError as e:
+        return jsonify({
+            'error': f'Invalid configuration: {str(e)}',
+            'version': ConfigWatcher.current().version,
+            'success': False
+        }), 400
+    except Exception as e:
+        logger.error(f"Error reloading config: {e}")
+        return jsonify({
+            'error': f'Failed to reload config: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/server/status')
+def api_server_status():
+    """Get server status and current model info."""
+    if HealthMonitor.is_running():
+        return jsonify(dict(HealthMonitor.get_status(), llamacpp_url=LLAMACPP_API_URL))
+
+    try:
+        is_running = LlamaCppManager.is_server_running()
+        current_model = ModelManager.get_current_model() if is_running else None
+
+        return jsonify({
+            'server_running': is_running,
+            'current_model': current_model,
+            'llamacpp_url': LLAMACPP_API_URL
+        })
+    except Exception as e:
+        logger.error(f"Error checking server status: {e}")
+        return jsonify({
+            'server_running': False,
+            'current_model': None,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/server/events')
+def api_server_events():
+    """Stream server status changes to the browser as Server-Sent Events.
+
+    Beyond ``max_event_streams`` open streams the request is refused with
+    503, and the browser polls /api/server/status instead.
+    """
+    HealthMonitor.start()
+    if not HealthMonitor.open_event_stream():
+        return jsonify({
+            'error': 'Too many open event streams, poll /api/server/status instead',
+            'success': False
+        }), 503
+    keepalive = HealthMonitor.settings().get('sse_keepalive_seconds', 15)
+
+    def stream():
+        version = None
+        while True:
+            status, version = HealthMonitor.wait_for_change(version, keepalive)
+            if status is None:
+                # Comment line keeps proxies from closing an idle stream
+                yield ': keepalive\n\n'
+            else:
+                yield f"event: status\ndata: {json.dumps(dict(status, llamacpp_url=LLAMACPP_API_URL))}\n\n"
+
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the client has gone, even if the stream never started
+    response.call_on_close(HealthMonitor.close_event_stream)
+    return response
+
+
+@app.route('/api/server/resources')
+def api_server_resources():
+    """Get llama-server resource samples and, optionally, a memory-fit check."""
+    try:
+        ResourceSampler.start()
+        limit = request.args.get('limit', type=int)
+        hardware = detect_hardware()
+        result = {
+            'success': True,
+            'interval_seconds': ResourceSampler.settings().get('sample_interval_seconds', 5),
+            'latest': ResourceSampler.latest(),
+            'samples': ResourceSampler.get_samples(limit),
+            'memory_total_mb': hardware['memory_total_mb'],
+            'memory_available_mb': hardware['memory_available_mb']
+        }
+
+        model_name = request.args.get('model')
+        if model_name:
+            model_path = os.path.join(MODELS_DIR, os.path.basename(model_name))
+            if not os.path.exists(model_path):
+                return jsonify({
+                    'error': f'Model file not found: {model_name}',
+                    'success': False
+                }), 404
+            result['fit'] = ResourceSampler.check_fit(model_path)
+
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error getting server resources: {e}")
+        return jsonify({
+            'error': f'Failed to get server resources: {str(e)}',
+            'success': False
+        }), 500
+
+
+# Existing routes with enhanced model tracking...
+
+
+@app.route('/api/conversations')
+def api_conversations():
+    """Get all conversations, including archived ones unless include_archived=false."""
+    try:
+        include_archived = request.args.get('include_archived', 'true').lower() != 'false'
+        etag = api_etag(include_archived, *ConversationManager.list_version(include_archived))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        # Encoded while read from the database, never held as one list
+        response = Response(
+            stream_json('conversations',
+                        ConversationManager.iter_conversations(include_archived=include_archived),
+                        success=True),
+            mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+        response.set_etag(etag, weak=True)
+        return response
+    except Exception as e:
+        logger.error(f"Error loading conversations: {e}")
+        return jsonify({
+            'conversations': [],
+            'error': f'Failed to load conversations: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/conversations', methods=['POST'])
+def api_create_conversation():
+    """Create new conversation with model info."""
+    try:
+        data = request.get_json()
+
+        if not data:
+            data = {}
+
+        title = data.get('title', 'New Chat')
+        model = data.get('model', 'unknown')
+        model_file = data.get('model_file')
+
+        # If no model_file provided, try to get current model
+        if not model_file:
+            try:
+                available_models = ModelManager.get_available_models()
+                current_model = ModelManager.get_current_model()
+                logger.debug(
+                    f"Available models: {len(available_models)}, Current model: {current_model}")
+
+                # Try to match current model to file
+                if current_model and available_models:
+                    for available_model in available_models:
+                        if current_model in available_model['name']:
+                            model_file = available_model['name']
+                            model = current_model
+                            break
+
+                # If no match found but we have available models, use the first one
+                if not model_file and available_models:
+                    model_file = available_models[0]['name']
+                    model = available_models[0]['name']
+                    logger.debug(f"Using first available model: {model_file}")
+
+            except Exception as e:
+                logger.warning(f"Error detecting current model: {e}")
+                # Continue with default values
+                pass
 
         # Create conversation
-        logger.info(
-            f"Creating conversation: title='{title}', model='{model}', model_file='{model_file}'")
         conv_id = ConversationManager.create_conversation(
             title, model, model_file)
-        logger.info(f"Created conversation with ID: {conv_id}")
+        logger.info(f"Created conversation {conv_id} with model {model_file}")
 
         response_data = {
             'conversation_id': conv_id,
@@ -916,7 +6711,6 @@ def api_create_conversation():
             'model': model,
             'model_file': model_file
         }
-        logger.info(f"Returning response: {response_data}")
 
         return jsonify(response_data)
 
@@ -932,11 +6726,9 @@ def api_create_conversation():
 def api_get_conversation(conversation_id):
     """Get conversation with messages and stats."""
     try:
-        logger.info(f"Loading conversation ID: {conversation_id}")
-
-        conversation = ConversationManager.get_conversation(conversation_id)
-        logger.info(
-            f"Found conversation: {dict(conversation) if conversation else None}")
+        with trace_span('conversation_lookup'):
+            conversation = ConversationManager.get_conversation(
+                conversation_id)
 
         if not conversation:
             logger.warning(f"Conversation {conversation_id} not found")
@@ -945,22 +6737,37 @@ def api_get_conversation(conversation_id):
                 'success': False
             }), 404
 
-        messages = ConversationManager.get_messages(conversation_id)
-        logger.info(
-            f"Found {len(messages)} messages for conversation {conversation_id}")
+        # The conversation row and its message counters cover everything below
+        message_count, last_message_id = get_db().execute(
+            'SELECT COUNT(*), MAX(id) FROM messages WHERE conversation_id = ?',
+            (conversation_id,)).fetchone()
+        etag = api_etag(tuple(conversation), message_count, last_message_id)
+        cached = not_modified(etag)
+        if cached:
+            return cached
 
-        stats = ConversationManager.get_conversation_stats(conversation_id)
-        logger.info(f"Stats for conversation {conversation_id}: {stats}")
+        with trace_span('messages_load'):
+            messages = ConversationManager.get_messages(conversation_id)
+
+        with trace_span('stats'):
+            stats = ConversationManager.get_conversation_stats(
+                conversation_id)
+
+        with trace_span('branches'):
+            sibling_ids = ConversationManager.get_sibling_ids(
+                conversation_id, messages)
 
         response_data = {
             'conversation': dict(conversation),
-            'messages': [dict(msg) for msg in messages],
+            'messages': [dict(msg, sibling_ids=sibling_ids[msg['id']]) for msg in messages],
             'stats': stats,
             'success': True
         }
-        logger.info(f"Returning conversation data: {response_data}")
+        logger.debug(f"Loaded conversation {conversation_id} with {len(messages)} messages")
 
-        return jsonify(response_data)
+        response = jsonify(response_data)
+        response.set_etag(etag, weak=True)
+        return response
 
     except Exception as e:
         logger.error(
@@ -971,6 +6778,37 @@ def api_get_conversation(conversation_id):
         }), 500
 
 
+@app.route('/api/conversations/<int:conversation_id>/summary')
+def api_get_conversation_summary(conversation_id):
+    """Get the rolling summary used to compact a conversation's history."""
+    try:
+        if not ConversationManager.get_conversation(conversation_id):
+            return jsonify({
+                'error': 'Conversation not found',
+                'success': False
+            }), 404
+
+        db = get_db()
+        messages = ConversationManager.get_messages(conversation_id)
+        history, summary = ConversationSummaries.build_context(db, conversation_id, messages)
+        versions = db.execute(
+            'SELECT COUNT(*) FROM conversation_summaries WHERE conversation_id = ?',
+            (conversation_id,)).fetchone()[0]
+        return jsonify({
+            'summary': dict(summary) if summary else None,
+            'versions': versions,
+            'uncovered_messages': len(history),
+            'enabled': ConversationSummaries.settings().get('enabled', False),
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error loading summary of conversation {conversation_id}: {e}")
+        return jsonify({
+            'error': f'Failed to load summary: {str(e)}',
+            'success': False
+        }), 500
+
+
 @app.route('/api/conversations/<int:conversation_id>', methods=['DELETE'])
 def api_delete_conversation(conversation_id):
     """Delete conversation."""
@@ -1023,6 +6861,7 @@ def api_update_conversation(conversation_id):
 
         # Update the conversation title
         db = get_db()
+        ConversationArchive.restore(db, conversation_id)
         result = db.execute(
             'UPDATE conversations SET title = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
             (new_title, conversation_id)
@@ -1048,9 +6887,30 @@ def api_update_conversation(conversation_id):
         }), 500
 
 
+def chat_metrics(response_data, summary, history):
+    """Metrics block returned with a generated response."""
+    timings = response_data.get('timings') or {}
+    return {
+        'completion_tokens': response_data.get('completion_tokens'),
+        'prompt_tokens': response_data.get('prompt_tokens'),
+        'total_tokens': response_data.get('total_tokens'),
+        'cached_tokens': timings.get('cached_tokens'),
+        'prompt_ms': timings.get('prompt_ms'),
+        'prompt_per_second': timings.get('prompt_per_second'),
+        'predicted_ms': timings.get('predicted_ms'),
+        'predicted_per_second': timings.get('predicted_per_second'),
+        'draft_model_file': LlamaCppManager.active_draft(),
+        'draft_tokens': timings.get('draft_n'),
+        'draft_accepted_tokens': timings.get('draft_n_accepted'),
+        'summary_version': summary['version'] if summary else None,
+        'history_messages': len(history)
+    }
+
+
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
     """Send message and get response with enhanced model tracking."""
+    grant = None
     try:
         data = request.get_json()
         if not data:
@@ -1063,6 +6923,8 @@ def api_chat():
         message = data.get('message')
         model = data.get('model', 'unknown')
         requested_model_file = data.get('model_file')
+        # Branch off an earlier message instead of continuing the active path
+        parent_id = data.get('parent_id')
 
         if not conversation_id or not message:
             return jsonify({
@@ -1070,21 +6932,38 @@ def api_chat():
                 'success': False
             }), 400
 
-        # Get current conversation to check if model switch is needed
-        conversation = ConversationManager.get_conversation(conversation_id)
+        # Get current conversation to check if model switch is needed; this
+        # also restores an archived one, so its messages can be found below
+        with trace_span('conversation_lookup'):
+            conversation = ConversationManager.get_conversation(
+                conversation_id)
         if not conversation:
             return jsonify({
                 'error': 'Conversation not found',
                 'success': False
             }), 404
 
+        if parent_id is not None and not ConversationManager.get_message(conversation_id, parent_id):
+            return jsonify({
+                'error': 'Parent message not found',
+                'success': False
+            }), 404
+
+        # Rate limits are checked before anything reaches llama-server
+        user_tokens = estimate_tokens(message)
+        grant = RateLimiter.admit('chat', user_tokens)
+        if not grant['allowed']:
+            return RateLimiter.rejection(grant)
+
         current_model_file = None
 
         # If a specific model was requested, try to switch to it
         if requested_model_file:
             try:
-                current_model = ModelManager.get_current_model()
-                available_models = ModelManager.get_available_models()
+                with trace_span('model_detect'):
+                    current_model = ModelManager.get_current_model()
+                with trace_span('model_scan'):
+                    available_models = ModelManager.get_available_models()
 
                 # Check if we need to switch models
                 model_needs_switch = True
@@ -1097,9 +6976,14 @@ def api_chat():
                 if model_needs_switch:
                     model_path = os.path.join(MODELS_DIR, requested_model_file)
                     if os.path.exists(model_path):
+                        switch_grant = RateLimiter.admit('switch')
+                        if not switch_grant['allowed']:
+                            RateLimiter.settle(grant, 0, 0)
+                            return RateLimiter.rejection(switch_grant)
                         logger.info(
                             f"Switching to requested model: {requested_model_file}")
-                        success = LlamaCppManager.switch_model(model_path)
+                        with trace_span('model_switch'):
+                            success = LlamaCppManager.switch_model(model_path)
                         if not success:
                             return jsonify({
                                 'error': f'Failed to switch to model: {requested_model_file}',
@@ -1119,8 +7003,10 @@ def api_chat():
         else:
             # Use current model
             try:
-                current_model = ModelManager.get_current_model()
-                available_models = ModelManager.get_available_models()
+                with trace_span('model_detect'):
+                    current_model = ModelManager.get_current_model()
+                with trace_span('model_scan'):
+                    available_models = ModelManager.get_available_models()
 
                 # Try to determine current model file
                 for available_model in available_models:
@@ -1132,42 +7018,50 @@ def api_chat():
                 pass
 
         # Add user message
-        user_tokens = estimate_tokens(message)
-        ConversationManager.add_message(
-            conversation_id, 'user', message, model, current_model_file, None, user_tokens
-        )
+        with trace_span('db_write_user'):
+            user_message_id = ConversationManager.add_message(
+                conversation_id, 'user', message, model, current_model_file, None, user_tokens,
+                parent_id=parent_id
+            )
 
-        # Get conversation history for context
-        messages = ConversationManager.get_messages(conversation_id)
-        history = [{'role': msg['role'], 'content': msg['content']}
-                   for msg in messages[:-1]]
+        # Get conversation history for context, compacted by the rolling
+        # summary when there is one
+        with trace_span('history_load'):
+            messages = ConversationManager.get_messages(conversation_id)
+            history, summary = ConversationSummaries.build_context(
+                get_db(), conversation_id, messages[:-1])
 
         # Generate response with metrics
-        response_data = LlamaCppAPI.generate_response(model, message, history)
+        with trace_span('generate'):
+            response_data = LlamaCppAPI.generate_response(
+                model, message, history, summary['content'] if summary else None)
+        RateLimiter.settle_response(grant, response_data, user_tokens)
 
         # Add assistant response with metrics and model info
-        ConversationManager.add_message(
-            conversation_id,
-            'assistant',
-            response_data['response'],
-            model,
-            current_model_file,
-            response_data['response_time_ms'],
-            response_data['estimated_tokens']
-        )
+        with trace_span('db_write_assistant'):
+            message_id = ConversationManager.add_message(
+                conversation_id,
+                'assistant',
+                response_data['response'],
+                model,
+                current_model_file,
+                response_data['response_time_ms'],
+                response_data['estimated_tokens'],
+                response_data.get('timings'),
+                parent_id=user_message_id
+            )
+        ConversationSummaries.schedule(conversation_id, current_model_file)
 
         return jsonify({
             'response': response_data['response'],
+            'message_id': message_id,
+            'user_message_id': user_message_id,
             'model': model,
             'model_file': current_model_file,
             'response_time_ms': response_data['response_time_ms'],
             'estimated_tokens': response_data['estimated_tokens'],
             'success': True,
-            'metrics': {
-                'completion_tokens': response_data.get('completion_tokens'),
-                'prompt_tokens': response_data.get('prompt_tokens'),
-                'total_tokens': response_data.get('total_tokens')
-            }
+            'metrics': chat_metrics(response_data, summary, history)
         })
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
@@ -1175,11 +7069,156 @@ def api_chat():
             'error': f'Chat request failed: {str(e)}',
             'success': False
         }), 500
+    finally:
+        # Failed requests return their reserved tokens
+        if grant and grant['allowed']:
+            RateLimiter.settle(grant, 0, 0)
+
+
+@app.route('/api/conversations/<int:conversation_id>/messages/<int:message_id>/regenerate', methods=['POST'])
+def api_regenerate_message(conversation_id, message_id):
+    """Generate another answer as a new branch next to an existing one.
+
+    ``message_id`` is the assistant answer to replace or the user message to
+    answer again. The previous answer is kept; the new one becomes the
+    active path.
+    """
+    grant = None
+    try:
+        data = request.get_json(silent=True) or {}
+        # Restores an archived conversation before its messages are looked up
+        if not ConversationManager.get_conversation(conversation_id):
+            return jsonify({
+                'error': 'Conversation not found',
+                'success': False
+            }), 404
+        target = ConversationManager.get_message(conversation_id, message_id)
+        if not target:
+            return jsonify({
+                'error': 'Message not found',
+                'success': False
+            }), 404
+
+        user_message = target if target['role'] == 'user' else \
+            ConversationManager.get_message(conversation_id, target['parent_id']) \
+            if target['parent_id'] else None
+        if not user_message or user_message['role'] != 'user':
+            return jsonify({
+                'error': 'No user message to answer',
+                'success': False
+            }), 400
+
+        user_tokens = estimate_tokens(user_message['content'])
+        grant = RateLimiter.admit('chat', user_tokens)
+        if not grant['allowed']:
+            return RateLimiter.rejection(grant)
+
+        model = data.get('model') or target['model'] or 'unknown'
+        current_model_file = None
+        try:
+            current_model = ModelManager.get_current_model()
+            for available_model in ModelManager.get_available_models():
+                if current_model and current_model in available_model['name']:
+                    current_model_file = available_model['name']
+                    break
+        except Exception as e:
+            logger.warning(f"Error detecting current model: {e}")
+
+        # Same prefix as the original answer, so llama-server can reuse the
+        # cached prompt instead of evaluating it again
+        with trace_span('history_load'):
+            db = get_db()
+            path = ConversationManager.get_path(db, conversation_id, user_message['id'])
+            history, summary = ConversationSummaries.build_context(
+                db, conversation_id, path[:-1])
+
+        with trace_span('generate'):
+            response_data = LlamaCppAPI.generate_response(
+                model, user_message['content'], history, summary['content'] if summary else None)
+        RateLimiter.settle_response(grant, response_data, user_tokens)
+
+        with trace_span('db_write_assistant'):
+            new_message_id = ConversationManager.add_message(
+                conversation_id,
+                'assistant',
+                response_data['response'],
+                model,
+                current_model_file,
+                response_data['response_time_ms'],
+                response_data['estimated_tokens'],
+                response_data.get('timings'),
+                parent_id=user_message['id']
+            )
+        ConversationSummaries.schedule(conversation_id, current_model_file)
+
+        return jsonify({
+            'response': response_data['response'],
+            'message_id': new_message_id,
+            'parent_id': user_message['id'],
+            'model': model,
+            'model_file': current_model_file,
+            'response_time_ms': response_data['response_time_ms'],
+            'estimated_tokens': response_data['estimated_tokens'],
+            'success': True,
+            'metrics': chat_metrics(response_data, summary, history)
+        })
+    except Exception as e:
+        logger.error(f"Error regenerating message {message_id}: {e}")
+        return jsonify({
+            'error': f'Regenerate failed: {str(e)}',
+            'success': False
+        }), 500
+    finally:
+        # Failed requests return their reserved tokens
+        if grant and grant['allowed']:
+            RateLimiter.settle(grant, 0, 0)
+
+
+@app.route('/api/conversations/<int:conversation_id>/branch', methods=['POST'])
+def api_switch_branch(conversation_id):
+    """Make the newest path through a message the active one."""
+    try:
+        data = request.get_json(silent=True) or {}
+        message_id = data.get('message_id')
+        if not isinstance(message_id, int):
+            return jsonify({
+                'error': 'message_id is required',
+                'success': False
+            }), 400
+        # Restores an archived conversation before its messages are looked up
+        if not ConversationManager.get_conversation(conversation_id):
+            return jsonify({
+                'error': 'Conversation not found',
+                'success': False
+            }), 404
+
+        leaf_id = ConversationManager.set_active_branch(conversation_id, message_id)
+        if leaf_id is None:
+            return jsonify({
+                'error': 'Message not found',
+                'success': False
+            }), 404
+
+        return jsonify({
+            'active_leaf_id': leaf_id,
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error switching branch of conversation {conversation_id}: {e}")
+        return jsonify({
+            'error': f'Failed to switch branch: {str(e)}',
+            'success': False
+        }), 500
 
 
 @app.route('/api/search')
 def api_search():
-    """Search conversations and messages."""
+    """Search conversations and messages.
+
+    ``mode`` is ``keyword`` (substring match), ``semantic`` (embedding
+    similarity) or ``hybrid`` (both, blended); semantic modes fall back to
+    keyword search while the embedding index is unavailable.
+    """
     try:
         query = request.args.get('q', '').strip()
         if not query:
@@ -1188,19 +7227,87 @@ def api_search():
                 'success': True
             })
 
+        settings = EmbeddingIndex.settings()
+        mode = request.args.get('mode') or (
+            settings.get('default_mode', 'hybrid') if EmbeddingIndex.is_enabled() else 'keyword')
+        if mode not in ('keyword', 'semantic', 'hybrid'):
+            return jsonify({
+                'error': 'mode must be keyword, semantic or hybrid',
+                'success': False
+            }), 400
+        if mode != 'keyword' and not EmbeddingIndex.is_enabled():
+            mode = 'keyword'
+
         db = get_db()
-        results = db.execute('''
-            SELECT DISTINCT c.id, c.title, c.model, c.model_file, c.updated_at,
-                   m.content, m.role, m.timestamp, m.response_time_ms, m.estimated_tokens
-            FROM conversations c
-            JOIN messages m ON c.id = m.conversation_id
-            WHERE m.content LIKE ? OR c.title LIKE ?
-            ORDER BY c.updated_at DESC
-            LIMIT 50
-        ''', (f'%{query}%', f'%{query}%')).fetchall()
+        keyword_results = []
+        if mode != 'semantic':
+            limit = 50 if mode == 'keyword' else 200
+            with trace_span('keyword_search'):
+                keyword_results = [dict(row, archived=False) for row in
+                                   ConversationManager.keyword_search(db, query, limit)]
+            # Archived conversations are older than all hot ones, so the
+            # archives are only opened when the hot database runs out
+            include_archived = request.args.get('include_archived', str(
+                ConversationArchive.settings().get('search_archives', True))).lower() != 'false'
+            if include_archived and len(keyword_results) < limit:
+                with trace_span('archive_search'):
+                    keyword_results += ConversationArchive.search(
+                        db, query, limit - len(keyword_results))
+        if mode == 'keyword':
+            return jsonify({
+                'results': keyword_results,
+                'mode': mode,
+                'success': True
+            })
+
+        try:
+            with trace_span('semantic_search'):
+                hits, keyword_scores = EmbeddingIndex.search(
+                    query, 100, [row['message_id'] for row in keyword_results])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Semantic search unavailable, using keyword search: {e}")
+            return jsonify({
+                'results': keyword_results[:50],
+                'mode': 'keyword',
+                'success': True
+            })
+
+        # Blend: cosine similarity plus a bonus for containing the query
+        weight = settings.get('keyword_weight', 0.3) if mode == 'hybrid' else 0
+        scores = {message_id: (1 - weight) * score for message_id, score in hits}
+        keyword_ids = set()
+        for row in keyword_results:
+            keyword_ids.add(row['message_id'])
+            scores[row['message_id']] = (1 - weight) * keyword_scores.get(row['message_id'], 0) + weight
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:50]
+
+        # Keyword hits (possibly from archives) are already loaded; messages
+        # only found semantically are looked up in the hot database
+        rows = {row['message_id']: row for row in keyword_results}
+        missing = [message_id for message_id, _ in ranked if message_id not in rows]
+        if missing:
+            placeholders = ','.join('?' * len(missing))
+            for row in db.execute(f'''
+                SELECT c.id, c.title, c.model, c.model_file, c.updated_at,
+                       m.id AS message_id, {MessageCompression.text_sql('m')} AS content, m.role,
+                       m.timestamp, m.response_time_ms, m.estimated_tokens
+                FROM messages m
+                JOIN conversations c ON c.id = m.conversation_id
+                WHERE m.id IN ({placeholders})
+            ''', missing).fetchall():
+                rows[row['message_id']] = dict(row, archived=False)
+
+        semantic_ids = {message_id for message_id, _ in hits}
+        results = []
+        for message_id, score in ranked:
+            if message_id in rows:
+                match = 'both' if message_id in keyword_ids and message_id in semantic_ids else \
+                    'keyword' if message_id in keyword_ids else 'semantic'
+                results.append(dict(rows[message_id], score=round(score, 4), match=match))
 
         return jsonify({
-            'results': [dict(result) for result in results],
+            'results': results,
+            'mode': mode,
             'success': True
         })
     except Exception as e:
@@ -1212,6 +7319,65 @@ def api_search():
         }), 500
 
 
+@app.route('/api/search/index')
+def api_search_index():
+    """Get the state of the semantic search index."""
+    try:
+        EmbeddingIndex.schedule()
+        return jsonify(dict(EmbeddingIndex.get_status(), success=True))
+    except Exception as e:
+        logger.error(f"Error getting search index status: {e}")
+        return jsonify({
+            'error': f'Failed to get search index status: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/export')
+def api_export():
+    """Stream conversations as NDJSON, optionally filtered by model and date."""
+    try:
+        model = request.args.get('model')
+        since = request.args.get('since')
+        until = request.args.get('until')
+        include_archived = request.args.get('include_archived', 'true').lower() != 'false'
+        filename = f"llama-chat-export-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.ndjson"
+        return Response(
+            ConversationTransfer.export_lines(model, since, until, include_archived),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    except Exception as e:
+        logger.error(f"Error exporting conversations: {e}")
+        return jsonify({
+            'error': f'Export failed: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/import', methods=['POST'])
+def api_import():
+    """Import an NDJSON export streamed in the request body."""
+    try:
+        counts = ConversationTransfer.import_lines(get_db(), request.stream)
+        logger.info(f"Imported {counts['conversations']} conversations, "
+                    f"{counts['messages']} messages")
+        return jsonify({
+            'imported': counts,
+            'success': True
+        })
+    except ValueError as e:
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 400
+    except Exception as e:
+        logger.error(f"Error importing conversations: {e}")
+        return jsonify({
+            'error': f'Import failed: {str(e)}',
+            'success': False
+        }), 500
+
+
 @app.route('/api/stats/<int:conversation_id>')
 def api_conversation_stats(conversation_id):
     """Get detailed statistics for a conversation."""
@@ -1220,11 +7386,11 @@ def api_conversation_stats(conversation_id):
 
         # Get additional detailed stats
         db = get_db()
-        detailed_stats = db.execute('''
+        detailed_stats = db.execute(f'''
             SELECT
                 role,
                 COUNT(*) as count,
-                AVG(LENGTH(content)) as avg_length,
+                AVG(LENGTH({MessageCompression.text_sql()})) as avg_length,
                 SUM(estimated_tokens) as total_tokens,
                 AVG(response_time_ms) as avg_response_time
             FROM messages
@@ -1248,36 +7414,693 @@ def api_conversation_stats(conversation_id):
         }), 500
 
 
-if __name__ == '__main__':
-    # Initialize database
+@app.route('/api/debug/traces')
+def api_debug_traces():
+    """Get recent request traces, newest first."""
+    try:
+        limit = int(request.args.get('limit', 50))
+        min_ms = float(request.args.get('min_ms', 0))
+    except ValueError:
+        return jsonify({
+            'error': 'limit and min_ms must be numbers',
+            'success': False
+        }), 400
+
+    route = request.args.get('route')
+    traces = []
+    for trace in reversed(list(TRACE_BUFFER)):
+        if trace['total_ms'] < min_ms:
+            continue
+        if route and trace['route'] != route:
+            continue
+        traces.append(trace)
+        if len(traces) >= limit:
+            break
+
+    return jsonify({
+        'traces': traces,
+        'count': len(traces),
+        'buffer_size': TRACE_BUFFER_SIZE,
+        'success': True
+    })
+
+
+@app.route('/api/stats')
+def api_usage_stats():
+    """Get usage rollups per model and per hour or day."""
+    try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ROLLUP_GRANULARITIES:
+            return jsonify({
+                'error': f"Invalid granularity: {granularity} (expected 'hour' or 'day')",
+                'success': False
+            }), 400
+
+        try:
+            days = int(request.args.get('days', 30))
+        except ValueError:
+            return jsonify({
+                'error': 'days must be an integer',
+                'success': False
+            }), 400
+
+        since = None
+        if days > 0:
+            db = get_db()
+            since = db.execute(
+                "SELECT strftime(?, 'now', ?)",
+                (ROLLUP_GRANULARITIES[granularity], f'-{days} days')
+            ).fetchone()[0]
+
+        stats = UsageRollups.get_stats(
+            granularity, since, request.args.get('model_file'))
+
+        return jsonify({
+            'granularity': granularity,
+            'since': since,
+            'latency_buckets_ms': list(LATENCY_BUCKETS_MS),
+            'buckets': stats['buckets'],
+            'models': stats['models'],
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error getting usage stats: {e}")
+        return jsonify({
+            'buckets': [],
+            'models': [],
+            'error': f'Failed to get usage statistics: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/quota')
+def api_quota():
+    """Rate limit buckets and today's usage of the calling client."""
+    try:
+        status = RateLimiter.status(get_db(), RateLimiter.client_id())
+        return jsonify(dict(status, success=True))
+    except Exception as e:
+        logger.error(f"Error getting quota: {e}")
+        return jsonify({
+            'error': f'Failed to get quota: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/quota/clients')
+def api_quota_clients():
+    """Usage per client over the last days, heaviest first."""
+    try:
+        try:
+            days = int(request.args.get('days', 7))
+        except ValueError:
+            days = 0
+        if days < 1:
+            return jsonify({
+                'error': 'days must be a positive integer',
+                'success': False
+            }), 400
+
+        return jsonify({
+            'days': days,
+            'clients': RateLimiter.usage(get_db(), days),
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error getting client usage: {e}")
+        return jsonify({
+            'clients': [],
+            'error': f'Failed to get client usage: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/batch/jobs', methods=['POST'])
+def api_create_batch_job():
+    """Queue a batch job for the JSONL prompts streamed in the request body.
+
+    ``model`` (for items that name none) and ``concurrency`` are query
+    parameters.
+    """
+    input_path = None
+    try:
+        directory = BatchJobs.directory()
+        os.makedirs(directory, exist_ok=True)
+        fd, input_path = tempfile.mkstemp(prefix='batch-', suffix='.jsonl', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = request.stream.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+
+        job_id = BatchJobs.create(get_db(), input_path, model_file=request.args.get('model'),
+                                  concurrency=request.args.get('concurrency', type=int))
+        BatchJobs.start(job_id)
+        return jsonify({
+            'job': BatchJobs.get_job(get_db(), job_id),
+            'success': True
+        }), 202
+    except ValueError as e:
+        os.remove(input_path)
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 400
+    except Exception as e:
+        logger.error(f"Error creating batch job: {e}")
+        if input_path and os.path.exists(input_path):
+            os.remove(input_path)
+        return jsonify({
+            'error': f'Failed to create batch job: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/batch/jobs')
+def api_batch_jobs():
+    """List the latest batch jobs, newest first."""
+    try:
+        return jsonify({
+            'jobs': BatchJobs.list_jobs(get_db(), request.args.get('limit', 50, type=int)),
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error listing batch jobs: {e}")
+        return jsonify({
+            'jobs': [],
+            'error': f'Failed to list batch jobs: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/batch/jobs/<int:job_id>')
+def api_batch_job(job_id):
+    """Status and counters of a batch job."""
+    try:
+        job = BatchJobs.get_job(get_db(), job_id)
+        if not job:
+            return jsonify({
+                'error': 'Batch job not found',
+                'success': False
+            }), 404
+        return jsonify({
+            'job': job,
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error getting batch job {job_id}: {e}")
+        return jsonify({
+            'error': f'Failed to get batch job: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/batch/jobs/<int:job_id>/results')
+def api_batch_job_results(job_id):
+    """The results written so far, as JSONL in completion order."""
+    job = BatchJobs.get_job(get_db(), job_id)
+    if not job or not os.path.exists(job['output_path']):
+        return jsonify({
+            'error': 'No results for this batch job',
+            'success': False
+        }), 404
+    return send_from_directory(os.path.dirname(job['output_path']),
+                               os.path.basename(job['output_path']),
+                               mimetype='application/x-ndjson')
+
+
+@app.route('/api/batch/jobs/<int:job_id>/cancel', methods=['POST'])
+def api_cancel_batch_job(job_id):
+    """Stop a batch job once the requests in flight have finished."""
+    try:
+        if not BatchJobs.cancel(get_db(), job_id):
+            return jsonify({
+                'error': 'Batch job is not running',
+                'success': False
+            }), 409
+        return jsonify({
+            'job': BatchJobs.get_job(get_db(), job_id),
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error cancelling batch job {job_id}: {e}")
+        return jsonify({
+            'error': f'Failed to cancel batch job: {str(e)}',
+            'success': False
+        }), 500
+
+
+@app.route('/api/batch/jobs/<int:job_id>/resume', methods=['POST'])
+def api_resume_batch_job(job_id):
+    """Run the prompts of a stopped batch job that have no result yet."""
+    try:
+        if not BatchJobs.resume(get_db(), job_id):
+            return jsonify({
+                'error': 'Batch job is running or has nothing left to run',
+                'success': False
+            }), 409
+        BatchJobs.start(job_id)
+        return jsonify({
+            'job': BatchJobs.get_job(get_db(), job_id),
+            'success': True
+        }), 202
+    except Exception as e:
+        logger.error(f"Error resuming batch job {job_id}: {e}")
+        return jsonify({
+            'error': f'Failed to resume batch job: {str(e)}',
+            'success': False
+        }), 500
+
+
+def run_cli(argv):
+    """Run a maintenance command instead of the web server."""
+    parser = argparse.ArgumentParser(
+        prog='app.py', description='llama-chat maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    benchmark_parser = subparsers.add_parser(
+        'benchmark-models', help='Measure load time and tokens/sec of the available models')
+    benchmark_parser.add_argument(
+        'models', nargs='*', help='Model files to benchmark (default: all)')
+
+    tune_parser = subparsers.add_parser(
+        'tune-model', help='Choose llama-server launch parameters for this host')
+    tune_parser.add_argument(
+        'models', nargs='*', help='Model files to tune (default: all)')
+    tune_parser.add_argument(
+        '--calibrate', action='store_true',
+        help='Refine the thread count with short generation runs (restarts llama-server)')
+    tune_parser.add_argument(
+        '--print-args', action='store_true',
+        help='Print only the llama-server arguments for the first model')
+
+    prefetch_parser = subparsers.add_parser(
+        'prefetch-model', help='Read model files into the page cache')
+    prefetch_parser.add_argument('models', nargs='+', help='Model files to prefetch')
+
+    subparsers.add_parser(
+        'embed-messages', help='Build or update the semantic search index')
+
+    compress_parser = subparsers.add_parser(
+        'compress-messages', help='Compress stored message contents and reclaim the space')
+    compress_parser.add_argument(
+        '--train-dictionary', action='store_true',
+        help='Train a compression dictionary on recent messages first (set use_dictionary to use it)')
+    compress_parser.add_argument(
+        '--recompress', action='store_true',
+        help='Encode already compressed messages again with the current settings')
+    compress_parser.add_argument(
+        '--no-vacuum', action='store_true', help='Skip VACUUM after compressing')
+
+    export_parser = subparsers.add_parser(
+        'export-conversations', help='Write conversations as NDJSON')
+    export_parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+    export_parser.add_argument('--model', help='Only conversations with this model')
+    export_parser.add_argument('--since', help='Only conversations updated at or after this date')
+    export_parser.add_argument('--until', help='Only conversations updated before this date')
+    export_parser.add_argument('--no-archived', action='store_true',
+                               help='Leave out archived conversations')
+
+    import_parser = subparsers.add_parser(
+        'import-conversations', help='Import conversations from an NDJSON export')
+    import_parser.add_argument('file', help="Export file ('-' for stdin)")
+    import_parser.add_argument('--batch-size', type=int, default=5000,
+                               help='Messages per transaction (default: 5000)')
+    import_parser.add_argument('--keep-indexes', action='store_true',
+                               help='Do not drop and rebuild indexes (slower; use while the app is running)')
+
+    archive_parser = subparsers.add_parser(
+        'archive-conversations', help='Move idle conversations to archive databases')
+    archive_parser.add_argument(
+        '--idle-days', type=int, help='Archive conversations idle this long (default: archive.idle_days)')
+    archive_parser.add_argument(
+        '--vacuum', action='store_true', help='Run VACUUM on the hot database afterwards')
+
+    subparsers.add_parser(
+        'build-assets', help='Write content-hashed, precompressed copies of the static files')
+
+    batch_parser = subparsers.add_parser(
+        'batch-run', help='Run a JSONL file of prompts through llama-server')
+    batch_parser.add_argument(
+        'file', nargs='?', help='Input file with one {"prompt": ...} object per line')
+    batch_parser.add_argument('--output', '-o', help='Results file (default: <input>.results.jsonl)')
+    batch_parser.add_argument(
+        '--model', help='Model file for prompts that name none (default: the loaded model)')
+    batch_parser.add_argument(
+        '--concurrency', type=int, help='Requests at a time (default: batch.concurrency)')
+    batch_parser.add_argument(
+        '--resume', type=int, metavar='JOB_ID', help='Run the prompts of a stopped job that have no result yet')
+
+    subparsers.add_parser('batch-jobs', help='List batch jobs')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build-assets':
+        files = StaticAssets.build()['files']
+        for name, entry in sorted(files.items()):
+            sizes = ', '.join(
+                f"{encoding} {os.path.getsize(os.path.join(StaticAssets.DIST_DIR, entry['path'] + suffix)) // 1024} KB"
+                for encoding, suffix in (('gzip', '.gz'), ('br', '.br')) if encoding in entry['encodings'])
+            print(f"{name} -> {entry['path']} ({entry['size'] // 1024} KB{', ' + sizes if sizes else ''})")
+        if brotli is None:
+            print("brotli is not installed: only gzip copies were written")
+        return 0
+
     init_db()
 
-    # Check llama.cpp connection
+    if args.command == 'embed-messages':
+        if not EmbeddingIndex.is_enabled():
+            print("Semantic search is disabled: set semantic_search.enabled and model in "
+                  "config.json and install numpy", file=sys.stderr)
+            return 1
+        # Leave a server started by the running app alone
+        server_was_up = EmbeddingIndex.server_up()
+        if not EmbeddingIndex.ensure_server():
+            print("Could not start the embedding server", file=sys.stderr)
+            return 1
+        started = time.time()
+        indexed = 0
+        try:
+            while True:
+                batch = EmbeddingIndex.index_pending(max_batches=50)
+                if not batch:
+                    break
+                indexed += batch
+                print(f"{indexed} messages embedded ({indexed / (time.time() - started):.0f}/s)")
+        finally:
+            if not server_was_up:
+                EmbeddingIndex.stop_server()
+        status = EmbeddingIndex.get_status()
+        print(f"Index: {status['indexed_messages']} messages, {status['dimensions']} dimensions, "
+              f"{status['size_bytes'] / (1024 * 1024):.1f} MB")
+        return 0
+
+    if args.command == 'compress-messages':
+        if not MessageCompression.settings().get('enabled', True) and not args.recompress:
+            print("Compression is disabled in config.json; use --recompress to store "
+                  "compressed messages as plain text again", file=sys.stderr)
+            return 1
+        size_before = os.path.getsize(DATABASE_PATH)
+        with sqlite3.connect(DATABASE_PATH) as db:
+            if args.train_dictionary:
+                try:
+                    dictionary_id = MessageCompression.train_dictionary(db)
+                except ValueError as e:
+                    print(e, file=sys.stderr)
+                    return 1
+                print(f"Trained {MessageCompression.algorithm()} dictionary {dictionary_id}")
+            started = time.time()
+            changed, bytes_before, bytes_after = MessageCompression.compress_messages(
+                db, recompress=args.recompress)
+            print(f"{changed} messages re-encoded in {time.time() - started:.1f}s: "
+                  f"{bytes_before / (1024 * 1024):.1f} MB -> {bytes_after / (1024 * 1024):.1f} MB")
+            if not args.no_vacuum:
+                print("Running VACUUM (needs free space for a copy of the database)...")
+                db.execute('VACUUM')
+                db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        print(f"Database: {size_before / (1024 * 1024):.1f} MB -> "
+              f"{os.path.getsize(DATABASE_PATH) / (1024 * 1024):.1f} MB")
+        return 0
+
+    if args.command == 'export-conversations':
+        started = time.time()
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        lines = 0
+        try:
+            for line in ConversationTransfer.export_lines(
+                    args.model, args.since, args.until, not args.no_archived):
+                output.write(line)
+                lines += 1
+        finally:
+            if args.output:
+                output.close()
+        print(f"Exported {lines - 1} records in {time.time() - started:.1f}s", file=sys.stderr)
+        return 0
+
+    if args.command == 'import-conversations':
+        started = time.time()
+        source = sys.stdin if args.file == '-' else open(args.file)
+        try:
+            with sqlite3.connect(DATABASE_PATH) as db:
+                counts = ConversationTransfer.import_lines(
+                    db, source, args.batch_size, defer_indexes=not args.keep_indexes)
+        except ValueError as e:
+            print(f"Import failed: {e}", file=sys.stderr)
+            return 1
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        print(f"Imported {counts['conversations']} conversations, {counts['messages']} messages "
+              f"in {time.time() - started:.1f}s")
+        return 0
+
+    if args.command == 'archive-conversations':
+        started = time.time()
+        with sqlite3.connect(DATABASE_PATH) as db:
+            archived = ConversationArchive.archive_idle(db, args.idle_days)
+            print(f"Archived {archived} conversations in {time.time() - started:.1f}s")
+            if args.vacuum:
+                db.execute('VACUUM')
+                db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        for path in ConversationArchive.archive_files():
+            with sqlite3.connect(path) as archive:
+                conversations = archive.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+            print(f"{os.path.basename(path)}: {conversations} conversations, "
+                  f"{os.path.getsize(path) / (1024 * 1024):.1f} MB")
+        print(f"Hot database: {os.path.getsize(DATABASE_PATH) / (1024 * 1024):.1f} MB")
+        return 0
+
+    if args.command == 'batch-run':
+        with sqlite3.connect(DATABASE_PATH) as db:
+            db.row_factory = sqlite3.Row
+            if args.resume:
+                if not BatchJobs.resume(db, args.resume):
+                    print(f"Batch job {args.resume} is running or has nothing left to run", file=sys.stderr)
+                    return 1
+                job_id = args.resume
+            elif args.file:
+                try:
+                    job_id = BatchJobs.create(db, args.file, args.output, args.model, args.concurrency)
+                except (OSError, ValueError) as e:
+                    print(f"Batch job not created: {e}", file=sys.stderr)
+                    return 1
+            else:
+                parser.error('batch-run needs an input file or --resume')
+            job = BatchJobs.get_job(db, job_id)
+        print(f"Batch job {job_id}: {job['total_items']} prompts -> {job['output_path']}")
+
+        def progress(job):
+            model = f", {job['current_model']}" if job['current_model'] else ''
+            print(f"{job['completed_items'] + job['failed_items']}/{job['total_items']} done, "
+                  f"{job['failed_items']} failed{model}", flush=True)
+
+        started = time.time()
+        try:
+            status = BatchJobs.run(job_id, progress)
+        except KeyboardInterrupt:
+            print(f"\nStopped; continue with: python app.py batch-run --resume {job_id}", file=sys.stderr)
+            return 130
+        with sqlite3.connect(DATABASE_PATH) as db:
+            db.row_factory = sqlite3.Row
+            job = BatchJobs.get_job(db, job_id)
+        print(f"Batch job {job_id} {status} in {time.time() - started:.1f}s: "
+              f"{job['completed_items']} completed, {job['failed_items']} failed")
+        return 0 if status == 'finished' and not job['failed_items'] else 1
+
+    if args.command == 'batch-jobs':
+        with sqlite3.connect(DATABASE_PATH) as db:
+            db.row_factory = sqlite3.Row
+            jobs = BatchJobs.list_jobs(db)
+        print(f"{'id':>5}  {'status':<12}{'done':>12}{'failed':>8}  {'created':<20}output")
+        for job in jobs:
+            print(f"{job['id']:>5}  {job['status']:<12}"
+                  f"{str(job['completed_items']) + '/' + str(job['total_items']):>12}"
+                  f"{job['failed_items']:>8}  {job['created_at']:<20}{job['output_path']}")
+        return 0
+
+    if args.command == 'benchmark-models':
+        results = ModelBenchmark.run(
+            args.models or None,
+            lambda index, total, name: print(f"[{index + 1}/{total}] {name}..."))
+        print(f"\n{'model':<45}{'load s':>8}{'prompt t/s':>12}{'gen t/s':>10}{'peak MB':>10}")
+        for result in sorted(results, key=lambda r: r['generation_tokens_per_second'] or 0, reverse=True):
+            if result['error']:
+                print(f"{result['model_file']:<45}  {result['error']}")
+                continue
+            print(f"{result['model_file']:<45}"
+                  f"{(result['load_time_ms'] or 0) / 1000:>8.1f}"
+                  f"{result['prompt_tokens_per_second'] or 0:>12.1f}"
+                  f"{result['generation_tokens_per_second'] or 0:>10.1f}"
+                  f"{result['peak_rss_mb'] or 0:>10.0f}")
+        return 0 if all(not r['error'] for r in results) else 1
+
+    if args.command == 'prefetch-model':
+        status = 0
+        for name in args.models:
+            model_path = name if os.path.isfile(name) else os.path.join(MODELS_DIR, name)
+            if not os.path.isfile(model_path):
+                print(f"{name}: not found", file=sys.stderr)
+                status = 1
+                continue
+            job = ModelPrefetcher.warm(model_path)
+            print(f"{os.path.basename(model_path)}: {os.path.getsize(model_path) / (1024 * 1024):.0f} MB "
+                  f"in {job['duration_ms'] / 1000:.1f}s ({job['mb_per_second']} MB/s), "
+                  f"page cache {job['residency_before']} -> {job['residency_after']}")
+        return status
+
+    if args.command == 'tune-model':
+        models = ModelManager.get_available_models()
+        if args.models:
+            # Accept model file names from MODELS_DIR as well as paths
+            models = [{'name': os.path.basename(name), 'file_path': name} if os.path.isfile(name)
+                      else next((m for m in models if m['name'] == name), None)
+                      for name in args.models]
+            models = [m for m in models if m]
+        if not models:
+            print("No matching models found", file=sys.stderr)
+            return 1
+
+        if args.print_args:
+            params = LaunchTuner.get_params(models[0]['file_path'], calibrate=args.calibrate)
+            print(' '.join(LaunchTuner.build_args(params)))
+            return 0
+
+        hardware = detect_hardware()
+        print(f"CPU: {hardware['cpu_model']} - {hardware['physical_cores']} physical cores, "
+              f"{hardware['usable_cpus']} usable CPUs, cgroup limit {hardware['cgroup_cpu_limit'] or 'none'}, "
+              f"{hardware['numa_nodes']} NUMA node(s)")
+        print(f"Memory: {hardware['memory_available_mb']} MB available of {hardware['memory_total_mb']} MB")
+        for model in models:
+            params = LaunchTuner.get_params(model['file_path'], calibrate=args.calibrate, refresh=True)
+            print(f"\n{model['name']}\n  {' '.join(LaunchTuner.build_args(params))}")
+            for note in params.get('notes', []):
+                print(f"  note: {note}")
+        return 0
+
+    return 0
+
+
+class StartupTimer:
+    """Durations of the startup phases, for the startup report."""
+
+    phases = []
+
+    @staticmethod
+    @contextmanager
+    def phase(name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            StartupTimer.phases.append((name, time.perf_counter() - started))
+
+    @staticmethod
+    def process_age():
+        """Seconds since this process started (Linux only), else None."""
+        try:
+            with open('/proc/self/stat') as f:
+                # Fields after the command name; starttime is the 22nd field
+                started = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+            with open('/proc/uptime') as f:
+                return float(f.read().split()[0]) - started
+        except (OSError, ValueError, IndexError):
+            return None
+
+    @staticmethod
+    def report(what):
+        """Log how long the process took to get ready, phase by phase.
+
+        Time not spent in a named phase (interpreter start, imports,
+        configuration) is reported as ``imports and setup``.
+        """
+        total = StartupTimer.process_age()
+        phases = list(StartupTimer.phases)
+        if total is not None:
+            phases.insert(0, ('imports and setup', max(0.0, total - sum(d for _, d in phases))))
+        else:
+            total = sum(d for _, d in phases)
+        logger.info(f"{what} ready after {total:.2f}s: " +
+                    ', '.join(f"{name} {duration * 1000:.0f}ms" for name, duration in phases))
+
+
+def run_startup_checks():
+    """Log what llama.cpp serves and which models are available.
+
+    Runs on a background thread: a llama-server that is down or hung can
+    take the whole connect and read timeout to answer, which must not keep
+    the app from serving requests.
+    """
+    started = time.perf_counter()
     models = LlamaCppAPI.get_models()
     if models:
         logger.info(f"Connected to llama.cpp. Available models: {models}")
     else:
         logger.warning("Could not connect to llama.cpp or no models available")
+    upstream_seconds = time.perf_counter() - started
 
-    # Check available models in directory
     available_models = ModelManager.get_available_models()
     logger.info(
         f"Found {len(available_models)} models in directory: {[m['name'] for m in available_models]}")
+    logger.info(f"Startup checks finished in {time.perf_counter() - started:.2f}s "
+                f"(llama.cpp {upstream_seconds * 1000:.0f}ms, model directory "
+                f"{(time.perf_counter() - started - upstream_seconds) * 1000:.0f}ms)")
+
+
+def start_background_services():
+    """Start the background threads of a process that serves requests."""
+    HealthMonitor.start()
+    ResourceSampler.start()
+    ConversationArchive.start()
+    ConfigWatcher.start()
+
+
+def init_worker():
+    """Prepare a gunicorn worker process (see gunicorn.conf.py).
+
+    Workers start at the same time, so the database is initialized and
+    migrated by one of them at a time.
+    """
+    with StartupTimer.phase('database'), FileLock(DATABASE_PATH + '.init.lock'):
+        init_db()
+    with StartupTimer.phase('background services'):
+        start_background_services()
+    StartupTimer.report(f"Worker {os.getpid()}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+
+    # Initialize database
+    with StartupTimer.phase('database'):
+        init_db()
 
     # Log current configuration
-    logger.info(f"llama.cpp timeout: {LLAMACPP_TIMEOUT}s")
-    logger.info(f"Model switch timeout: {MODEL_SWITCH_TIMEOUT}s")
-    logger.info(
-        f"Context history limit: {CONFIG['performance']['context_history_limit']} messages")
-    logger.info(f"Temperature: {CONFIG['model_options']['temperature']}")
+    config = ConfigWatcher.current()
+    logger.info(f"Configuration version {config.version} ({config.digest})")
+    logger.info(f"llama.cpp timeout: {config.timeouts[1]}s")
+    logger.info(f"Model switch timeout: {CONFIG['timeouts']['model_switch_timeout']}s")
+    logger.info(f"Context history limit: {config.history_limit} messages")
+    logger.info(f"Temperature: {config.sampling['temperature']}")
 
     # Run the app with threading enabled
     flask_host = os.getenv('FLASK_HOST', '0.0.0.0')
     flask_port = int(os.getenv('FLASK_PORT', 3000))
+    debug = os.getenv('DEBUG', 'False').lower() == 'true'
+
+    # With the reloader only the child process serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        with StartupTimer.phase('background services'):
+            start_background_services()
+        # llama.cpp and the model directory are checked while the app
+        # already listens
+        threading.Thread(target=run_startup_checks, name='startup-checks', daemon=True).start()
+        StartupTimer.report('App')
 
     app.run(
         host=flask_host,
         port=flask_port,
-        debug=os.getenv('DEBUG', 'False').lower() == 'true',
+        debug=debug,
         threaded=True
     )
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Stand-in llama-server for benchmarks.
+
+Implements the parts of the llama-server HTTP API that llama-chat uses
+(/health, /v1/models and /v1/chat/completions, streaming and non-streaming)
+with a configurable prompt latency and token generation rate, so the Flask
+application can be load-tested without a model or a CPU busy generating.
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+FILLER_WORDS = (
+    "the model answers with a steady stream of plausible words so that "
+    "response sizes and timings look like a real generation run"
+).split()
+
+
+class FakeLlamaServerConfig:
+    """Behaviour knobs shared by all request handlers."""
+
+    def __init__(self, model='fake-model.gguf', prompt_latency_ms=50,
+                 tokens_per_second=50.0, completion_tokens=64,
+                 prompt_ms_per_token=0.5):
+        self.model = model
+        self.prompt_latency_ms = prompt_latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.prompt_ms_per_token = prompt_ms_per_token
+
+
+def _estimate_prompt_tokens(messages):
+    return max(1, sum(len(m.get('content', '')) for m in messages) // 4)
+
+
+class FakeLlamaServerHandler(BaseHTTPRequestHandler):
+    """Request handler emulating llama-server responses and timings."""
+
+    protocol_version = 'HTTP/1.1'
+    config = FakeLlamaServerConfig()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json({'status': 'ok'})
+        elif self.path == '/v1/models':
+            self._send_json({
+                'object': 'list',
+                'data': [{'id': self.config.model, 'object': 'model'}]
+            })
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        if self.path != '/v1/chat/completions':
+            self._send_json({'error': 'not found'}, 404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        messages = payload.get('messages', [])
+        config = self.config
+
+        prompt_tokens = _estimate_prompt_tokens(messages)
+        completion_tokens = min(config.completion_tokens,
+                                payload.get('max_tokens') or config.completion_tokens)
+        prompt_ms = config.prompt_latency_ms + \
+            prompt_tokens * config.prompt_ms_per_token
+        token_interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+
+        time.sleep(prompt_ms / 1000)
+
+        if payload.get('stream'):
+            self._stream(completion_tokens, token_interval)
+            return
+
+        time.sleep(token_interval * completion_tokens)
+        predicted_ms = token_interval * completion_tokens * 1000
+        text = ' '.join(FILLER_WORDS[i % len(FILLER_WORDS)]
+                        for i in range(completion_tokens))
+        self._send_json({
+            'object': 'chat.completion',
+            'model': config.model,
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': text}
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            },
+            'timings': {
+                'prompt_n': prompt_tokens,
+                'prompt_ms': prompt_ms,
+                'prompt_per_second': prompt_tokens / (prompt_ms / 1000) if prompt_ms else None,
+                'predicted_n': completion_tokens,
+                'predicted_ms': predicted_ms,
+                'predicted_per_second': config.tokens_per_second
+            }
+        })
+
+    def _stream(self, completion_tokens, token_interval):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send_chunk(data):
+            event = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(event):X}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+
+        for i in range(completion_tokens):
+            time.sleep(token_interval)
+            send_chunk(json.dumps({
+                'object': 'chat.completion.chunk',
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': FILLER_WORDS[i % len(FILLER_WORDS)] + ' '}
+                }]
+            }))
+        send_chunk('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_fake_server(host='127.0.0.1', port=0, config=None):
+    """Start the fake server on a background thread and return it.
+
+    With port 0 an ephemeral port is chosen; read it from
+    ``server.server_address``. Call ``server.shutdown()`` to stop.
+    """
+    handler = type('ConfiguredHandler', (FakeLlamaServerHandler,), {
+        'config': config or FakeLlamaServerConfig()
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8120)
+    parser.add_argument('--model', default='fake-model.gguf')
+    parser.add_argument('--prompt-latency-ms', type=float, default=50)
+    parser.add_argument('--prompt-ms-per-token', type=float, default=0.5)
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--completion-tokens', type=int, default=64)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = FakeLlamaServerConfig(
+        model=args.model,
+        prompt_latency_ms=args.prompt_latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        prompt_ms_per_token=args.prompt_ms_per_token
+    )
+    server = start_fake_server(args.host, args.port, config)
+    logger.info(f"Fake llama-server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic llama-chat database for benchmarks.
+
+Produces a reproducible (seeded) database with the application schema,
+alternating user/assistant messages spread over a configurable time range,
+assistant metrics filled in and the usage rollups built.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+WORDS = (
+    "model token context prompt server python flask sqlite thread memory "
+    "cache latency request response function variable install configure "
+    "error debug deploy container network socket benchmark throughput "
+    "quantization llama gguf vector matrix gradient compile kernel"
+).split()
+
+CODE_SNIPPET = '''```python
+def handler(request):
+    data = request.get_json()
+    for item in data["items"]:
+        process(item)
+    return {"ok": True}
+```'''
+
+BATCH_SIZE = 10000
+
+
+def _text(rng, min_words, max_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def generate(path, messages, messages_per_conversation=40, days=365,
+             models=('qwen2.5-0.5b-instruct-q4_0.gguf', 'phi3-mini-4k-instruct-q4.gguf'),
+             seed=42):
+    """Create ``path`` containing roughly ``messages`` messages."""
+    if os.path.exists(path):
+        os.remove(path)
+
+    os.environ['DATABASE_PATH'] = path
+    sys.path.insert(0, os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__))))
+    import app
+
+    rng = random.Random(seed)
+    conversations = max(1, messages // messages_per_conversation)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+    span_seconds = days * 86400
+
+    with sqlite3.connect(path) as conn:
+        conn.executescript(app.SCHEMA)
+        conn.execute('PRAGMA journal_mode=WAL')
+
+        conversation_rows = []
+        message_rows = []
+        message_id = 0
+        for conversation_id in range(1, conversations + 1):
+            model = rng.choice(models)
+            created = start + timedelta(seconds=rng.randint(0, span_seconds))
+            count = messages_per_conversation if conversation_id < conversations else max(
+                1, messages - message_id)
+            timestamp = created
+            for index in range(count):
+                timestamp += timedelta(seconds=rng.randint(5, 300))
+                stamp = timestamp.strftime('%Y-%m-%d %H:%M:%S')
+                if index % 2 == 0:
+                    content = _text(rng, 5, 80)
+                    message_rows.append((conversation_id, 'user', content, model, model, stamp,
+                                         None, max(1, len(content) // 4)))
+                else:
+                    content = _text(rng, 40, 600)
+                    if rng.random() < 0.2:
+                        content += '\n\n' + CODE_SNIPPET
+                    tokens = max(1, len(content) // 4)
+                    message_rows.append((conversation_id, 'assistant', content, model, model, stamp,
+                                         int(tokens / rng.uniform(8, 40) * 1000), tokens))
+                message_id += 1
+
+            conversation_rows.append((conversation_id, f"Conversation {conversation_id}: {_text(rng, 2, 5)}",
+                                      model, model, created.strftime('%Y-%m-%d %H:%M:%S'),
+                                      timestamp.strftime('%Y-%m-%d %H:%M:%S')))
+
+            if len(message_rows) >= BATCH_SIZE:
+                _flush(conn, conversation_rows, message_rows)
+
+        _flush(conn, conversation_rows, message_rows)
+
+    # Run migrations and build the usage rollups like a first app start would
+    app.init_db()
+    return conversations, message_id
+
+
+def _flush(conn, conversation_rows, message_rows):
+    conn.executemany(
+        'INSERT INTO conversations (id, title, model, model_file, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+        conversation_rows)
+    conn.executemany(
+        'INSERT INTO messages (conversation_id, role, content, model, model_file, timestamp, response_time_ms, estimated_tokens) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        message_rows)
+    conn.commit()
+    conversation_rows.clear()
+    message_rows.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', help='Database file to create (overwritten)')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--messages-per-conversation', type=int, default=40)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.time()
+    conversations, messages = generate(
+        args.path, args.messages, args.messages_per_conversation, args.days, seed=args.seed)
+    print(f"Generated {messages} messages in {conversations} conversations "
+          f"at {args.path} in {time.time() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
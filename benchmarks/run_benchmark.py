@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Load-test llama-chat against a stand-in llama-server.
+
+Starts the fake llama-server and the Flask application (as a subprocess, the
+same way chat-manager.sh does), drives the main API endpoints at a
+configurable concurrency against a generated database, reports
+p50/p95/p99 latency and throughput per scenario and optionally compares the
+run with a saved baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_llama_server import FakeLlamaServerConfig, start_fake_server  # noqa: E402
+from generate_db import generate  # noqa: E402
+
+SCENARIOS = ('conversations', 'conversation', 'search', 'chat')
+SEARCH_TERMS = ('model', 'python', 'latency', 'cache', 'deploy',
+                'socket', 'gradient', 'nonexistentterm')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, quantile):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(quantile * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def start_app(database_path, llamacpp_url, port, log_path):
+    """Start app.py in a subprocess and wait until it answers."""
+    models_dir = tempfile.mkdtemp(prefix='llama-chat-bench-models-')
+
+    # The load comes from one client, so per-client rate limits would
+    # reject most of it; admission and usage accounting still run
+    with open(os.path.join(PROJECT_DIR, 'config.json')) as f:
+        config = json.load(f)
+    config.setdefault('rate_limits', {})['enabled'] = False
+    config_path = os.path.join(models_dir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+    env = os.environ.copy()
+    env.update({
+        'FLASK_HOST': '127.0.0.1',
+        'FLASK_PORT': str(port),
+        'DATABASE_PATH': database_path,
+        'LLAMACPP_API_URL': llamacpp_url,
+        'MODELS_DIR': models_dir,
+        'LLAMACPP_PID_FILE': os.path.join(models_dir, 'llamacpp.pid'),
+        'CONFIG_PATH': config_path,
+    })
+    log_file = open(log_path, 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(PROJECT_DIR, 'app.py')],
+                               stdout=log_file, stderr=subprocess.STDOUT, env=env,
+                               cwd=PROJECT_DIR)
+
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"app.py exited with code {process.returncode}, see {log_path}")
+        try:
+            requests.get(f'{base_url}/metrics', timeout=1)
+            return process, base_url
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"app.py did not start, see {log_path}")
+
+
+def import_export(database_path, export_path):
+    """Seed a database from an NDJSON export with the app's importer."""
+    env = os.environ.copy()
+    env['DATABASE_PATH'] = database_path
+    subprocess.run([sys.executable, os.path.join(PROJECT_DIR, 'app.py'),
+                    'import-conversations', export_path],
+                   env=env, cwd=PROJECT_DIR, check=True)
+
+
+class Scenario:
+    """One endpoint workload: builds requests and records their latencies."""
+
+    def __init__(self, name, base_url, conversation_ids, rng):
+        self.name = name
+        self.base_url = base_url
+        self.conversation_ids = conversation_ids
+        self.rng = rng
+        self.chat_conversations = []
+
+    def prepare(self, session, concurrency):
+        if self.name == 'chat':
+            for _ in range(concurrency):
+                response = session.post(f'{self.base_url}/api/conversations',
+                                        json={'title': 'Benchmark chat'})
+                self.chat_conversations.append(
+                    response.json()['conversation_id'])
+
+    def request(self, session, index):
+        if self.name == 'conversations':
+            return session.get(f'{self.base_url}/api/conversations')
+        if self.name == 'conversation':
+            conversation_id = self.rng.choice(self.conversation_ids)
+            return session.get(f'{self.base_url}/api/conversations/{conversation_id}')
+        if self.name == 'search':
+            term = SEARCH_TERMS[index % len(SEARCH_TERMS)]
+            return session.get(f'{self.base_url}/api/search', params={'q': term})
+        conversation_id = self.chat_conversations[index % len(
+            self.chat_conversations)]
+        return session.post(f'{self.base_url}/api/chat', json={
+            'conversation_id': conversation_id,
+            'message': f'Benchmark question {index}: explain the model cache briefly.'
+        })
+
+
+def run_scenario(scenario, requests_count, concurrency):
+    sessions = [requests.Session() for _ in range(concurrency)]
+    scenario.prepare(sessions[0], concurrency)
+
+    def worker(worker_index):
+        session = sessions[worker_index]
+        latencies, errors = [], 0
+        for index in range(worker_index, requests_count, concurrency):
+            start = time.perf_counter()
+            try:
+                response = scenario.request(session, index)
+                response.content
+                if response.status_code >= 400:
+                    errors += 1
+            except requests.exceptions.RequestException:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for worker_latencies,
+                       _ in results for latency in worker_latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(latencies[-1], 2),
+        'throughput_rps': round(len(latencies) / elapsed, 2)
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table and return the list of regressions."""
+    regressions = []
+    print(f"\n{'scenario':<14}{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change < -threshold if metric == 'throughput_rps' else change > threshold
+            flag = '  REGRESSION' if worse else ''
+            print(f"{name:<14}{metric:<16}{old:>12.2f}{new:>12.2f}{change:>+9.1%}{flag}")
+            if worse:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=10000,
+                        help='Messages in the generated database (default: 10000)')
+    parser.add_argument('--db', help='Database to benchmark; generated if missing')
+    parser.add_argument('--from-export',
+                        help='Seed a missing database from this NDJSON export instead of generating it')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Requests per scenario')
+    parser.add_argument('--prompt-latency-ms', type=float, default=50)
+    parser.add_argument('--tokens-per-second', type=float, default=200)
+    parser.add_argument('--completion-tokens', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against a saved results file')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change treated as a regression (default: 0.10)')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    scenarios = [name.strip()
+                 for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    work_dir = tempfile.mkdtemp(prefix='llama-chat-bench-')
+    database_path = args.db or os.path.join(
+        work_dir, f'bench_{args.messages}.db')
+    if not os.path.exists(database_path):
+        if args.from_export:
+            print(f"Importing {args.from_export}...")
+            import_export(database_path, args.from_export)
+        else:
+            print(f"Generating database with {args.messages} messages...")
+            generate(database_path, args.messages, seed=args.seed)
+
+    fake_config = FakeLlamaServerConfig(
+        prompt_latency_ms=args.prompt_latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens
+    )
+    fake_server = start_fake_server(config=fake_config)
+    llamacpp_url = f'http://127.0.0.1:{fake_server.server_address[1]}'
+
+    log_path = os.path.join(work_dir, 'app.log')
+    process, base_url = start_app(
+        database_path, llamacpp_url, free_port(), log_path)
+
+    try:
+        conversation_ids = [conv['id'] for conv in
+                            requests.get(f'{base_url}/api/conversations').json()['conversations']]
+        rng = random.Random(args.seed)
+
+        results = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'database': database_path,
+                'messages': args.messages,
+                'concurrency': args.concurrency,
+                'requests_per_scenario': args.requests,
+                'fake_server': vars(fake_config)
+            },
+            'scenarios': {}
+        }
+
+        print(f"\n{'scenario':<14}{'requests':>9}{'errors':>8}{'p50 ms':>10}"
+              f"{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+        for name in scenarios:
+            scenario = Scenario(name, base_url, conversation_ids, rng)
+            stats = run_scenario(scenario, args.requests, args.concurrency)
+            results['scenarios'][name] = stats
+            print(f"{name:<14}{stats['requests']:>9}{stats['errors']:>8}{stats['p50_ms']:>10.1f}"
+                  f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['throughput_rps']:>10.1f}")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        fake_server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+            if args.fail_on_regression:
+                sys.exit(1)
+        else:
+            print("\nNo regressions")
+
+
+if __name__ == '__main__':
+    main()
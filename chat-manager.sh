@@ -34,16 +34,22 @@ CONFIG_FILE="$SCRIPT_DIR/cm.conf"
 if [ -f "$CONFIG_FILE" ]; then
     source "$CONFIG_FILE"
 fi
+# The app writes its log file (logging.file in config.json) here too
+export LOG_DIR
 
 # Default values (can be overridden by config file)
 LLAMACPP_PORT="${LLAMACPP_PORT:-8120}"
 LLAMACPP_HOST="${LLAMACPP_HOST:-127.0.0.1}"
 FLASK_PORT="${FLASK_PORT:-3333}"
 FLASK_HOST="${FLASK_HOST:-127.0.0.1}"
+# More than one worker runs the app under gunicorn (see gunicorn.conf.py)
+WORKERS="${WORKERS:-1}"
+WORKER_THREADS="${WORKER_THREADS:-8}"
 CONTEXT_SIZE="${CONTEXT_SIZE:-4096}"
 GPU_LAYERS="${GPU_LAYERS:-0}"
 THREADS="${THREADS:-$(nproc 2>/dev/null || echo "4")}"
 BATCH_SIZE="${BATCH_SIZE:-512}"
+AUTO_TUNE="${AUTO_TUNE:-false}"
 
 # Enhanced configuration for model switching
 MODEL_SWITCH_TIMEOUT="${MODEL_SWITCH_TIMEOUT:-60}"
@@ -191,17 +197,30 @@ start_llamacpp() {
     cmd="$cmd --model '$model_file'"
     cmd="$cmd --host '$LLAMACPP_HOST'"
     cmd="$cmd --port '$LLAMACPP_PORT'"
-    cmd="$cmd --ctx-size '$CONTEXT_SIZE'"
-    cmd="$cmd --threads '$THREADS'"
-    cmd="$cmd --batch-size '$BATCH_SIZE'"
-    cmd="$cmd --n-gpu-layers '$GPU_LAYERS'"
 
-    # Add performance optimizations
-    if [ "$USE_MMAP" = "true" ]; then
-        cmd="$cmd --mmap"
+    # Use hardware-tuned launch parameters when enabled (cached per model and host)
+    local tuned_args=""
+    if [ "$AUTO_TUNE" = "true" ] && [ -x "$VENV_DIR/bin/python" ]; then
+        tuned_args=$(cd "$SCRIPT_DIR" && MODELS_DIR="$MODELS_DIR" \
+            "$VENV_DIR/bin/python" app.py tune-model --print-args "$model_file" 2>/dev/null)
     fi
-    if [ "$USE_MLOCK" = "true" ]; then
-        cmd="$cmd --mlock"
+
+    if [ -n "$tuned_args" ]; then
+        print_info "Auto-tuned parameters: $tuned_args"
+        cmd="$cmd $tuned_args"
+    else
+        cmd="$cmd --ctx-size '$CONTEXT_SIZE'"
+        cmd="$cmd --threads '$THREADS'"
+        cmd="$cmd --batch-size '$BATCH_SIZE'"
+        cmd="$cmd --n-gpu-layers '$GPU_LAYERS'"
+
+        # Add performance optimizations
+        if [ "$USE_MMAP" = "true" ]; then
+            cmd="$cmd --mmap"
+        fi
+        if [ "$USE_MLOCK" = "true" ]; then
+            cmd="$cmd --mlock"
+        fi
     fi
 
     # Start server in background
@@ -304,8 +323,20 @@ start_flask() {
     # Create logs directory
     mkdir -p "$LOG_DIR"
 
-    # Start Flask app
+    # Refresh the hashed, precompressed static files
     cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        python app.py build-assets > /dev/null 2>&1
+    ) || print_warning "Could not build static assets, serving them unhashed"
+
+    local server_cmd="python app.py"
+    if [ "$WORKERS" -gt 1 ]; then
+        server_cmd="gunicorn --config gunicorn.conf.py app:app"
+        print_info "Running $WORKERS workers with $WORKER_THREADS threads each"
+    fi
+
+    # Start Flask app
     nohup bash -c "
         source venv/bin/activate
         export FLASK_HOST='$FLASK_HOST'
@@ -313,14 +344,17 @@ start_flask() {
         export LLAMACPP_HOST='$LLAMACPP_HOST'
         export LLAMACPP_PORT='$LLAMACPP_PORT'
         export MODELS_DIR='$MODELS_DIR'
-        python app.py
+        export WORKERS='$WORKERS'
+        export WORKER_THREADS='$WORKER_THREADS'
+        exec $server_cmd
     " > "$FLASK_LOG_FILE" 2>&1 &
 
     local pid=$!
     echo "$pid" > "$FLASK_PID_FILE"
 
-    # Wait for Flask to start
-    local max_attempts=15
+    # Wait for Flask to start; it listens well under a second after
+    # launch, so poll often rather than sleeping whole seconds
+    local max_attempts=60
     local attempt=1
 
     print_info "Waiting for Flask app to start..."
@@ -330,7 +364,7 @@ start_flask() {
             print_info "Web interface: http://$FLASK_HOST:$FLASK_PORT"
             return 0
         fi
-        sleep 2
+        sleep 0.5
         attempt=$((attempt + 1))
         printf "."
     done
@@ -355,8 +389,13 @@ start_monitor() {
         while true; do
             sleep $HEALTH_CHECK_INTERVAL
 
-            # Check llama.cpp server health
-            if [ -f '$LLAMACPP_PID_FILE' ]; then
+            # Check llama.cpp server health; a running Flask app restarts
+            # llama-server itself, so only step in when Flask is down too
+            flask_up=false
+            if [ -f '$FLASK_PID_FILE' ] && ps -p \$(cat '$FLASK_PID_FILE') > /dev/null 2>&1; then
+                flask_up=true
+            fi
+            if [ -f '$LLAMACPP_PID_FILE' ] && [ \$flask_up = false ]; then
                 pid=\$(cat '$LLAMACPP_PID_FILE')
                 if ! ps -p \$pid > /dev/null 2>&1; then
                     echo \"\$(date): llama.cpp server crashed, restarting...\" >> '$MONITOR_LOG_FILE'
@@ -394,10 +433,10 @@ stop_service() {
             print_info "Stopping $service_name (PID: $pid)..."
             kill "$pid"
 
-            # Wait for process to stop
+            # Wait up to 15 seconds for the process to stop
             local attempt=1
-            while [ $attempt -le 15 ] && ps -p "$pid" > /dev/null 2>&1; do
-                sleep 1
+            while [ $attempt -le 75 ] && ps -p "$pid" > /dev/null 2>&1; do
+                sleep 0.2
                 attempt=$((attempt + 1))
             done
 
@@ -458,6 +497,7 @@ stop_all_services() {
     # Kill Flask processes by name
     pkill -f "python.*app\.py" 2>/dev/null && print_info "Killed Python app.py processes" || true
     pkill -f "flask.*run" 2>/dev/null && print_info "Killed Flask run processes" || true
+    pkill -f "gunicorn.*app:app" 2>/dev/null && print_info "Killed gunicorn workers" || true
 
     # Verify Flask is stopped
     sleep 2
@@ -471,8 +511,9 @@ stop_all_services() {
         print_success "Flask application stopped"
     fi
 
-    # Stop llama.cpp server
+    # Stop llama.cpp server and the semantic search embedding server
     stop_service "$LLAMACPP_PID_FILE" "llama-server"
+    stop_service "$SCRIPT_DIR/llamacpp-embedding.pid" "Embedding server"
 
     # Final cleanup - kill any processes using llama.cpp port
     if command_exists lsof; then
@@ -806,6 +847,182 @@ download_model() {
     return 1
 }
 
+# Benchmark models (restarts llama-server once per model)
+benchmark_models() {
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    print_step "Benchmarking models (llama-server will be restarted for each model)..."
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        export LLAMACPP_HOST="$LLAMACPP_HOST"
+        export LLAMACPP_PORT="$LLAMACPP_PORT"
+        export MODELS_DIR="$MODELS_DIR"
+        export LLAMACPP_PID_FILE="$LLAMACPP_PID_FILE"
+        python app.py benchmark-models "$@"
+    )
+}
+
+# Read model files into the page cache so the next load is fast
+prefetch_models() {
+    if [ $# -eq 0 ]; then
+        print_error "Usage: $0 prefetch-model <model-filename> [...]"
+        return 1
+    fi
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    print_step "Prefetching model files into the page cache..."
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        export MODELS_DIR="$MODELS_DIR"
+        python app.py prefetch-model "$@"
+    )
+}
+
+# Choose hardware-aware llama-server launch parameters for models
+tune_models() {
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    print_step "Tuning llama-server launch parameters for this host..."
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        export LLAMACPP_HOST="$LLAMACPP_HOST"
+        export LLAMACPP_PORT="$LLAMACPP_PORT"
+        export MODELS_DIR="$MODELS_DIR"
+        export LLAMACPP_PID_FILE="$LLAMACPP_PID_FILE"
+        python app.py tune-model "$@"
+    )
+}
+
+# Embed new messages into the semantic search index
+embed_messages() {
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    print_step "Embedding messages for semantic search..."
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        export LLAMACPP_HOST="$LLAMACPP_HOST"
+        export MODELS_DIR="$MODELS_DIR"
+        export LLAMACPP_PID_FILE="$LLAMACPP_PID_FILE"
+        python app.py embed-messages "$@"
+    )
+}
+
+# Compress stored message contents and reclaim the space
+compress_messages() {
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    print_step "Compressing stored messages..."
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        python app.py compress-messages "$@"
+    )
+}
+
+# Write conversations as NDJSON (to stdout unless -o is given)
+export_conversations() {
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment" >&2
+        return 1
+    fi
+
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        python app.py export-conversations "$@"
+    )
+}
+
+# Import conversations from an NDJSON export
+import_conversations() {
+    if [ $# -eq 0 ]; then
+        print_error "Usage: $0 import-conversations <file|-> [--batch-size N] [--keep-indexes]"
+        return 1
+    fi
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    print_step "Importing conversations..."
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        python app.py import-conversations "$@"
+    )
+}
+
+# Move idle conversations into the archive databases
+archive_conversations() {
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    print_step "Archiving idle conversations..."
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        python app.py archive-conversations "$@"
+    )
+}
+
+# Run a JSONL file of prompts through llama-server, or list the batch jobs
+batch_run() {
+    if [ $# -eq 0 ]; then
+        print_error "Usage: $0 batch-run <file> [-o results] [--model M] [--concurrency N] | --resume ID | --list"
+        return 1
+    fi
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        if [ "$1" = "--list" ]; then
+            python app.py batch-jobs
+        else
+            python app.py batch-run "$@"
+        fi
+    )
+}
+
+# Write content-hashed, precompressed copies of the static files
+build_assets() {
+    if ! check_and_setup_venv; then
+        print_error "Failed to setup virtual environment"
+        return 1
+    fi
+
+    print_step "Building static assets..."
+    cd "$SCRIPT_DIR"
+    (
+        source venv/bin/activate
+        python app.py build-assets
+    )
+}
+
 # Enhanced help function
 show_help() {
     print_header
@@ -832,6 +1049,10 @@ show_help() {
     echo "  switch-model <filename>   Switch to different model (dynamic switching)"
     echo "  list-models               List all available models with details"
     echo "  download-model <url> <filename>  Download a new model"
+    echo "  benchmark-models [files]  Measure load time and tokens/sec of models"
+    echo "  tune-model [files] [--calibrate]  Pick threads/batch/ctx/mlock for this host"
+    echo "  prefetch-model <files>    Warm model files into the page cache"
+    echo "  embed-messages            Build the semantic search index"
     echo ""
     echo "MONITORING & LOGS:"
     echo "  logs [service] [lines]    Show recent logs (llamacpp, flask, monitor, all)"
@@ -843,6 +1064,12 @@ show_help() {
     echo "  setup-venv                Setup Python virtual environment"
     echo "  info                      Show system and configuration info"
     echo "  cleanup                   Clean up logs and temporary files"
+    echo "  compress-messages         Compress stored messages and VACUUM the database"
+    echo "  archive-conversations     Move idle conversations to archive databases"
+    echo "  build-assets              Hash and precompress static files (run by start)"
+    echo "  export-conversations [-o file] [--model M] [--since D] [--until D]  Export as NDJSON"
+    echo "  import-conversations <file>   Import an NDJSON export"
+    echo "  batch-run <file> [--model M] [--concurrency N]  Run a JSONL file of prompts (--resume ID, --list)"
     echo ""
     echo "ENHANCED FEATURES:"
     echo "  • Dynamic model switching without restart"
@@ -892,7 +1119,12 @@ main() {
             lsof -ti:$FLASK_PORT 2>/dev/null | xargs kill -9 2>/dev/null || true
             lsof -ti:$LLAMACPP_PORT 2>/dev/null | xargs kill -9 2>/dev/null || true
 
-            sleep 5  # Increase wait time
+            # Wait up to 5 seconds for the ports to be released
+            local attempt=1
+            while [ $attempt -le 25 ] && { port_in_use "$FLASK_PORT" || port_in_use "$LLAMACPP_PORT"; }; do
+                sleep 0.2
+                attempt=$((attempt + 1))
+            done
             start_llamacpp "$param2"
             start_flask
             start_monitor
@@ -941,6 +1173,36 @@ main() {
         "download-model")
             download_model "$param2" "$param3"
             ;;
+        "benchmark-models"|"benchmark")
+            benchmark_models "${@:2}"
+            ;;
+        "tune-model"|"tune")
+            tune_models "${@:2}"
+            ;;
+        "prefetch-model"|"prefetch")
+            prefetch_models "${@:2}"
+            ;;
+        "embed-messages"|"embed")
+            embed_messages "${@:2}"
+            ;;
+        "compress-messages"|"compress")
+            compress_messages "${@:2}"
+            ;;
+        "archive-conversations"|"archive")
+            archive_conversations "${@:2}"
+            ;;
+        "build-assets"|"assets")
+            build_assets
+            ;;
+        "export-conversations"|"export")
+            export_conversations "${@:2}"
+            ;;
+        "import-conversations"|"import")
+            import_conversations "${@:2}"
+            ;;
+        "batch-run"|"batch")
+            batch_run "${@:2}"
+            ;;
         "test")
             test_installation
             ;;
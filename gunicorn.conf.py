@@ -0,0 +1,33 @@
+"""gunicorn settings for running llama-chat with several worker processes.
+
+./chat-manager.sh start uses them when WORKERS is greater than 1:
+
+    gunicorn --config gunicorn.conf.py app:app
+
+Workers coordinate llama.cpp server switches and restarts through a lock
+file and a shared state file (see LlamaCppManager in app.py).
+"""
+import os
+
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', '3000')}"
+workers = int(os.getenv('WORKERS', '2'))
+
+# Threads keep a worker responsive while some of its requests wait for
+# long generations or stream server-sent events (at most
+# health.max_event_streams of them per worker, see config.json)
+worker_class = 'gthread'
+threads = int(os.getenv('WORKER_THREADS', '8'))
+
+# gthread workers keep notifying the master while requests run, so this
+# only restarts hung workers, not slow generations or model switches
+timeout = 120
+graceful_timeout = 30
+
+# Every worker imports the app itself: its logging and background threads
+# would not survive a fork from the master
+preload_app = False
+
+
+def post_worker_init(worker):
+    from app import init_worker
+    init_worker()
@@ -12,6 +12,7 @@ let isLoading = false;
 let isModelSwitching = false;
 let messageStartTime = null;
 let hasEnhancedBackend = false;
+let lastPrefetchRequest = 0;
 
 // Initialize marked with options
 function initializeMarked() {
@@ -187,7 +188,17 @@ function updateModelSelectUI() {
         option.value = model.name;
 
         if (hasEnhancedBackend && model.size_mb > 0) {
-            option.textContent = `${model.name} (${model.size_mb}MB)`;
+            const details = [`${model.size_mb}MB`];
+            if (model.benchmark && model.benchmark.generation_tokens_per_second) {
+                details.push(`${model.benchmark.generation_tokens_per_second.toFixed(1)} tok/s`);
+            }
+            if (model.speculative && model.speculative.enabled && model.speculative.draft_model_file) {
+                details.push('⚡');
+            }
+            option.textContent = `${model.name} (${details.join(', ')})`;
+            if (model.benchmark) {
+                option.title = formatBenchmarkTitle(model.benchmark);
+            }
         } else {
             option.textContent = model.name;
         }
@@ -201,6 +212,100 @@ function updateModelSelectUI() {
     });
 
     updateCurrentModelDisplay();
+    updateSpeculativeToggle();
+}
+
+// Find the model list entry of the currently loaded model
+function getCurrentModelInfo() {
+    if (!currentModel) {
+        return null;
+    }
+    return availableModels.find(m =>
+        currentModel === m.name || currentModel.includes(m.name.replace('.gguf', ''))
+    ) || null;
+}
+
+// Show the speculative decoding switch for the current model if it has a draft
+function updateSpeculativeToggle() {
+    const toggle = document.getElementById('speculativeToggle');
+    const checkbox = document.getElementById('speculativeCheckbox');
+    if (!toggle || !checkbox) {
+        return;
+    }
+
+    const model = getCurrentModelInfo();
+    const speculative = model && model.speculative;
+    if (!hasEnhancedBackend || !speculative || !speculative.draft_model_file) {
+        toggle.style.display = 'none';
+        return;
+    }
+
+    toggle.style.display = 'flex';
+    checkbox.checked = speculative.enabled;
+    checkbox.disabled = isModelSwitching;
+    toggle.classList.toggle('disabled', isModelSwitching);
+
+    const lines = [`Draft model: ${speculative.draft_model_file}`];
+    const stats = speculative.stats.find(s => s.draft_model_file === speculative.draft_model_file);
+    if (stats) {
+        if (stats.acceptance_rate !== null) {
+            lines.push(`Acceptance rate: ${(stats.acceptance_rate * 100).toFixed(0)}%`);
+        }
+        if (stats.speedup !== null) {
+            lines.push(`Speedup: ${stats.speedup.toFixed(2)}x (${stats.tokens_per_second.toFixed(1)} vs ${stats.baseline_tokens_per_second.toFixed(1)} tok/s)`);
+        }
+    }
+    toggle.title = lines.join('\n');
+}
+
+// Turn speculative decoding on or off for the current model (restarts llama-server)
+async function toggleSpeculative(enabled) {
+    const model = getCurrentModelInfo();
+    if (!model) {
+        return;
+    }
+
+    try {
+        showModelSwitching(true);
+        const response = await fetch(`/api/models/speculative/${encodeURIComponent(model.name)}`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ enabled })
+        });
+        const data = await response.json();
+
+        if (!response.ok || !data.success) {
+            throw new Error(data.error || 'Failed to update speculative decoding');
+        }
+
+        model.speculative = data.speculative;
+        showNotification(`Speculative decoding ${enabled ? 'enabled' : 'disabled'} for ${model.name}`, 'success');
+    } catch (error) {
+        console.error('Error updating speculative decoding:', error);
+        showNotification(`Failed to update speculative decoding: ${error.message}`, 'error');
+    } finally {
+        showModelSwitching(false);
+        updateModelSelectUI();
+    }
+}
+
+// Describe benchmark results for a model tooltip
+function formatBenchmarkTitle(benchmark) {
+    const lines = [];
+    if (benchmark.generation_tokens_per_second) {
+        lines.push(`Generation: ${benchmark.generation_tokens_per_second.toFixed(1)} tok/s`);
+    }
+    if (benchmark.prompt_tokens_per_second) {
+        lines.push(`Prompt eval: ${benchmark.prompt_tokens_per_second.toFixed(1)} tok/s`);
+    }
+    if (benchmark.load_time_ms) {
+        lines.push(`Load time: ${(benchmark.load_time_ms / 1000).toFixed(1)}s`);
+    }
+    if (benchmark.peak_rss_mb) {
+        lines.push(`Peak memory: ${Math.round(benchmark.peak_rss_mb)}MB`);
+    }
+    lines.push(`Benchmarked: ${benchmark.created_at}`);
+    return lines.join('\n');
 }
 
 // Update current model display
@@ -394,6 +499,21 @@ async function onModelChange() {
     }
 }
 
+// Warm the models the user is likely to switch to while they pick one
+function prefetchLikelyModels() {
+    const now = Date.now();
+    if (!hasEnhancedBackend || isModelSwitching || now - lastPrefetchRequest < 60000) {
+        return;
+    }
+    lastPrefetchRequest = now;
+
+    fetch('/api/models/prefetch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ predict: true })
+    }).catch(error => console.log('Model prefetch request failed:', error));
+}
+
 // Fixed loadConversations function
 async function loadConversations() {
     try {
@@ -425,8 +545,12 @@ async function loadConversations() {
 
         data.conversations.forEach(conv => {
             const div = document.createElement('div');
-            div.className = 'conversation-item';
-            div.onclick = () => loadConversation(conv.id);
+            div.className = conv.archived ? 'conversation-item archived' : 'conversation-item';
+            div.onclick = async () => {
+                await loadConversation(conv.id);
+                // Opening moved it back from the archive
+                if (conv.archived) await loadConversations();
+            };
 
             const date = new Date(conv.updated_at).toLocaleDateString();
 
@@ -437,7 +561,7 @@ async function loadConversations() {
 
             div.innerHTML = `
                 <div class="conversation-title" data-conv-id="${conv.id}" onclick="event.stopPropagation();" ondblclick="startRename(${conv.id})">${escapeHtml(conv.title)}</div>
-                <div class="conversation-meta">${modelDisplay} • ${date}</div>
+                <div class="conversation-meta">${conv.archived ? '<span title="Archived; restored when opened">📦</span> ' : ''}${modelDisplay} • ${date}</div>
                 <div class="conversation-actions">
                     <button class="conversation-edit" onclick="event.stopPropagation(); startRename(${conv.id})" title="Rename">✏</button>
                     <button class="conversation-delete" onclick="event.stopPropagation(); deleteConversation(${conv.id})" title="Delete">×</button>
@@ -619,7 +743,8 @@ async function loadConversation(conversationId) {
                     message.timestamp,
                     message.response_time_ms,
                     message.estimated_tokens,
-                    hasEnhancedBackend ? message.model_file : null
+                    hasEnhancedBackend ? message.model_file : null,
+                    message
                 );
             });
         }
@@ -685,6 +810,15 @@ async function sendMessage() {
         const data = await response.json();
         const responseTime = messageStartTime ? Date.now() - messageStartTime : 0;
 
+        // Rate limited or failed: show the server's reason
+        if (!response.ok) {
+            loadingDiv.remove();
+            const reason = data.error || `HTTP ${response.status}`;
+            addMessageToChat('assistant', `Error: ${reason}`);
+            showNotification(reason, 'error');
+            return;
+        }
+
         loadingDiv.remove();
 
         addMessageToChat(
@@ -694,7 +828,8 @@ async function sendMessage() {
             null,
             responseTime,
             data.estimated_tokens,
-            hasEnhancedBackend ? data.model_file : null
+            hasEnhancedBackend ? data.model_file : null,
+            data.message_id ? { ...data.metrics, id: data.message_id } : data.metrics
         );
 
         if (hasEnhancedBackend && data.model_file && data.model_file !== currentModel) {
@@ -720,8 +855,63 @@ async function sendMessage() {
     }
 }
 
+// Answer a message again as a new branch
+async function regenerateMessage(messageId) {
+    if (isLoading || isModelSwitching || !currentConversationId) return;
+
+    isLoading = true;
+    const loadingDiv = document.createElement('div');
+    loadingDiv.className = 'loading';
+    loadingDiv.textContent = 'Regenerating...';
+    document.getElementById('chatContainer').appendChild(loadingDiv);
+    scrollToBottom();
+
+    try {
+        const response = await fetch(
+            `/api/conversations/${currentConversationId}/messages/${messageId}/regenerate`,
+            {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ model: document.getElementById('modelSelect').value })
+            }
+        );
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            throw new Error(data.error || 'Regenerate failed');
+        }
+        await loadConversation(currentConversationId);
+    } catch (error) {
+        console.error('Regenerate error:', error);
+        showNotification(`Failed to regenerate: ${error.message}`, 'error');
+    } finally {
+        loadingDiv.remove();
+        isLoading = false;
+    }
+}
+
+// Show another version of a message and the conversation that follows it
+async function switchBranch(messageId) {
+    if (!messageId || isLoading || !currentConversationId) return;
+
+    try {
+        const response = await fetch(`/api/conversations/${currentConversationId}/branch`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ message_id: messageId })
+        });
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            throw new Error(data.error || 'Failed to switch branch');
+        }
+        await loadConversation(currentConversationId);
+    } catch (error) {
+        console.error('Branch switch error:', error);
+        showNotification(`Failed to switch branch: ${error.message}`, 'error');
+    }
+}
+
 // Add message to chat
-function addMessageToChat(role, content, model = null, timestamp = null, responseTime = null, tokens = null, modelFile = null) {
+function addMessageToChat(role, content, model = null, timestamp = null, responseTime = null, tokens = null, modelFile = null, timings = null) {
     const chatContainer = document.getElementById('chatContainer');
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${role}`;
@@ -748,16 +938,46 @@ function addMessageToChat(role, content, model = null, timestamp = null, respons
         }
         if (tokens) {
             stats.push(`~${tokens} tokens`);
-            if (responseTime) {
+            if (timings && timings.predicted_per_second) {
+                stats.push(`${timings.predicted_per_second.toFixed(1)} tok/s`);
+            } else if (responseTime) {
                 const tokensPerSecond = (tokens / (responseTime / 1000)).toFixed(1);
                 stats.push(`${tokensPerSecond} tok/s`);
             }
         }
+        // Prompt evaluation breakdown reported by llama-server
+        if (timings && timings.prompt_tokens) {
+            let promptStat = `prompt ${timings.prompt_tokens} tok`;
+            if (timings.cached_tokens) {
+                promptStat += ` (${timings.cached_tokens} cached)`;
+            }
+            if (timings.prompt_ms) {
+                promptStat += ` in ${(timings.prompt_ms / 1000).toFixed(2)}s`;
+            }
+            stats.push(promptStat);
+        }
         if (stats.length > 0) {
             combinedMeta += ` • <span class="meta-stats">${stats.join(' • ')}</span>`;
         }
     }
 
+    // Branch navigation and regenerate, for messages stored in the tree
+    if (timings && timings.id) {
+        const siblings = timings.sibling_ids || [timings.id];
+        if (siblings.length > 1) {
+            const index = siblings.indexOf(timings.id);
+            const previous = index > 0 ? siblings[index - 1] : null;
+            const next = index < siblings.length - 1 ? siblings[index + 1] : null;
+            combinedMeta += ` • <span class="branch-nav">` +
+                `<button onclick="switchBranch(${previous})" ${previous ? '' : 'disabled'} title="Previous version">‹</button>` +
+                `${index + 1}/${siblings.length}` +
+                `<button onclick="switchBranch(${next})" ${next ? '' : 'disabled'} title="Next version">›</button></span>`;
+        }
+        if (role === 'assistant') {
+            combinedMeta += ` <button class="regenerate-btn" onclick="regenerateMessage(${timings.id})" title="Regenerate response">🔄</button>`;
+        }
+    }
+
     let contentHtml;
     if (role === 'assistant') {
         try {
@@ -1149,46 +1369,88 @@ function estimateTokens(text) {
 }
 
 // Server health monitoring
-async function checkServerHealth() {
-    try {
-        const status = await checkServerStatus();
-        const statusIndicators = document.querySelectorAll('.server-status');
-        const statusText = document.getElementById('serverStatusText');
-
-        statusIndicators.forEach(indicator => {
-            if (status.server_running) {
-                indicator.className = 'server-status online';
-                indicator.title = `Server online${status.current_model ? ' - ' + status.current_model : ''}`;
-            } else {
-                indicator.className = 'server-status offline';
-                indicator.title = 'Server offline';
-            }
-        });
+const SERVER_STATES = {
+    healthy: { label: 'Online', color: '#238636', className: 'online' },
+    loading: { label: 'Loading model', color: '#d29922', className: 'busy' },
+    switching: { label: 'Switching model', color: '#d29922', className: 'busy' },
+    benchmarking: { label: 'Benchmarking', color: '#d29922', className: 'busy' },
+    restarting: { label: 'Restarting', color: '#d29922', className: 'busy' },
+    unhealthy: { label: 'Unhealthy', color: '#da3633', className: 'offline' },
+    down: { label: 'Offline', color: '#da3633', className: 'offline' }
+};
+
+function applyServerStatus(status) {
+    const state = SERVER_STATES[status.state] ||
+        (status.server_running ? SERVER_STATES.healthy : SERVER_STATES.down);
+    const statusIndicators = document.querySelectorAll('.server-status');
+    const statusText = document.getElementById('serverStatusText');
+    const modelIndicator = document.getElementById('modelStatusIndicator');
+
+    statusIndicators.forEach(indicator => {
+        indicator.className = `server-status ${state.className}`;
+        indicator.title = `Server ${state.label.toLowerCase()}` +
+            (status.current_model ? ` - ${status.current_model}` : '') +
+            (status.last_error ? ` (${status.last_error})` : '');
+    });
 
-        if (statusText) {
-            statusText.textContent = status.server_running ? 'Online' : 'Offline';
-            statusText.style.color = status.server_running ? '#238636' : '#da3633';
+    if (modelIndicator && !isModelSwitching) {
+        if (status.server_running && status.current_model) {
+            modelIndicator.className = 'model-status-indicator';
+            modelIndicator.title = `Model loaded: ${status.current_model}`;
+        } else {
+            modelIndicator.className = 'model-status-indicator offline';
+            modelIndicator.title = 'No model loaded';
         }
+    }
 
+    if (statusText) {
+        statusText.textContent = state.label;
+        statusText.style.color = state.color;
+    }
+}
+
+async function checkServerHealth() {
+    try {
+        const status = await checkServerStatus();
+        applyServerStatus(status);
         return status.server_running;
     } catch (error) {
         console.error('Health check failed:', error);
+        applyServerStatus({ state: 'down', last_error: 'Connection error' });
+        return false;
+    }
+}
 
-        const statusIndicators = document.querySelectorAll('.server-status');
-        const statusText = document.getElementById('serverStatusText');
-
-        statusIndicators.forEach(indicator => {
-            indicator.className = 'server-status offline';
-            indicator.title = 'Connection error';
-        });
+let serverHealthTimer = null;
 
-        if (statusText) {
-            statusText.textContent = 'Error';
-            statusText.style.color = '#da3633';
-        }
+function pollServerHealth() {
+    if (!serverHealthTimer) {
+        serverHealthTimer = setInterval(checkServerHealth, 30000); // Check every 30 seconds
+    }
+}
 
+function subscribeServerEvents() {
+    if (!window.EventSource) {
         return false;
     }
+
+    const source = new EventSource('/api/server/events');
+    source.addEventListener('status', event => {
+        applyServerStatus(JSON.parse(event.data));
+    });
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            // Refused, e.g. too many open streams: poll instead
+            pollServerHealth();
+            checkServerHealth();
+            return;
+        }
+        // EventSource reconnects by itself; show the gap meanwhile
+        if (source.readyState !== EventSource.OPEN) {
+            applyServerStatus({ state: 'down', last_error: 'Connection lost' });
+        }
+    };
+    return true;
 }
 
 // Event listeners
@@ -1209,13 +1471,15 @@ document.addEventListener('DOMContentLoaded', function() {
     const modelSelect = document.getElementById('modelSelect');
     if (modelSelect) {
         modelSelect.addEventListener('change', onModelChange);
+        modelSelect.addEventListener('focus', prefetchLikelyModels);
     }
 
-    // Start periodic health checks
-    setInterval(checkServerHealth, 30000); // Check every 30 seconds
-
-    // Initial health check
-    setTimeout(checkServerHealth, 2000);
+    // Status changes are pushed by the server; poll only without EventSource
+    // or when the server refuses the stream
+    checkServerHealth();
+    if (!subscribeServerEvents()) {
+        pollServerHealth();
+    }
 });
 
 // Initialize app when page loads